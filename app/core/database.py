@@ -1,7 +1,35 @@
-from sqlmodel import SQLModel, create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlmodel import create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 from .config import settings
 
-engine = create_engine(settings.DATABASE_URL, echo=False)
+engine = create_engine(
+    settings.DATABASE_URL,
+    echo=False,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=True,  # drop dead MySQL connections before handing them out
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    isolation_level=settings.DB_ISOLATION_LEVEL,
+)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+# Async engine for handlers that must not block the event loop.
+# Same database as DATABASE_URL, but driven through aiomysql instead of pymysql.
+ASYNC_DATABASE_URL = make_url(settings.DATABASE_URL).set(drivername="mysql+aiomysql")
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=False,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    isolation_level=settings.DB_ISOLATION_LEVEL,
+)
+
+# expire_on_commit=False: attribute access after commit would otherwise trigger
+# an implicit (and, under asyncio, illegal) lazy refresh.
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
@@ -0,0 +1,79 @@
+import os
+import re
+import stat
+import mimetypes
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+# e.g. app.3f9a1c2b.js / style.3f9a1c2b.css — fingerprinted, safe to cache forever
+_HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.[^./]+$")
+
+# Precompressed siblings written by compress_static.py, in order of preference
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    """Our codings that an Accept-Encoding header allows: listed (or covered by '*') with q > 0."""
+    qvalues = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+    wildcard = qvalues.get("*", 0.0)
+    return {encoding for encoding, _ in _ENCODINGS if qvalues.get(encoding, wildcard) > 0}
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves `<file>.br` / `<file>.gz` when the client accepts it,
+    and sets Cache-Control: immutable for content-hashed names, short max-age otherwise.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await self._precompressed_response(path, scope)
+        if response is None:
+            response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = self._cache_control(path)
+        return response
+
+    async def _precompressed_response(self, path: str, scope: Scope):
+        request_headers = Headers(scope=scope)
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding, suffix in _ENCODINGS:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat_result and stat.S_ISREG(stat_result.st_mode):
+                media_type = mimetypes.guess_type(path)[0] or "text/plain"
+                response = FileResponse(full_path, stat_result=stat_result, media_type=media_type)
+                response.headers["Content-Encoding"] = encoding
+                response.headers["Vary"] = "Accept-Encoding"
+                # Same conditional-request handling as StaticFiles.file_response
+                if self.is_not_modified(response.headers, request_headers):
+                    return NotModifiedResponse(response.headers)
+                return response
+        return None
+
+    @staticmethod
+    def _cache_control(path: str) -> str:
+        if path.replace(os.sep, "/").startswith("screenshots/"):
+            # Overwritten in place on every capture
+            return "no-cache"
+        if _HASHED_NAME.search(path):
+            return "public, max-age=31536000, immutable"
+        return "public, max-age=300"
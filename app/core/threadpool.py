@@ -0,0 +1,31 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from app.core.config import settings
+
+# Multi-second vmrun operations (snapshots, clones, VM deletion) queue here among themselves,
+# so quick calls on the default executor never wait behind them. Shut down in main.py lifespan.
+vmrun_pool = ThreadPoolExecutor(max_workers=settings.VMRUN_POOL_WORKERS, thread_name_prefix="vmrun")
+
+
+def _submit(executor, func, args, kwargs):
+    loop = asyncio.get_running_loop()
+    if kwargs:
+        return loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    return loop.run_in_executor(executor, func, *args)
+
+
+async def run_bare(func, *args, **kwargs):
+    """
+    Run a blocking call on the event loop's default executor.
+
+    Unlike starlette's run_in_threadpool this skips the contextvars copy and the
+    anyio hop, and only builds a partial when there are keyword arguments. Use it for
+    self-contained calls (the vmrun wrappers in VMService) that don't read request context.
+    """
+    return await _submit(None, func, args, kwargs)
+
+
+async def run_vmrun(func, *args, **kwargs):
+    """run_bare for the slow vmrun operations, on the dedicated vmrun_pool."""
+    return await _submit(vmrun_pool, func, args, kwargs)
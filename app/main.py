@@ -1,134 +1,194 @@
+import os
+import queue
 import asyncio
-from datetime import datetime, timedelta
+import logging
+import tempfile
+import anyio.to_thread
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime
+from types import MappingProxyType
 from fastapi import FastAPI, Depends, Request
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from sqlmodel import Session, select
-from app.core.database import create_db_and_tables, engine
+from jinja2 import FileSystemBytecodeCache
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from sqlmodel import select, update, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from app.core.database import AsyncSessionLocal, async_engine
 from app.routers import auth, admin, vm, network
 import app.routers.scheduled_tasks as scheduled_tasks
 from app.routers.scheduled_tasks import run_scheduler
 from app.models.user import User, Role
 from app.models.vm import VM
-from app.models.scheduled_task import ScheduledTask  # noqa: F401 — ensures table is created
 from app.core.security import get_password_hash
-from app.services.notification_service import notification_service
+from app.services.notification_service import notification_service, WORKER_COUNT
+from app.services.audit_queue import audit_queue
+from app.services.job_queue import job_queue, WORKER_COUNT as JOB_WORKER_COUNT
+from app.core.config import settings
+from app.core.static_files import PrecompressedStaticFiles
+from app.core.threadpool import vmrun_pool
 from contextlib import asynccontextmanager
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+
+scheduler = AsyncIOScheduler()
+
+# app.* loggers only enqueue records; a listener thread does the stderr writes,
+# so a slow console never stalls a request. Started/stopped in lifespan.
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_app_logger = logging.getLogger("app")
+_app_logger.addHandler(QueueHandler(_log_queue))
+_app_logger.setLevel(logging.INFO if settings.DEBUG else logging.WARNING)
+_app_logger.propagate = False
+
+# Expiration alert payloads, built once at import. Only {vm_name}, {vm_id} and
+# {expiration} are filled in per VM; fields are (name, value, inline) tuples.
+_ALERT_TEMPLATES = {
+    30: MappingProxyType({
+        "title": "📅 Service Expiration Notice",
+        "description": "Your service for VM **{vm_name}** is expiring in 30 days.",
+        "color": 3447003, # Blue
+        "fields": (("VM ID", "{vm_id}", True), ("Expiration Date", "{expiration}", True), ("Status", "Active", True)),
+    }),
+    7: MappingProxyType({
+        "title": "⚠️ Service Expiration Warning",
+        "description": "Your service for VM **{vm_name}** is expiring in 1 week.",
+        "color": 15105570, # Orange
+        "fields": (("VM ID", "{vm_id}", True), ("Expiration Date", "{expiration}", True), ("Time Remaining", "7 Days", True)),
+    }),
+    3: MappingProxyType({
+        "title": "⚠️ Service Expiration Warning",
+        "description": "Your service for VM **{vm_name}** is expiring in 3 days.",
+        "color": 15105570, # Orange
+        "fields": (("VM ID", "{vm_id}", True), ("Expiration Date", "{expiration}", True), ("Time Remaining", "3 Days", True)),
+    }),
+    1: MappingProxyType({
+        "title": "🚨 Urgent: Service Expiring Tomorrow",
+        "description": "Your service for VM **{vm_name}** expires tomorrow!",
+        "color": 15158332, # Red
+        "fields": (("VM ID", "{vm_id}", True), ("Expiration Date", "{expiration}", True), ("Action Required", "Please renew immediately", False)),
+    }),
+    0: MappingProxyType({
+        "title": "🚨 Service Expiring Today",
+        "description": "Your service for VM **{vm_name}** expires TODAY.",
+        "color": 15158332, # Red
+        "fields": (("VM ID", "{vm_id}", True), ("Expiration Date", "{expiration}", True), ("Status", "Expiring Now", True)),
+    }),
+    -1: MappingProxyType({
+        "title": "❌ Service Expired",
+        "description": "The service for VM **{vm_name}** has EXPIRED.",
+        "color": 0, # Black
+        "fields": (("VM ID", "{vm_id}", True), ("Expired On", "{expiration}", True), ("Status", "Suspended", True)),
+    }),
+}
+
+def _render_alert(tmpl, vm_id: int, vm_name: str, expiration: str) -> dict:
+    values = {"vm_id": vm_id, "vm_name": vm_name, "expiration": expiration}
+    return {
+        "title": tmpl["title"],
+        "description": tmpl["description"].format(**values),
+        "color": tmpl["color"],
+        "fields": [
+            {"name": name, "value": value.format(**values), "inline": inline}
+            for name, value, inline in tmpl["fields"]
+        ],
+    }
+
+# Max expiration alerts in flight at once
+ALERT_CONCURRENCY = 5
+
+# days_left -> alert threshold. Thresholds span a few days so an alert still
+# fires if the server was down on the exact day.
+_THRESHOLD_FOR_DAYS = {
+    30: 30, 29: 30, 28: 30,
+    7: 7, 6: 7,
+    3: 3, 2: 3,
+    1: 1,
+    0: 0,
+    -1: -1, -2: -1,
+}
 
 async def check_expiring_vms():
-    while True:
-        try:
-            with Session(engine) as session:
-                vms = session.exec(select(VM).where(VM.expiration_date != None)).all()
-                now = datetime.utcnow()
+    """
+    Daily expiration sweep (scheduled by APScheduler in lifespan).
+    Each VM gets at most one alert per threshold: the last threshold sent is
+    persisted in VM.last_notified_threshold, so restarts neither repeat nor skip alerts.
+    """
+    try:
+        async with AsyncSessionLocal() as session:
+            # Day arithmetic happens in MySQL; only VMs due an alert today come back.
+            # The ADDDATE/SUBDATE range is a range scan on ix_vm_expiration_date_id, which
+            # also holds every selected column (covering index — no clustered-row reads).
+            days_left = func.datediff(VM.expiration_date, func.current_date()).label("days_left")
+            result = await session.exec(
+                select(VM.id, VM.name, VM.expiration_date, VM.last_notified_threshold, days_left)
+                .where(VM.expiration_date >= func.subdate(func.current_date(), 2))
+                .where(VM.expiration_date < func.adddate(func.current_date(), 31))
+                .where(days_left.in_(list(_THRESHOLD_FOR_DAYS)))
+            )
+            
+            # Plain rows (id, name, expiration_date, ...): no VM instances are hydrated
+            due = []  # (vm_id, threshold, alert)
+            for row in result.all():
+                threshold = _THRESHOLD_FOR_DAYS[row.days_left]
+                # Already alerted for this (or a later) threshold
+                if row.last_notified_threshold is not None and row.last_notified_threshold <= threshold:
+                    continue
                 
-                for vm in vms:
-                    if not vm.expiration_date:
-                        continue
-                        
-                    days_left = (vm.expiration_date - now).days
-                    
-                    # Use <= so notifications still fire if server was down on the exact day
-                    notification_data = None
-                    
-                    if 28 <= days_left <= 30:
-                        notification_data = {
-                            "title": "📅 Service Expiration Notice",
-                            "description": f"Your service for VM **{vm.name}** is expiring in 30 days.",
-                            "color": 3447003, # Blue
-                            "fields": [
-                                {"name": "VM ID", "value": str(vm.id), "inline": True},
-                                {"name": "Expiration Date", "value": vm.expiration_date.strftime("%Y-%m-%d"), "inline": True},
-                                {"name": "Status", "value": "Active", "inline": True}
-                            ]
-                        }
-                    elif 6 <= days_left <= 7:
-                        notification_data = {
-                            "title": "⚠️ Service Expiration Warning",
-                            "description": f"Your service for VM **{vm.name}** is expiring in 1 week.",
-                            "color": 15105570, # Orange
-                            "fields": [
-                                {"name": "VM ID", "value": str(vm.id), "inline": True},
-                                {"name": "Expiration Date", "value": vm.expiration_date.strftime("%Y-%m-%d"), "inline": True},
-                                {"name": "Time Remaining", "value": "7 Days", "inline": True}
-                            ]
-                        }
-                    elif 2 <= days_left <= 3:
-                        notification_data = {
-                            "title": "⚠️ Service Expiration Warning",
-                            "description": f"Your service for VM **{vm.name}** is expiring in 3 days.",
-                            "color": 15105570, # Orange
-                            "fields": [
-                                {"name": "VM ID", "value": str(vm.id), "inline": True},
-                                {"name": "Expiration Date", "value": vm.expiration_date.strftime("%Y-%m-%d"), "inline": True},
-                                {"name": "Time Remaining", "value": "3 Days", "inline": True}
-                            ]
-                        }
-                    elif days_left == 1:
-                        notification_data = {
-                            "title": "🚨 Urgent: Service Expiring Tomorrow",
-                            "description": f"Your service for VM **{vm.name}** expires tomorrow!",
-                            "color": 15158332, # Red
-                            "fields": [
-                                {"name": "VM ID", "value": str(vm.id), "inline": True},
-                                {"name": "Expiration Date", "value": vm.expiration_date.strftime("%Y-%m-%d"), "inline": True},
-                                {"name": "Action Required", "value": "Please renew immediately", "inline": False}
-                            ]
-                        }
-                    elif days_left <= 0 and days_left > -2:
-                        notification_data = {
-                            "title": "🚨 Service Expiring Today",
-                            "description": f"Your service for VM **{vm.name}** expires TODAY.",
-                            "color": 15158332, # Red
-                            "fields": [
-                                {"name": "VM ID", "value": str(vm.id), "inline": True},
-                                {"name": "Expiration Date", "value": vm.expiration_date.strftime("%Y-%m-%d"), "inline": True},
-                                {"name": "Status", "value": "Expiring Now", "inline": True}
-                            ]
-                        }
-                    elif days_left <= -1 and days_left > -3:
-                        notification_data = {
-                            "title": "❌ Service Expired",
-                            "description": f"The service for VM **{vm.name}** has EXPIRED.",
-                            "color": 0, # Black
-                            "fields": [
-                                {"name": "VM ID", "value": str(vm.id), "inline": True},
-                                {"name": "Expired On", "value": vm.expiration_date.strftime("%Y-%m-%d"), "inline": True},
-                                {"name": "Status", "value": "Suspended", "inline": True}
-                            ]
-                        }
-                    
-                    if notification_data:
-                        await notification_service.send_discord_alert(
-                            title=notification_data["title"],
-                            description=notification_data["description"],
-                            color=notification_data["color"],
-                            fields=notification_data["fields"]
-                        )
-                        
-        except Exception as e:
-            print(f"Error in expiration checker: {e}")
+                due.append((row.id, threshold, _render_alert(
+                    _ALERT_TEMPLATES[threshold], row.id, row.name, row.expiration_date.strftime("%Y-%m-%d")
+                )))
+            
+            # Fan out over the shared keep-alive client, a few at a time to stay
+            # under Discord's webhook rate limit
+            sem = asyncio.Semaphore(ALERT_CONCURRENCY)
+            async def _send(alert: dict):
+                async with sem:
+                    return await notification_service.send_discord_alert(**alert)
+            results = await asyncio.gather(*(_send(alert) for _, _, alert in due), return_exceptions=True)
+            
+            # Only delivered alerts are recorded; a failed one is retried on the next sweep
+            notified = {}
+            for (vm_id, threshold, alert), outcome in zip(due, results):
+                if isinstance(outcome, Exception):
+                    print(f"Error sending expiration alert '{alert['description']}': {outcome}")
+                elif outcome:
+                    notified.setdefault(threshold, []).append(vm_id)
             
-        # Check every 24 hours
-        await asyncio.sleep(86400)
+            for threshold, vm_ids in notified.items():
+                await session.execute(
+                    update(VM).where(VM.id.in_(vm_ids)).values(last_notified_threshold=threshold)
+                )
+            await session.commit()
+                    
+    except Exception as e:
+        print(f"Error in expiration checker: {e}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
+    _log_listener.start()
+    # Schema is managed by Alembic (`alembic upgrade head`), not created at startup
     # Create default admin if not exists
-    with Session(engine) as session:
-        user = session.exec(select(User).where(User.username == "admin")).first()
-        if not user:
-            hashed_pwd = get_password_hash("admin")
-            admin_user = User(username="admin", hashed_password=hashed_pwd, role=Role.ADMIN)
-            session.add(admin_user)
-            session.commit()
-            print("Default admin user created: admin / admin — CHANGE THIS PASSWORD IMMEDIATELY")
+    async with AsyncSessionLocal() as session:
+        # Cheap unique-index probe first so bcrypt only runs on a fresh install;
+        # the upsert stays idempotent when several workers boot at once
+        admin_id = await session.scalar(select(User.id).where(User.username == "admin").limit(1))
+        if admin_id is None:
+            # Ship a precomputed hash in DEFAULT_ADMIN_HASH to skip bcrypt entirely
+            admin_hash = settings.DEFAULT_ADMIN_HASH or await asyncio.to_thread(get_password_hash, "admin")
+            stmt = mysql_insert(User).values(username="admin", hashed_password=admin_hash, role=Role.ADMIN, is_active=True)
+            stmt = stmt.on_duplicate_key_update(username=stmt.inserted.username)
+            result = await session.execute(stmt)
+            await session.commit()
+            if result.rowcount == 1:
+                print("Default admin user created: admin / admin — CHANGE THIS PASSWORD IMMEDIATELY")
         
         # Clear any stuck task states from a previous crash
         # If the server died mid-reinstall, VMs would be permanently frozen in the UI
-        stuck_vms = session.exec(select(VM).where(VM.task_state != None)).all()
+        stuck_vms = (await session.exec(select(VM).where(VM.task_state != None))).all()
         if stuck_vms:
             print(f"Clearing {len(stuck_vms)} stuck task(s) from previous session...")
             for vm in stuck_vms:
@@ -136,30 +196,75 @@ async def lifespan(app: FastAPI):
                 vm.task_message = "Interrupted — server restarted"
                 vm.task_progress = 0
                 session.add(vm)
-            session.commit()
+            await session.commit()
 
         # Clear any scheduled tasks stuck in RUNNING state from a previous crash
         from app.models.scheduled_task import ScheduledTask, TaskStatus
-        stuck_tasks = session.exec(select(ScheduledTask).where(ScheduledTask.status == TaskStatus.RUNNING)).all()
+        stuck_tasks = (await session.exec(select(ScheduledTask).where(ScheduledTask.status == TaskStatus.RUNNING))).all()
         if stuck_tasks:
             print(f"Clearing {len(stuck_tasks)} stuck scheduled task(s) from previous session...")
             for t in stuck_tasks:
                 t.status = TaskStatus.FAILED
                 t.result_message = "Interrupted — server restarted"
                 session.add(t)
-            session.commit()
+            await session.commit()
     
     # Start background tasks
-    asyncio.create_task(check_expiring_vms())
+    # Python 3.12+: run new tasks eagerly until their first real suspension point,
+    # saving a scheduler hop for coroutines that short-circuit (e.g. no webhook configured)
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    # Thread capacity for blocking calls: starlette/anyio caps run_in_threadpool at 40 by default
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=settings.THREADPOOL_SIZE))
+    # Daily expiration check at a fixed wall-clock time; also run once at boot
+    scheduler.add_job(
+        check_expiring_vms,
+        CronTrigger(hour=settings.EXPIRATION_CHECK_HOUR, minute=0),
+        next_run_time=datetime.now(),
+        id="check_expiring_vms",
+        replace_existing=True,
+    )
+    scheduler.start()
     asyncio.create_task(run_scheduler())
+    stats_task = asyncio.create_task(admin.run_stats_refresher())
+    audit_task = asyncio.create_task(audit_queue.run())
+    notify_tasks = [asyncio.create_task(notification_service.run_worker()) for _ in range(WORKER_COUNT)]
+    job_tasks = [asyncio.create_task(job_queue.run_worker()) for _ in range(JOB_WORKER_COUNT)]
     
     yield
 
+    stats_task.cancel()
+    for task in job_tasks:
+        task.cancel()
+    audit_task.cancel()
+    await audit_queue.drain()
+    scheduler.shutdown(wait=False)
+    for task in notify_tasks:
+        task.cancel()
+    await notification_service.drain()
+    await notification_service.aclose()
+    vmrun_pool.shutdown(wait=False)
+
+    await async_engine.dispose()
+    _log_listener.stop()
+
 
-app = FastAPI(title="VM Control Panel", lifespan=lifespan)
+# orjson for every JSON response (routes returning a Response directly are unaffected)
+app = FastAPI(title="VM Control Panel", lifespan=lifespan, default_response_class=ORJSONResponse)
 
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+app.mount("/static", PrecompressedStaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
+if not settings.DEBUG:
+    # Production: don't stat template files on every render, reuse compiled bytecode
+    # across restarts, and compile every page at boot instead of on first request
+    templates.env.auto_reload = False
+    templates.env.bytecode_cache = FileSystemBytecodeCache(
+        directory=os.path.join(tempfile.gettempdir(), "vmpanel_jinja_cache")
+    )
+    os.makedirs(templates.env.bytecode_cache.directory, exist_ok=True)
+    for _name in ("layout.html", "login.html", "dashboard.html", "admin.html"):
+        templates.env.get_template(_name)
 
 app.include_router(auth.router)
 app.include_router(admin.router)
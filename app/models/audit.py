@@ -1,11 +1,16 @@
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Index
 from typing import Optional
 from datetime import datetime
 
 class AuditLog(SQLModel, table=True):
+    __table_args__ = (
+        # Per-VM history, newest first; also serves the vm_id foreign key
+        Index("ix_auditlog_vm_id_timestamp", "vm_id", "timestamp"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
     action: str
     vm_id: Optional[int] = Field(default=None, foreign_key="vm.id")
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=datetime.utcnow, index=True)
     details: Optional[str] = None
@@ -1,13 +1,28 @@
-from sqlmodel import SQLModel, Field
+from sqlalchemy import event
+from sqlmodel import SQLModel, Field, Index
 from typing import Optional
 from datetime import datetime
+import os
+
+def normalize_vmx_path(path: str) -> str:
+    """Same form as VMService.list_running_vms() reports, so running checks are a plain set lookup."""
+    return os.path.normpath(path).lower()
 
 class VM(SQLModel, table=True):
+    __table_args__ = (
+        # Covers the daily expiration sweep (app/main.py) — answered from the index alone
+        Index("ix_vm_expiration_date_id", "expiration_date", "id", "name", "last_notified_threshold"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(max_length=255)
     vmx_path: str = Field(unique=True, max_length=512)
-    owner_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    # normalize_vmx_path(vmx_path); kept in sync by the mapper hooks below
+    vmx_path_normalized: str = Field(default="", max_length=512, index=True)
+    owner_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
     expiration_date: Optional[datetime] = Field(default=None)
+    # Last expiration alert threshold sent (30/7/3/1/0/-1 days); reset when expiration_date changes
+    last_notified_threshold: Optional[int] = Field(default=None)
     
     # RDP Settings
     rdp_ip: str = Field(default="remotedesktop.penguinhosting.host", max_length=255)
@@ -30,3 +45,10 @@ class VM(SQLModel, table=True):
     task_state: Optional[str] = Field(default=None) # e.g. "reinstalling", "creating_snapshot"
     task_progress: int = Field(default=0) # 0-100
     task_message: Optional[str] = Field(default=None) # e.g. "Stopping VM..."
+
+
+@event.listens_for(VM, "before_insert")
+@event.listens_for(VM, "before_update")
+def _sync_vmx_path_normalized(mapper, connection, target: VM):
+    if target.vmx_path:
+        target.vmx_path_normalized = normalize_vmx_path(target.vmx_path)
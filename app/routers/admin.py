@@ -1,40 +1,68 @@
 import os
+import re
+import time
+import itertools
 import shutil
+import asyncio
 import psutil
-import datetime
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select
-from typing import List
+import msgspec
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlmodel import select, update, delete, func, or_, case
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional
 from pydantic import BaseModel
 from fastapi.concurrency import run_in_threadpool
-from app.core.database import engine
+from cachetools import LRUCache
 from app.core.config import settings
+from app.core.threadpool import run_bare, run_vmrun
 from app.services.vm_service import vm_service
 from app.models.user import User, Role
-from app.models.vm import VM
+from app.models.vm import VM, normalize_vmx_path
 from app.models.audit import AuditLog
-from app.schemas import UserCreate, UserRead, UserUpdate, VMCreate, VMRead, VMUpdate
+from app.models.port_mapping import PortMapping
+from app.models.scheduled_task import ScheduledTask
+from app.schemas import UserCreate, UserRead, UserUpdate, VMCreate, VMRead, VMPage, VMUpdate, VMReadStruct, UserReadStruct, AuditLogStruct, to_struct, struct_columns
 from app.core.security import get_password_hash
-from app.routers.auth import get_current_admin_user, get_session
+from app.routers.auth import get_current_admin_user, get_async_session, invalidate_cached_user
 
 router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(get_current_admin_user)])
 
-@router.get("/stats")
-async def get_system_stats():
-    """
-    Returns system statistics (CPU, RAM, Disk).
-    """
+# List endpoints encode with msgspec and return the Response directly; response_model
+# is kept on those routes for the OpenAPI schema only.
+_json_encoder = msgspec.json.Encoder()
+
+def _msgspec_response(content) -> Response:
+    return Response(content=_json_encoder.encode(content), media_type="application/json")
+
+# MySQL ER_DUP_ENTRY
+_DUPLICATE_KEY_ERROR = 1062
+
+def _is_duplicate_key(exc: IntegrityError) -> bool:
+    return bool(getattr(exc.orig, "args", None)) and exc.orig.args[0] == _DUPLICATE_KEY_ERROR
+
+# Latest system stats snapshot, refreshed off the event loop by run_stats_refresher()
+_stats_cache = {"ts": 0.0, "data": None}
+_stats_lock = asyncio.Lock()
+# Host-wide numbers only (no per-user data), so one snapshot is safe to share
+STATS_TTL_SECONDS = 2.0
+
+# Capacities don't change while the host is up; compute them once
+_RAM_TOTAL_GB = round(psutil.virtual_memory().total / (1024**3), 2)
+_DISK_TOTAL_GB = round(psutil.disk_usage('.').total / (1024**3), 2)
+
+def _compute_stats() -> dict:
     cpu_percent = psutil.cpu_percent(interval=None)
     
     # RAM
     mem = psutil.virtual_memory()
-    ram_total_gb = round(mem.total / (1024**3), 2)
+    ram_total_gb = _RAM_TOTAL_GB
     ram_used_gb = round(mem.used / (1024**3), 2)
     ram_percent = mem.percent
     
     # Disk (Usage of the drive where CWD is)
     disk = psutil.disk_usage('.')
-    disk_total_gb = round(disk.total / (1024**3), 2)
+    disk_total_gb = _DISK_TOTAL_GB
     disk_used_gb = round(disk.used / (1024**3), 2)
     disk_percent = disk.percent
     
@@ -59,43 +87,125 @@ async def get_system_stats():
         }
     }
 
+async def run_stats_refresher():
+    """
+    Background loop: recomputes the system stats snapshot every second.
+    Registered in main.py lifespan via asyncio.create_task().
+    """
+    # Prime cpu_percent so the first sample covers a real interval instead of returning 0.0
+    psutil.cpu_percent(interval=None)
+    while True:
+        try:
+            _stats_cache["data"] = await run_in_threadpool(_compute_stats)
+            _stats_cache["ts"] = time.monotonic()
+        except Exception as exc:
+            print(f"[Stats] Error refreshing system stats: {exc}")
+        await asyncio.sleep(1)
+
+@router.get("/stats")
+async def get_system_stats():
+    """
+    Returns system statistics (CPU, RAM, Disk) from the background snapshot.
+    """
+    if time.monotonic() - _stats_cache["ts"] >= STATS_TTL_SECONDS:
+        # Snapshot missing or stale (refresher not started yet, or stalled):
+        # recompute once and let concurrent pollers wait on the same result
+        async with _stats_lock:
+            if time.monotonic() - _stats_cache["ts"] >= STATS_TTL_SECONDS:
+                _stats_cache["data"] = await run_in_threadpool(_compute_stats)
+                _stats_cache["ts"] = time.monotonic()
+    return _stats_cache["data"]
+
 @router.get("/audit_logs", response_model=List[AuditLog])
-async def read_audit_logs(session: Session = Depends(get_session)):
-    logs = session.exec(select(AuditLog).order_by(AuditLog.timestamp.desc()).limit(100)).all()
-    return logs
+async def read_audit_logs(
+    before_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=500),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Newest logs first. For the next page pass the smallest id already seen as before_id.
+    """
+    query = select(*struct_columns(AuditLog, AuditLogStruct))
+    if before_id is not None:
+        query = query.where(AuditLog.id < before_id)
+    result = await session.exec(query.order_by(AuditLog.id.desc()).limit(limit))
+    return _msgspec_response([to_struct(AuditLogStruct, row) for row in result.all()])
+
+SCAN_CACHE_SECONDS = 30
+# Never contain VMs; skipped without descending
+_SCAN_SKIP_DIRS = {"system volume information", "$recycle.bin", "windowsapps", "caches", "snapshots"}
+
+def _walk_vmx(path: str):
+    """
+    Recursive scandir walk yielding .vmx paths; DirEntry avoids a stat per file.
+    A directory holding a .vmx is a VM folder — VMware VMs don't nest, so its
+    subdirectories (snapshots, caches, ...) are not descended into.
+    """
+    subdirs = []
+    found = False
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    name = entry.name
+                    if name[0] in ".$" or name.lower() in _SCAN_SKIP_DIRS:
+                        continue
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(".vmx"):
+                    found = True
+                    yield entry.path
+    except OSError:
+        # Unreadable directory — skip it, as os.walk did
+        return
+    if not found:
+        for subdir in subdirs:
+            yield from _walk_vmx(subdir)
+
+# Directories searched by /admin/scan_vms
+VM_SEARCH_ROOTS = (
+    r"C:\Virtual Machines",
+    r"D:\Vms",
+    os.path.expanduser(r"~\Documents\Virtual Machines"),
+    r"D:\Virtual Machines",  # keep as fallback
+)
+
+# Last successful scan; served while fresh, and as a stale fallback if a rescan fails
+_scan_cache = {"t": 0.0, "paths": []}
+_scan_lock = asyncio.Lock()
+
+def _scan_root(root_dir: str) -> list:
+    """Blocking walk of one search root — only ever called through run_in_threadpool."""
+    if not os.path.exists(root_dir):
+        return []
+    return list(_walk_vmx(root_dir))
 
 @router.get("/scan_vms")
 async def scan_vms():
     """
     Scans configured directories for .vmx files.
     """
-    search_roots = [
-        r"C:\Virtual Machines",
-        r"D:\Vms",
-        os.path.expanduser(r"~\Documents\Virtual Machines"),
-        r"D:\Virtual Machines",  # keep as fallback
-    ]
-    
-    found_vms = []
+    if time.monotonic() - _scan_cache["t"] < SCAN_CACHE_SECONDS:
+        return {"paths": _scan_cache["paths"]}
     
-    for root_dir in search_roots:
-        if os.path.exists(root_dir):
-            for root, dirs, files in os.walk(root_dir):
-                for file in files:
-                    if file.lower().endswith(".vmx"):
-                        found_vms.append(os.path.join(root, file))
-    
-    # Remove duplicates and sort
-    return {"paths": sorted(list(set(found_vms)))}
+    # One scan at a time; requests queued behind it reuse its result
+    async with _scan_lock:
+        if time.monotonic() - _scan_cache["t"] < SCAN_CACHE_SECONDS:
+            return {"paths": _scan_cache["paths"]}
+        try:
+            # Roots usually sit on different drives: walk them concurrently to overlap disk latency
+            results = await asyncio.gather(*(run_in_threadpool(_scan_root, root) for root in VM_SEARCH_ROOTS))
+        except Exception as e:
+            print(f"VM scan failed, serving cached results: {e}")
+            return {"paths": _scan_cache["paths"], "stale": True}
+        # Remove duplicates and sort
+        _scan_cache["paths"] = sorted(set(itertools.chain.from_iterable(results)))
+        _scan_cache["t"] = time.monotonic()
+        return {"paths": _scan_cache["paths"]}
 
 # Users
 @router.post("/users", response_model=UserRead)
-async def create_user(user: UserCreate, session: Session = Depends(get_session)):
-    db_user = session.exec(select(User).where(User.username == user.username)).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Username already registered")
-    
-    hashed_pwd = get_password_hash(user.password)
+async def create_user(user: UserCreate, session: AsyncSession = Depends(get_async_session)):
+    hashed_pwd = await run_in_threadpool(get_password_hash, user.password)
     new_user = User(
         username=user.username, 
         hashed_password=hashed_pwd, 
@@ -104,132 +214,195 @@ async def create_user(user: UserCreate, session: Session = Depends(get_session))
         discord_webhook_url=user.discord_webhook_url
     )
     session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    # The UNIQUE index on username is the uniqueness check — no racy pre-SELECT
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        if _is_duplicate_key(e):
+            raise HTTPException(status_code=400, detail="Username already registered")
+        raise
+    await session.refresh(new_user)
     return new_user
 
 @router.get("/users", response_model=List[UserRead])
-async def read_users(session: Session = Depends(get_session)):
-    users = session.exec(select(User)).all()
-    return users
+async def read_users(session: AsyncSession = Depends(get_async_session)):
+    result = await session.exec(select(*struct_columns(User, UserReadStruct)))
+    return _msgspec_response([to_struct(UserReadStruct, row) for row in result.all()])
 
 @router.put("/users/{user_id}", response_model=UserRead)
-async def update_user(user_id: int, user_update: UserUpdate, session: Session = Depends(get_session)):
-    user = session.get(User, user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
+async def update_user(user_id: int, user_update: UserUpdate, session: AsyncSession = Depends(get_async_session)):
     user_data = user_update.dict(exclude_unset=True)
-    if "username" in user_data:
-        existing_user = session.exec(select(User).where(User.username == user_data["username"])).first()
-        if existing_user and existing_user.id != user_id:
-            raise HTTPException(status_code=400, detail="Username already registered")
 
-    if "password" in user_data and user_data["password"]:
-        user_data["hashed_password"] = get_password_hash(user_data["password"])
-        del user_data["password"]
+    password = user_data.pop("password", None)
+    if password:
+        user_data["hashed_password"] = await run_in_threadpool(get_password_hash, password)
         
-    for key, value in user_data.items():
-        setattr(user, key, value)
+    # Single UPDATE by primary key, then one SELECT for the response
+    if user_data:
+        try:
+            result = await session.execute(update(User).where(User.id == user_id).values(**user_data))
+        except IntegrityError as e:
+            # Username taken — enforced by the UNIQUE index
+            await session.rollback()
+            if _is_duplicate_key(e):
+                raise HTTPException(status_code=400, detail="Username already registered")
+            raise
+        if result.rowcount == 0:
+            raise HTTPException(status_code=404, detail="User not found")
+        await session.commit()
+        invalidate_cached_user(user_id)
     
-    session.add(user)
-    session.commit()
-    session.refresh(user)
+    user = await session.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user(user_id: int, session: Session = Depends(get_session)):
-    user = session.get(User, user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Unassign VMs owned by this user
-    vms = session.exec(select(VM).where(VM.owner_id == user_id)).all()
-    for vm in vms:
-        vm.owner_id = None
-        session.add(vm)
+async def delete_user(user_id: int, session: AsyncSession = Depends(get_async_session)):
+    # Unassign VMs owned by this user (one UPDATE, backed by the owner_id index)
+    await session.execute(update(VM).where(VM.owner_id == user_id).values(owner_id=None))
         
-    session.delete(user)
-    session.commit()
+    # Delete by primary key without loading the row first
+    result = await session.execute(delete(User).where(User.id == user_id))
+    if result.rowcount == 0:
+        await session.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
+    await session.commit()
+    invalidate_cached_user(user_id)
     return None
 
+# Last IP each VM answered with, for when Tools stop responding. Fresh answers are cached
+# (and invalidated on power/snapshot changes) by VMService; this only backs the stale fallback
+_last_guest_ip: LRUCache = LRUCache(maxsize=256)
+
 @router.get("/vms/{vm_id}/guest_ip")
 async def get_vm_guest_ip_admin(
     vm_id: int,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
-    vm = session.get(VM, vm_id)
+    vm = await session.get(VM, vm_id)
     if not vm:
         raise HTTPException(status_code=404, detail="VM not found")
-        
-    try:
-        ip = await run_in_threadpool(vm_service.get_guest_ip, vm.vmx_path, vm.guest_username, vm.guest_password)
+    
+    ip = await vm_service.get_guest_ip_async(vm.vmx_path, vm.guest_username, vm.guest_password)
+    if ip:
+        _last_guest_ip[vm.vmx_path] = ip
         return {"ip": ip}
-    except Exception as e:
-        return {"ip": ""}
+    # Tools not answering right now: fall back to the last IP we saw, flagged as stale
+    stale_ip = _last_guest_ip.get(vm.vmx_path)
+    if stale_ip:
+        return {"ip": stale_ip, "stale": True}
+    return {"ip": ""}
 
 # VMs
 @router.post("/vms", response_model=VMRead)
-async def create_vm(vm: VMCreate, session: Session = Depends(get_session)):
-    db_vm = session.exec(select(VM).where(VM.vmx_path == vm.vmx_path)).first()
-    if db_vm:
-        raise HTTPException(status_code=400, detail="VM path already registered")
-    
+async def create_vm(vm: VMCreate, session: AsyncSession = Depends(get_async_session)):
     new_vm = VM.from_orm(vm)
     session.add(new_vm)
-    session.commit()
-    session.refresh(new_vm)
+    # The UNIQUE constraint on vmx_path is the uniqueness check — no racy pre-SELECT
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        if _is_duplicate_key(e):
+            raise HTTPException(status_code=400, detail="VM path already registered")
+        raise
+    await session.refresh(new_vm)
     return new_vm
 
-@router.get("/vms", response_model=List[VMRead])
-async def read_all_vms(session: Session = Depends(get_session)):
-    vms = session.exec(select(VM)).all()
-    return vms
+@router.get("/vms", response_model=VMPage)
+async def read_all_vms(
+    after_id: int = 0,
+    limit: int = Query(100, ge=1, le=500),
+    session: AsyncSession = Depends(get_async_session)
+):
+    # Keyset pagination on the primary key: each page is an index range scan
+    # Plain column rows — no VM objects or identity-map entries are created
+    vms = (await session.exec(
+        select(*struct_columns(VM, VMReadStruct), VM.vmx_path_normalized).where(VM.id > after_id).order_by(VM.id).limit(limit)
+    )).all()
+    items = [to_struct(VMReadStruct, row) for row in vms]
+    try:
+        statuses = await run_bare(vm_service.status_map, {row.vmx_path: row.vmx_path_normalized for row in vms})
+        for item in items:
+            item.status = statuses[item.vmx_path]
+    except Exception as e:
+        # Page still renders, with status left as "unknown"
+        print(f"VM status lookup failed: {e}")
+    return _msgspec_response({
+        "items": items,
+        "next": vms[-1].id if len(vms) == limit else None,
+    })
 
 @router.put("/vms/{vm_id}", response_model=VMRead)
-async def update_vm(vm_id: int, vm_update: VMUpdate, session: Session = Depends(get_session)):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    
+async def update_vm(vm_id: int, vm_update: VMUpdate, session: AsyncSession = Depends(get_async_session)):
     vm_data = vm_update.dict(exclude_unset=True)
 
     # Guard: if vmx_path is being changed, ensure it doesn't collide with another VM
-    # Use case-insensitive compare — Windows paths are case-insensitive
-    if "vmx_path" in vm_data and vm_data["vmx_path"].lower() != vm.vmx_path.lower():
-        conflict = session.exec(select(VM).where(VM.vmx_path == vm_data["vmx_path"])).first()
+    # (MySQL's default collation compares case-insensitively, matching Windows paths)
+    if "vmx_path" in vm_data:
+        conflict = (await session.exec(
+            select(VM.id, VM.name).where(VM.vmx_path == vm_data["vmx_path"], VM.id != vm_id).limit(1)
+        )).first()
         if conflict:
             raise HTTPException(status_code=400, detail=f"VMX path is already registered to VM '{conflict.name}' (ID {conflict.id})")
 
-    for key, value in vm_data.items():
-        setattr(vm, key, value)
+    # Single UPDATE by primary key, then one SELECT for the response
+    if vm_data:
+        values = []
+        if "expiration_date" in vm_data:
+            # New expiration date -> re-arm the expiration alerts. Listed before
+            # expiration_date because MySQL applies SET assignments left to right.
+            values.append((VM.last_notified_threshold, case(
+                (VM.expiration_date == vm_data["expiration_date"], VM.last_notified_threshold),
+                else_=None,
+            )))
+        if "vmx_path" in vm_data:
+            # Bulk UPDATE skips the ORM hooks, so keep the normalized copy in step here
+            vm_data["vmx_path_normalized"] = normalize_vmx_path(vm_data["vmx_path"])
+        values.extend((getattr(VM, key), value) for key, value in vm_data.items())
+        result = await session.execute(update(VM).where(VM.id == vm_id).ordered_values(*values))
+        if result.rowcount == 0:
+            raise HTTPException(status_code=404, detail="VM not found")
+        await session.commit()
     
-    session.add(vm)
-    session.commit()
-    session.refresh(vm)
+    vm = await session.get(VM, vm_id)
+    if not vm:
+        raise HTTPException(status_code=404, detail="VM not found")
     return vm
 
 @router.delete("/vms/{vm_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_vm(vm_id: int, session: Session = Depends(get_session)):
-    vm = session.get(VM, vm_id)
-    if not vm:
+async def delete_vm(vm_id: int, session: AsyncSession = Depends(get_async_session)):
+    # Only the name is needed (for the audit note), not the whole row
+    vm_name = await session.scalar(select(VM.name).where(VM.id == vm_id))
+    if vm_name is None:
         raise HTTPException(status_code=404, detail="VM not found")
     
     # Unlink audit logs before deleting VM to avoid foreign key constraint error
-    audit_logs = session.exec(select(AuditLog).where(AuditLog.vm_id == vm_id)).all()
-    for log in audit_logs:
-        log.vm_id = None
-        if log.details:
-            log.details += f" (VM {vm.name} deleted)"
-        else:
-            log.details = f"VM {vm.name} deleted"
-        session.add(log)
+    await session.execute(
+        update(AuditLog)
+        .where(AuditLog.vm_id == vm_id)
+        .values(
+            vm_id=None,
+            details=case(
+                (or_(AuditLog.details.is_(None), AuditLog.details == ""), f"VM {vm_name} deleted"),
+                else_=func.concat(AuditLog.details, f" (VM {vm_name} deleted)"),
+            ),
+        )
+    )
+    # Same for the other tables referencing vm.id — one statement each
+    await session.execute(update(PortMapping).where(PortMapping.vm_id == vm_id).values(vm_id=None))
+    await session.execute(delete(ScheduledTask).where(ScheduledTask.vm_id == vm_id))
     
-    session.delete(vm)
-    session.commit()
+    await session.execute(delete(VM).where(VM.id == vm_id))
+    await session.commit()
     return None
 
 
+# Anything but letters/digits (Unicode, like str.isalnum), space, '-' and '_'
+_UNSAFE_NAME_CHARS = re.compile(r"[^\w \-]+")
+
 class VMProvision(BaseModel):
     name: str
     owner_id: int
@@ -237,26 +410,40 @@ class VMProvision(BaseModel):
     cpu_cores: int = 2
     ram_mb: int = 4096
 
+def _provision_on_disk(provision: VMProvision, dest_vmx: str, safe_name: str):
+    """Blocking vmrun steps for provision_vm — run as a single threadpool call."""
+    vm_service.clone_vm(
+        settings.TEMPLATE_VM_PATH, 
+        dest_vmx, 
+        safe_name, 
+        provision.clone_type,
+        settings.TEMPLATE_SNAPSHOT_NAME
+    )
+
+    # Update Specs (CPU/RAM)
+    vm_service.update_specs(dest_vmx, provision.cpu_cores, provision.ram_mb)
+    
+    # Create Base Snapshot for future reinstalls
+    vm_service.create_snapshot(dest_vmx, settings.TEMPLATE_SNAPSHOT_NAME)
+
 @router.post("/vms/provision", response_model=VMRead)
 async def provision_vm(
     provision: VMProvision, 
     current_user: User = Depends(get_current_admin_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     # 1. Check Template
     if not os.path.exists(settings.TEMPLATE_VM_PATH):
         raise HTTPException(status_code=500, detail=f"Template VM not found at {settings.TEMPLATE_VM_PATH}")
     
     # 2. Check Owner
-    owner = session.get(User, provision.owner_id)
+    owner = await session.get(User, provision.owner_id)
     if not owner:
         raise HTTPException(status_code=404, detail="Owner not found")
 
     # 3. Prepare Paths
     # Sanitize name for folder
-    safe_name = "".join(c for c in provision.name if c.isalnum() or c in (' ', '-', '_')).strip()
-    if not safe_name:
-        safe_name = "VM-New"
+    safe_name = _UNSAFE_NAME_CHARS.sub("", provision.name).strip() or "VM-New"
         
     dest_dir = os.path.join(settings.VM_STORAGE_PATH, safe_name)
     dest_vmx = os.path.join(dest_dir, f"{safe_name}.vmx")
@@ -269,29 +456,8 @@ async def provision_vm(
         # Create storage dir if not exists
         os.makedirs(settings.VM_STORAGE_PATH, exist_ok=True)
         
-        await run_in_threadpool(
-            vm_service.clone_vm, 
-            settings.TEMPLATE_VM_PATH, 
-            dest_vmx, 
-            safe_name, 
-            provision.clone_type,
-            settings.TEMPLATE_SNAPSHOT_NAME
-        )
-
-        # 4.5 Update Specs (CPU/RAM)
-        await run_in_threadpool(
-            vm_service.update_specs,
-            dest_vmx,
-            provision.cpu_cores,
-            provision.ram_mb
-        )
-        
-        # Create Base Snapshot for future reinstalls
-        await run_in_threadpool(
-            vm_service.create_snapshot,
-            dest_vmx,
-            settings.TEMPLATE_SNAPSHOT_NAME
-        )
+        # Clone, specs and base snapshot in one hop on the vmrun pool
+        await run_vmrun(_provision_on_disk, provision, dest_vmx, safe_name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Cloning failed: {e}")
         
@@ -306,18 +472,17 @@ async def provision_vm(
     # new_vm.status = "stopped" 
     
     session.add(new_vm)
-    session.commit()
-    session.refresh(new_vm)
+    await session.flush()  # assigns new_vm.id without committing
     
-    # 6. Log
+    # 6. Log (same transaction: one commit for VM + audit entry)
     log = AuditLog(
         user_id=current_user.id,
         action="provision",
         vm_id=new_vm.id,
-        details=f"Provisioned for user {owner.username} from template ({provision.clone_type})",
-        timestamp=datetime.datetime.utcnow()
+        details=f"Provisioned for user {owner.username} from template ({provision.clone_type})"
     )
     session.add(log)
-    session.commit()
+    await session.commit()
+    await session.refresh(new_vm)
     
     return new_vm
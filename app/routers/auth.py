@@ -1,14 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from jose import JWTError, jwt
-from app.core.database import engine
+from app.core.database import engine, AsyncSessionLocal
 from app.models.user import User, Role
 from app.core import security
 from app.core.config import settings
 from app.schemas import Token, TokenData, UserRead
 import time
 from collections import defaultdict
+from cachetools import TTLCache
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
@@ -19,6 +22,17 @@ _login_attempts: dict = defaultdict(list)
 _MAX_ATTEMPTS = 10   # max attempts
 _WINDOW_SECONDS = 60 # per minute
 
+# Compared against when the username doesn't exist (see login_for_access_token)
+_DUMMY_HASH = security.get_password_hash("dummy-password-for-timing")
+
+# Short-lived cache of token -> validated user, so polling endpoints skip the user SELECT.
+# Cached users are detached copies without hashed_password; handlers that modify the
+# account reload it from their session and call invalidate_cached_user().
+_user_cache: TTLCache = TTLCache(maxsize=1024, ttl=30)
+_CACHED_USER_FIELDS = ("id", "username", "role", "is_active", "discord_webhook_url", "discord_webhook_public")
+# user id -> (discord_webhook_url, discord_webhook_public), for VM notifications to the owner
+_webhook_cache: TTLCache = TTLCache(maxsize=1024, ttl=60)
+
 def _check_rate_limit(ip: str):
     now = time.time()
     attempts = _login_attempts[ip]
@@ -35,12 +49,21 @@ def get_session():
     with Session(engine) as session:
         yield session
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+async def get_async_session():
+    async with AsyncSessionLocal() as session:
+        yield session
+
+async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_async_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # Keyed by the raw token: a new token always goes through full validation
+    cached = _user_cache.get(token)
+    if cached is not None:
+        return User(**cached)
+
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
@@ -50,11 +73,31 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
     except JWTError:
         raise credentials_exception
     
-    user = session.exec(select(User).where(User.username == token_data.username)).first()
+    user = (await session.exec(select(User).where(User.username == token_data.username))).first()
     if user is None:
         raise credentials_exception
+    _user_cache[token] = {field: getattr(user, field) for field in _CACHED_USER_FIELDS}
     return user
 
+def invalidate_cached_user(user_id: int):
+    """Drop every cached token for this user (call after changing or deleting the account)."""
+    for token, data in list(_user_cache.items()):
+        if data["id"] == user_id:
+            _user_cache.pop(token, None)
+    _webhook_cache.pop(user_id, None)
+
+async def get_user_webhooks(user_id: int) -> tuple:
+    """(discord_webhook_url, discord_webhook_public) of a user, (None, None) if there is no such user.
+    Cached, so a burst of notifications for one owner costs a single SELECT."""
+    cached = _webhook_cache.get(user_id)
+    if cached is None:
+        async with AsyncSessionLocal() as session:
+            row = (await session.exec(
+                select(User.discord_webhook_url, User.discord_webhook_public).where(User.id == user_id)
+            )).first()
+        cached = _webhook_cache[user_id] = (row[0], row[1]) if row else (None, None)
+    return cached
+
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
@@ -66,18 +109,28 @@ async def get_current_admin_user(current_user: User = Depends(get_current_active
     return current_user
 
 @router.post("/token", response_model=Token)
-async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_async_session)):
     # Rate limit by IP
     client_ip = request.client.host if request.client else "unknown"
     _check_rate_limit(client_ip)
     
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    user = (await session.exec(select(User).where(User.username == form_data.username))).first()
+    # bcrypt is CPU-bound (~100ms): run it in the threadpool, not on the event loop.
+    # Unknown usernames are checked against a dummy hash so both paths cost the same
+    # and response time doesn't reveal which usernames exist.
+    stored_hash = user.hashed_password if user else _DUMMY_HASH
+    valid, new_hash = await run_in_threadpool(security.verify_and_update_password, form_data.password, stored_hash)
+    if not user or not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Stored hash used outdated parameters — upgrade it while we have the plaintext
+        user.hashed_password = new_hash
+        session.add(user)
+        await session.commit()
     access_token = security.create_access_token(subject=user.username)
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -106,13 +159,15 @@ async def update_user_profile(
     # This allows users to clear their webhooks by sending null
     update_data = profile.dict(exclude_unset=True)
     
+    user = session.get(User, current_user.id)
     for key, value in update_data.items():
-        setattr(current_user, key, value)
+        setattr(user, key, value)
         
-    session.add(current_user)
+    session.add(user)
     session.commit()
-    session.refresh(current_user)
-    return current_user
+    session.refresh(user)
+    invalidate_cached_user(user.id)
+    return user
 
 @router.post("/me/password")
 async def change_password(
@@ -120,10 +175,12 @@ async def change_password(
     current_user: User = Depends(get_current_active_user),
     session: Session = Depends(get_session)
 ):
-    if not security.verify_password(password_data.current_password, current_user.hashed_password):
+    user = session.get(User, current_user.id)
+    if not await run_in_threadpool(security.verify_password, password_data.current_password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Incorrect current password")
     
-    current_user.hashed_password = security.get_password_hash(password_data.new_password)
-    session.add(current_user)
+    user.hashed_password = await run_in_threadpool(security.get_password_hash, password_data.new_password)
+    session.add(user)
     session.commit()
+    invalidate_cached_user(user.id)
     return {"message": "Password updated successfully"}
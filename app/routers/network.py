@@ -1,13 +1,18 @@
+import asyncio
+import logging
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
-from sqlmodel import Session, select
+from sqlmodel import select, update, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.services.nat_service import nat_service
 from app.models.user import User, Role
 from app.models.port_mapping import PortMapping
 from app.models.vm import VM
-from app.routers.auth import get_current_active_user, get_session
+from app.routers.auth import get_current_active_user, get_async_session
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/network", tags=["network"])
 
@@ -23,80 +28,79 @@ class DeleteRule(BaseModel):
     host_port: int
 
 @router.get("/forwarding")
-def get_forwarding_rules(
+async def get_forwarding_rules(
     current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     if current_user.role != Role.ADMIN:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     try:
-        # Get raw rules from NAT Service
-        rules = nat_service.get_rules()
-        
-        # Get metadata from DB
-        statement = select(PortMapping)
-        mappings = session.exec(statement).all()
+        # Get metadata from DB: one query, only the columns used for labels,
+        # with the VM name joined in instead of a second lookup
+        statement = (
+            select(PortMapping.protocol, PortMapping.host_port, PortMapping.description, VM.name)
+            .outerjoin(VM, VM.id == PortMapping.vm_id)
+        )
         
-        # Create a lookup map: (protocol, host_port) -> PortMapping
-        mapping_dict = {(m.protocol, m.host_port): m for m in mappings}
+        # Raw rules from the NAT config file (threadpool) and DB labels, concurrently
+        rules, mappings = await asyncio.gather(
+            run_in_threadpool(nat_service.get_rules),
+            session.exec(statement),
+        )
         
-        # Create a lookup for VM names: vm_id -> vm_name
-        vm_ids = {m.vm_id for m in mappings if m.vm_id}
-        vm_map = {}
-        if vm_ids:
-            vms = session.exec(select(VM).where(VM.id.in_(vm_ids))).all()
-            vm_map = {v.id: v.name for v in vms}
+        # One pass: (protocol, host_port) -> label
+        label_map = {
+            (protocol, host_port): vm_name or description or "-"
+            for protocol, host_port, description, vm_name in mappings
+        }
 
         # Enrich rules with VM name
         for protocol in ['tcp', 'udp']:
             for rule in rules[protocol]:
-                key = (protocol, rule['host_port'])
-                if key in mapping_dict:
-                    mapping = mapping_dict[key]
-                    if mapping.vm_id and mapping.vm_id in vm_map:
-                        rule['vm_name'] = vm_map[mapping.vm_id]
-                    elif mapping.description:
-                        rule['vm_name'] = mapping.description
-                
-                if 'vm_name' not in rule:
-                    rule['vm_name'] = "-"
+                rule['vm_name'] = label_map.get((protocol, rule['host_port']), "-")
                     
         return rules
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/forwarding")
-def add_forwarding_rule(
+async def add_forwarding_rule(
     rule: ForwardingRule,
     current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     if current_user.role != Role.ADMIN:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     try:
-        # Add to NAT Service
-        nat_service.add_forwarding_rule(
+        # Remember what this host port forwarded to, so a failed DB write can put it back
+        existing = await run_in_threadpool(nat_service.get_rules)
+        previous = next(
+            (r for r in existing.get(rule.protocol, []) if r["host_port"] == rule.host_port),
+            None
+        )
+        # Add to NAT Service first: if this fails nothing is written to the DB
+        await run_in_threadpool(
+            nat_service.add_forwarding_rule,
             rule.protocol, 
             rule.host_port, 
             rule.guest_ip, 
             rule.guest_port
         )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
         
+    try:
         # Add metadata to DB
-        # Check if mapping exists
-        statement = select(PortMapping).where(
-            PortMapping.protocol == rule.protocol,
-            PortMapping.host_port == rule.host_port
+        # Update the mapping in place if it exists (no row fetch), otherwise insert
+        result = await session.execute(
+            update(PortMapping)
+            .where(PortMapping.protocol == rule.protocol, PortMapping.host_port == rule.host_port)
+            .values(vm_id=rule.vm_id, description=None)  # Clear desc if using ID
         )
-        existing_mapping = session.exec(statement).first()
         
-        if existing_mapping:
-            existing_mapping.vm_id = rule.vm_id
-            existing_mapping.description = None # Clear desc if using ID
-            session.add(existing_mapping)
-        else:
+        if result.rowcount == 0:
             new_mapping = PortMapping(
                 protocol=rule.protocol,
                 host_port=rule.host_port,
@@ -104,34 +108,51 @@ def add_forwarding_rule(
             )
             session.add(new_mapping)
         
-        session.commit()
-        
-        return {"message": "Rule added successfully"}
+        await session.commit()
     except Exception as e:
+        # Compensate: restore the rule this one replaced, or drop it if the port was free,
+        # so the NAT config doesn't drift from what the panel knows about
+        try:
+            if previous:
+                await run_in_threadpool(
+                    nat_service.add_forwarding_rule,
+                    rule.protocol,
+                    rule.host_port,
+                    previous["guest_ip"],
+                    previous["guest_port"]
+                )
+            else:
+                await run_in_threadpool(nat_service.delete_forwarding_rule, rule.protocol, rule.host_port)
+        except Exception:
+            logger.exception(
+                "Failed to roll back NAT rule %s/%s after DB error; vmnetnat.conf and port mappings now differ",
+                rule.protocol, rule.host_port
+            )
         raise HTTPException(status_code=500, detail=str(e))
+        
+    return {"message": "Rule added successfully"}
 
 @router.delete("/forwarding/{protocol}/{host_port}")
-def delete_forwarding_rule(
+async def delete_forwarding_rule(
     protocol: str,
     host_port: int,
     current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     if current_user.role != Role.ADMIN:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     try:
-        nat_service.delete_forwarding_rule(protocol, host_port)
+        await run_in_threadpool(nat_service.delete_forwarding_rule, protocol, host_port)
         
         # Delete from DB
-        statement = select(PortMapping).where(
-            PortMapping.protocol == protocol,
-            PortMapping.host_port == host_port
+        await session.execute(
+            delete(PortMapping).where(
+                PortMapping.protocol == protocol,
+                PortMapping.host_port == host_port
+            )
         )
-        mapping = session.exec(statement).first()
-        if mapping:
-            session.delete(mapping)
-            session.commit()
+        await session.commit()
             
         return {"message": "Rule deleted successfully"}
     except Exception as e:
@@ -14,9 +14,9 @@ from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import Session, select
-from starlette.concurrency import run_in_threadpool
 
 from app.core.database import engine
+from app.core.threadpool import run_bare, run_vmrun
 from app.models.vm import VM
 from app.models.audit import AuditLog
 from app.models.scheduled_task import ScheduledTask, TaskAction, TaskStatus
@@ -97,15 +97,11 @@ async def list_scheduled_tasks(
             select(ScheduledTask).order_by(ScheduledTask.run_at)
         ).all()
     else:
-        # Find VM ids owned by this user
-        owned_vm_ids = [
-            vm.id for vm in session.exec(select(VM).where(VM.owner_id == current_user.id)).all()
-        ]
-        if not owned_vm_ids:
-            return []
+        # Filter by ownership in the same query instead of loading the user's VMs first
         tasks = session.exec(
             select(ScheduledTask)
-            .where(ScheduledTask.vm_id.in_(owned_vm_ids))
+            .join(VM, VM.id == ScheduledTask.vm_id)
+            .where(VM.owner_id == current_user.id)
             .order_by(ScheduledTask.run_at)
         ).all()
     return tasks
@@ -228,17 +224,17 @@ async def _execute_task(task_id: int):
 
         # Step 2: run the vmrun command (session closed, only plain vars used)
         if task_action == TaskAction.START:
-            await run_in_threadpool(vm_service.start_vm, vmx_path)
+            await run_bare(vm_service.start_vm, vmx_path)
 
         elif task_action == TaskAction.STOP:
-            await run_in_threadpool(vm_service.stop_vm, vmx_path)
+            await run_bare(vm_service.stop_vm, vmx_path)
 
         elif task_action == TaskAction.RESTART:
-            await run_in_threadpool(vm_service.restart_vm, vmx_path)
+            await run_bare(vm_service.restart_vm, vmx_path)
 
         elif task_action == TaskAction.SNAPSHOT:
             snap_name = task_snap or f"auto-{datetime.utcnow().strftime('%Y%m%d-%H%M')}"
-            await run_in_threadpool(vm_service.create_snapshot, vmx_path, snap_name)
+            await run_vmrun(vm_service.create_snapshot, vmx_path, snap_name)
 
     except Exception as exc:
         error = str(exc)
@@ -1,32 +1,70 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, WebSocket, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, WebSocket
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from sqlmodel import Session, select
+from jose import jwt
+from sqlmodel import Session, select, update
 from typing import List, Optional
 from app.core.database import engine
 from app.models.vm import VM
 from app.models.user import User, Role
 from app.models.audit import AuditLog
-from app.schemas import VMRead, VMUpdate, VMStaticIPRequest
-from app.routers.auth import get_current_active_user, get_session
+from app.schemas import VMRead, VMReadListAdapter, VMStaticIPRequest
+from app.routers.auth import get_current_active_user, get_session, get_user_webhooks
 from app.services.vm_service import vm_service
 from app.services.notification_service import notification_service
+from app.services.audit_queue import audit_queue
+from app.services.job_queue import job_queue
+from app.services.vnc_capture import grab_screen_png
 from app.core.config import settings
-import datetime
 import os
+import re
+import logging
+import socket
 import asyncio
 import time
-import hashlib
 import shutil
-import base64
+import hashlib
+import zlib
+from functools import lru_cache
+from cachetools import TTLCache
 from starlette.concurrency import run_in_threadpool
+from app.core.threadpool import run_bare, run_vmrun
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/vms", tags=["vms"])
 
-def log_action(user_id: int, action: str, vm_id: int, details: str = None):
-    with Session(engine) as session:
-        log = AuditLog(user_id=user_id, action=action, vm_id=vm_id, details=details, timestamp=datetime.datetime.utcnow())
-        session.add(log)
-        session.commit()
+def log_action(user_id: int, action: str, vm_id: int, details: str = None, session: Optional[Session] = None):
+    if session is not None:
+        # Caller is about to commit anyway: the row rides along in the same transaction
+        session.add(AuditLog(user_id=user_id, action=action, vm_id=vm_id, details=details))
+        return
+    # Batched by the audit flusher; keeps the INSERT + COMMIT off the request path
+    audit_queue.log(user_id, action, vm_id, details)
+
+def get_owned_vm(
+    vm_id: int,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+) -> VM:
+    """The path's VM, provided the caller owns it or is an admin. Resolved once per request."""
+    vm = session.get(VM, vm_id)
+    if not vm:
+        raise HTTPException(status_code=404, detail="VM not found")
+    if vm.owner_id != current_user.id and current_user.role != Role.ADMIN:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return vm
+
+def _release_connection(session: Session):
+    """
+    End the read transaction get_owned_vm opened, returning its pooled connection before a
+    multi-second vmrun call. close() detaches without expiring, so the loaded VM stays
+    readable; later writes run in a fresh short transaction on the same session.
+    """
+    session.close()
+
+# Successful player-activity events, which may go to the owner's public webhook
+PUBLIC_ACTIONS = frozenset({"start", "stop", "restart", "network_change"})
 
 async def send_vm_notification(vm: VM, action: str, status: str = "Success", details: str = None, fields: list = None):
     """
@@ -61,40 +99,21 @@ async def send_vm_notification(vm: VM, action: str, status: str = "Success", det
         "icon_url": "https://cdn.penguinhosting.host/pingvin.jpeg"
     }
     
-    # 2. Determine Webhook URLs (Routing Logic)
-    
-    # Define Public Actions (Player Activity)
-    public_actions = ["start", "stop", "restart", "network_change"]
-    
-    is_public_event = False
-    if action in public_actions and status == "Success":
-        is_public_event = True
-    
-    # 3. Determine Owner Webhook
+    # 2. Determine Owner Webhook (Routing Logic)
     target_user_webhook = None
     
     if vm.owner_id:
-        with Session(engine) as session:
-            owner = session.get(User, vm.owner_id)
-            if owner:
-                # User Notification Logic:
-                # 1. Public Events -> Try 'Public Webhook', fallback to 'Main Webhook'
-                # 2. Private Events -> 'Main Webhook' only.
-                
-                if is_public_event:
-                     # Prefer Public Webhook if set, otherwise Main
-                     if owner.discord_webhook_public:
-                         target_user_webhook = owner.discord_webhook_public
-                     elif owner.discord_webhook_url:
-                         target_user_webhook = owner.discord_webhook_url
-                else:
-                     # Private Event (Security/Errors) -> Main Webhook only
-                     if owner.discord_webhook_url:
-                         target_user_webhook = owner.discord_webhook_url
+        # Cached per owner (and dropped when the account changes), not a SELECT per event
+        webhook_url, webhook_public = await get_user_webhooks(vm.owner_id)
+        # Public Events -> 'Public Webhook', falling back to 'Main Webhook'
+        # Private Events (Security/Errors) -> 'Main Webhook' only
+        is_public_event = status == "Success" and action in PUBLIC_ACTIONS
+        target_user_webhook = (is_public_event and webhook_public) or webhook_url or None
     
-    # 4. Send to Owner
+    # 3. Send to Owner
+    # Queued, not awaited: the workers in NotificationService do the HTTP round-trips
     if target_user_webhook:
-        await notification_service.send_discord_alert(
+        notification_service.enqueue(
             title=title, 
             description=description, 
             color=color, 
@@ -105,12 +124,12 @@ async def send_vm_notification(vm: VM, action: str, status: str = "Success", det
             footer=footer
         )
 
-    # 5. Send to System Admin (Global Webhook)
+    # 4. Send to System Admin (Global Webhook)
     # We always send to admin for logging, unless it's a duplicate of the user's webhook
     global_webhook = settings.DISCORD_WEBHOOK_URL
     
     if global_webhook and target_user_webhook != global_webhook:
-         await notification_service.send_discord_alert(
+         notification_service.enqueue(
             title=title, 
             description=description, 
             color=color, 
@@ -120,83 +139,140 @@ async def send_vm_notification(vm: VM, action: str, status: str = "Success", det
             author=author,
             footer=footer
         )
+PROGRESS_COMMIT_INTERVAL = 0.5
+GUEST_IP_WAIT_SECONDS = 150  # same 2.5 min ceiling as the old 30 × 5s loop
+_progress_committed_at = {}
+
+async def _update_progress(session: Session, vm: VM, *, message: str = None, progress: int = None, force: bool = False):
+    """
+    Record reinstall progress on the VM row. Commits (in a worker thread) at phase
+    boundaries (force=True) or at most every PROGRESS_COMMIT_INTERVAL seconds; skipped
+    updates stay pending in the session and go out with the next commit. Unforced calls
+    that change nothing (same progress and message, nothing pending) never commit.
+    """
+    if message is not None:
+        vm.task_message = message
+    if progress is not None:
+        vm.task_progress = progress
+    session.add(vm)
+    if not force and not session.is_modified(vm):
+        return
+    vm_id = vm.id
+    now = time.monotonic()
+    if force or now - _progress_committed_at.get(vm_id, 0.0) >= PROGRESS_COMMIT_INTERVAL:
+        await asyncio.to_thread(session.commit)
+        _progress_committed_at[vm_id] = now
+
+# RDP port/firewall bootstrap run in the guest after a reinstall; only $port varies.
+# Lines are stripped but NOT joined with semicolons: a # comment would swallow the next command.
+_RDP_SCRIPT_TEMPLATE = "\n".join(line.strip() for line in """
+    $port = {port}
+    
+    # Enable RDP 
+    Set-ItemProperty -Path 'HKLM:\\System\\CurrentControlSet\\Control\\Terminal Server' -Name 'fDenyTSConnections' -Value 0 
+    
+    # Set RDP port explicitly as DWORD 
+    Set-ItemProperty -Path 'HKLM:\\System\\CurrentControlSet\\Control\\Terminal Server\\WinStations\\RDP-Tcp' -Name 'PortNumber' -Value $port -Type DWord 
+    
+    # Disable default RDP firewall rules (3389) 
+    Get-NetFirewallRule -DisplayGroup "Remote Desktop" | Disable-NetFirewallRule 
+    
+    # Allow custom RDP port 
+    New-NetFirewallRule -DisplayName "RDP Custom Port $port" -Direction Inbound -Protocol TCP -LocalPort $port -Action Allow -Profile Any -ErrorAction SilentlyContinue 
+    
+    # Restart RDP service
+    Restart-Service TermService -Force 
+    
+    # Wait to ensure port bind 
+    Start-Sleep -Seconds 5 
+    
+    # Reboot to ensure settings apply
+    Restart-Computer -Force
+""".splitlines() if line.strip())
+
+def _wipe_dir(path: str):
+    """Empty a VM folder in one go; files still locked by VMware are left for the clone to fail on."""
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+def _write_script_once(path: str, script: str) -> str:
+    """Write a content-addressed host script unless an identical one is already on disk; returns its absolute path."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        with open(path, "w") as f:
+            f.write(script)
+    return os.path.abspath(path)
+
+def _elapsed_field(started_at: float) -> list:
+    if not settings.BATCH_NOTIFICATIONS:
+        return []
+    minutes, seconds = divmod(int(time.monotonic() - started_at), 60)
+    return [{"name": "⏱️ Elapsed", "value": f"{minutes}m {seconds:02d}s", "inline": True}]
+
 async def background_reinstall_vm(vm_id: int):
-    with Session(engine) as session:
+    # expire_on_commit=False: this task is the VM row's only writer while it runs, so the
+    # progress commits must not turn every later attribute read into a full-row SELECT
+    with Session(engine, expire_on_commit=False) as session:
         vm = session.get(VM, vm_id)
         if not vm:
             return
 
+        # With BATCH_NOTIFICATIONS, intermediate warnings ride along in the final embed
+        events = []
+        started_at = time.monotonic()
         try:
             # Notify Start
             await send_vm_notification(vm, "reinstall", "Started", "Server is Reinstalling...")
 
             # UPDATE PROGRESS: Started
             vm.task_state = "reinstalling"
-            vm.task_progress = 5
-            vm.task_message = "Initializing..."
-            session.add(vm)
-            session.commit()
+            await _update_progress(session, vm, message="Initializing...", progress=5, force=True)
+
+            # The running check, the snapshot list and the guest IP don't depend on each other,
+            # so their vmrun calls run side by side (sleep(0) stands in when the IP is known)
+            running_vms, snapshots, current_ip = await asyncio.gather(
+                get_running_vms(),
+                run_bare(vm_service.list_snapshots, vm.vmx_path, force=True),
+                asyncio.sleep(0) if vm.internal_ip else vm_service.get_guest_ip_async(vm.vmx_path),
+                return_exceptions=True,
+            )
+            running = vm.vmx_path_normalized in running_vms
+            if isinstance(snapshots, BaseException):
+                snapshots = [] # Proceed to check/re-provision
 
             # 0. Auto-Learn IP (Last chance before wipe)
-            if not vm.internal_ip:
-                try:
-                     # Only try if running
-                     if await run_in_threadpool(vm_service.is_running, vm.vmx_path):
-                        vm.task_message = "Detecting IP..."
-                        session.add(vm)
-                        session.commit()
-                        
-                        current_ip = await run_in_threadpool(vm_service.get_guest_ip, vm.vmx_path)
-                        if current_ip and "Unknown" not in current_ip:
-                            vm.internal_ip = current_ip
-                            session.add(vm)
-                            session.commit()
-                            log_action(vm.owner_id or 0, "system", vm.id, f"Auto-detected Internal IP: {current_ip}")
-                except Exception as e:
-                    print(f"Auto-IP failed: {e}")
+            if running and isinstance(current_ip, str) and current_ip and "Unknown" not in current_ip:
+                vm.internal_ip = current_ip
+                # auditlog.user_id is a foreign key, so unowned VMs get no entry
+                if vm.owner_id:
+                    log_action(vm.owner_id, "system", vm.id, f"Auto-detected Internal IP: {current_ip}", session=session)
+                await _update_progress(session, vm, force=True)
 
             # 1. Stop VM
-            if await run_in_threadpool(vm_service.is_running, vm.vmx_path):
-                vm.task_message = "Stopping VM..."
-                vm.task_progress = 10
-                session.add(vm)
-                session.commit()
+            if running:
+                await _update_progress(session, vm, message="Stopping VM...", progress=10, force=True)
 
-                await run_in_threadpool(vm_service.stop_vm, vm.vmx_path, hard=True)
+                await run_bare(vm_service.stop_vm, vm.vmx_path, hard=True)
                 await asyncio.sleep(2)
 
             # 2. Revert to Snapshot
-            vm.task_message = "Checking Snapshot..."
-            vm.task_progress = 20
-            session.add(vm)
-            session.commit()
+            await _update_progress(session, vm, message="Checking Snapshot...", progress=20)
 
             snapshot_name = settings.TEMPLATE_SNAPSHOT_NAME
-            snapshots = []
-            try:
-                snapshots = await run_in_threadpool(vm_service.list_snapshots, vm.vmx_path)
-            except Exception:
-                pass # Proceed to check/re-provision
-
+            base_snapshot = None
             if snapshot_name in snapshots:
-                vm.task_message = f"Reverting to {snapshot_name}..."
-                vm.task_progress = 30
-                session.add(vm)
-                session.commit()
-                await run_in_threadpool(vm_service.revert_to_snapshot, vm.vmx_path, snapshot_name)
+                await _update_progress(session, vm, message=f"Reverting to {snapshot_name}...", progress=30, force=True)
+                await run_vmrun(vm_service.revert_to_snapshot, vm.vmx_path, snapshot_name)
             else:
                 # Fallback: Re-provision
-                vm.task_message = "Snapshot missing. Re-provisioning..."
-                vm.task_progress = 30
-                session.add(vm)
-                session.commit()
+                await _update_progress(session, vm, message="Snapshot missing. Re-provisioning...", progress=30, force=True)
                 
                 # Get current specs
-                specs = await run_in_threadpool(vm_service.get_vm_specs, vm.vmx_path)
+                specs = await run_bare(vm_service.get_vm_specs, vm.vmx_path)
                 
                 # Delete existing VM
                 try:
-                    await run_in_threadpool(vm_service.delete_vm, vm.vmx_path)
+                    await run_vmrun(vm_service.delete_vm, vm.vmx_path)
                 except Exception as e:
                     print(f"Delete VM failed (might not exist): {e}")
 
@@ -204,33 +280,21 @@ async def background_reinstall_vm(vm_id: int):
                 # vmrun deleteVM sometimes leaves files behind or fails if VM is broken
                 vm_dir = os.path.dirname(vm.vmx_path)
                 if os.path.exists(vm_dir):
-                    vm.task_message = "Cleaning up old files..."
-                    session.add(vm)
-                    session.commit()
+                    await _update_progress(session, vm, message="Cleaning up old files...")
                     try:
                         # Wait a moment for any locks to release
                         await asyncio.sleep(2)
-                        for filename in os.listdir(vm_dir):
-                            file_path = os.path.join(vm_dir, filename)
-                            try:
-                                if os.path.isfile(file_path) or os.path.islink(file_path):
-                                    os.unlink(file_path)
-                                elif os.path.isdir(file_path):
-                                    shutil.rmtree(file_path)
-                            except Exception as e:
-                                print(f"Failed to delete {file_path}: {e}")
+                        await asyncio.to_thread(_wipe_dir, vm_dir)
                     except Exception as e:
                         print(f"Failed to clean directory {vm_dir}: {e}")
 
                 # Clone from Template
-                vm.task_message = "Cloning new VM..."
-                session.add(vm)
-                session.commit()
+                await _update_progress(session, vm, message="Cloning new VM...", force=True)
 
                 safe_name = os.path.splitext(os.path.basename(vm.vmx_path))[0]
                 
                 try:
-                    await run_in_threadpool(
+                    await run_vmrun(
                         vm_service.clone_vm, 
                         settings.TEMPLATE_VM_PATH, 
                         vm.vmx_path, 
@@ -243,121 +307,124 @@ async def background_reinstall_vm(vm_id: int):
                     raise Exception(f"Clone failed: {e}")
                 
                 # Restore Specs
-                vm.task_message = "Restoring Specs..."
-                session.add(vm)
-                session.commit()
+                await _update_progress(session, vm, message="Restoring Specs...")
 
-                await run_in_threadpool(
+                await run_bare(
                     vm_service.update_specs,
                     vm.vmx_path,
                     specs.get("cpu_count", 2),
                     specs.get("memory_mb", 4096)
                 )
                 
-                # Create Base Snapshot for next time
-                await run_in_threadpool(
+                # Create Base Snapshot for next time; the VM is stopped, so it runs alongside
+                # the host-side DHCP reservation below and is awaited before the start
+                base_snapshot = asyncio.ensure_future(run_vmrun(
                     vm_service.create_snapshot,
                     vm.vmx_path,
                     settings.TEMPLATE_SNAPSHOT_NAME
-                )
+                ))
             
-            # Configure Host DHCP Reservation (if Internal IP is known)
-            # Note: guest-side config runs after VM starts and IP is confirmed
-            if getattr(vm, "internal_ip", None):
-                vm.task_message = "Configuring Network..."
-                session.add(vm)
-                session.commit()
-                try:
-                    await run_in_threadpool(
-                        vm_service.configure_static_ip,
-                        vm.vmx_path,
-                        vm.internal_ip,
-                        "255.255.255.0",
-                        settings.DEFAULT_GATEWAY,
-                        settings.DEFAULT_DNS,
-                        settings.BASE_SNAPSHOT_USER,
-                        settings.BASE_SNAPSHOT_PASSWORD
-                    )
-                except Exception as e:
-                    print(f"Failed to configure Host DHCP: {e}")
+            snapshot_outcome = None
+            try:
+                # Configure Host DHCP Reservation (if Internal IP is known)
+                # Note: guest-side config runs after VM starts and IP is confirmed
+                if getattr(vm, "internal_ip", None):
+                    await _update_progress(session, vm, message="Configuring Network...")
+                    try:
+                        await run_bare(
+                            vm_service.configure_static_ip,
+                            vm.vmx_path,
+                            vm.internal_ip,
+                            "255.255.255.0",
+                            settings.DEFAULT_GATEWAY,
+                            settings.DEFAULT_DNS,
+                            settings.BASE_SNAPSHOT_USER,
+                            settings.BASE_SNAPSHOT_PASSWORD
+                        )
+                    except Exception as e:
+                        print(f"Failed to configure Host DHCP: {e}")
+            finally:
+                if base_snapshot is not None:
+                    # Always wait for it: it must not keep running against the .vmx behind the
+                    # error path, and an earlier failure takes precedence over its own
+                    snapshot_outcome, = await asyncio.gather(base_snapshot, return_exceptions=True)
+            if isinstance(snapshot_outcome, BaseException):
+                raise snapshot_outcome
 
             # 3. Start VM — kill any hanging vmrun processes first to release .vmx lock
-            vm.task_message = "Starting VM..."
-            vm.task_progress = 50
-            session.add(vm)
-            session.commit()
+            await _update_progress(session, vm, message="Starting VM...", progress=50, force=True)
 
             # Clean up any orphaned vmrun processes that may be holding a lock
             try:
-                vm_service._kill_hanging_vmrun(vm.vmx_path, "getGuestIPAddress")
-                vm_service._kill_hanging_vmrun(vm.vmx_path, "runScriptInGuest")
+                # Walks the whole process table: keep it off the event loop
+                for command in ("getGuestIPAddress", "runScriptInGuest"):
+                    await run_bare(vm_service._kill_hanging_vmrun, vm.vmx_path, command)
                 await asyncio.sleep(1)  # Brief pause to let OS release file handles
             except Exception:
                 pass
 
-            await run_in_threadpool(vm_service.start_vm, vm.vmx_path)
+            await run_bare(vm_service.start_vm, vm.vmx_path)
             
             # 4. Wait for Tools / IP
-            vm.task_message = "Waiting for Network..."
-            vm.task_progress = 60
-            session.add(vm)
-            session.commit()
-
-            max_retries = 30  # 30 × 5s = 2.5 min max wait (reduced from 5 min)
+            await _update_progress(session, vm, message="Waiting for Network...", progress=60, force=True)
+
+            # Poll with backoff: catches a fast boot within a second or two, then
+            # backs off so a slow one doesn't spawn a vmrun every few seconds
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            deadline = started + GUEST_IP_WAIT_SECONDS
+            delay = 1.0
             ip = None
-            for i in range(max_retries):
-                # Update progress slightly during wait (60 -> 80)
-                if i % 3 == 0:
-                    vm.task_progress = 60 + int((i / max_retries) * 20)
-                    session.add(vm)
-                    session.commit()
+            while loop.time() < deadline:
+                # Update progress during wait (60 -> 80); _update_progress throttles the commits
+                elapsed = loop.time() - started
+                await _update_progress(session, vm, progress=60 + int((elapsed / GUEST_IP_WAIT_SECONDS) * 20))
 
                 try:
-                    ip = await run_in_threadpool(vm_service.get_guest_ip, vm.vmx_path)
-                    if ip:
-                        # Update Internal IP if not set (Auto-Learn)
-                        if not getattr(vm, "internal_ip", None):
-                            vm.internal_ip = ip
-                        
-                        session.add(vm)
-                        session.commit()
-                        
-                        # FORCE STATIC IP GUI UPDATE (Dual-Mode)
-                        if getattr(vm, "internal_ip", None):
-                            try:
-                                print(f"Applying Guest-Side Static IP Config for {vm.internal_ip}...")
-                                await run_in_threadpool(
-                                    vm_service.configure_static_ip,
-                                    vm.vmx_path,
-                                    vm.internal_ip,
-                                    "255.255.255.0",
-                                    settings.DEFAULT_GATEWAY,
-                                    settings.DEFAULT_DNS,
-                                    settings.BASE_SNAPSHOT_USER,
-                                    settings.BASE_SNAPSHOT_PASSWORD
-                                )
-                            except Exception as e:
-                                print(f"Failed to apply Guest-Side Static IP: {e}")
-                        
-                        break
-                except:
-                    pass
-                await asyncio.sleep(5)
+                    ip = await vm_service.get_guest_ip_async(vm.vmx_path)
+                except Exception:
+                    ip = None
+                if ip:
+                    break
+                await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+                delay = min(delay * 1.6, 10.0)
+
+            if ip:
+                # Update Internal IP if not set (Auto-Learn)
+                if not getattr(vm, "internal_ip", None):
+                    vm.internal_ip = ip
+                
+                await _update_progress(session, vm, force=True)
+                
+                # FORCE STATIC IP GUI UPDATE (Dual-Mode)
+                if getattr(vm, "internal_ip", None):
+                    try:
+                        print(f"Applying Guest-Side Static IP Config for {vm.internal_ip}...")
+                        await run_bare(
+                            vm_service.configure_static_ip,
+                            vm.vmx_path,
+                            vm.internal_ip,
+                            "255.255.255.0",
+                            settings.DEFAULT_GATEWAY,
+                            settings.DEFAULT_DNS,
+                            settings.BASE_SNAPSHOT_USER,
+                            settings.BASE_SNAPSHOT_PASSWORD
+                        )
+                    except Exception as e:
+                        print(f"Failed to apply Guest-Side Static IP: {e}")
             
             if not ip:
                 # VM is running but Tools aren't ready yet — warn but CONTINUE the reinstall
                 # so RDP bootstrap still runs. Tools may come up while we configure.
-                await send_vm_notification(vm, "reinstall", "Warning", "VMware Tools not ready — skipping IP detection, continuing bootstrap.")
-                vm.task_message = "Network timeout — continuing setup..."
-                vm.task_progress = 80
-                session.add(vm)
-                session.commit()
+                warning = "VMware Tools not ready — skipping IP detection, continuing bootstrap."
+                if settings.BATCH_NOTIFICATIONS:
+                    events.append({"name": "⚠️ Warning", "value": warning, "inline": False})
+                else:
+                    await send_vm_notification(vm, "reinstall", "Warning", warning)
+                await _update_progress(session, vm, message="Network timeout — continuing setup...", progress=80, force=True)
 
             # 5. Bootstrap
-            vm.task_message = "Configuring Admin User..."
-            vm.task_progress = 85
-            session.add(vm)
-            session.commit()
+            await _update_progress(session, vm, message="Configuring Admin User...", progress=85)
 
             # Always use Base Snapshot credentials because we just reverted to Base
             bootstrap_user = settings.BASE_SNAPSHOT_USER
@@ -366,68 +433,35 @@ async def background_reinstall_vm(vm_id: int):
             # Update DB to match Base credentials (Reset password)
             vm.guest_username = bootstrap_user
             vm.guest_password = bootstrap_pass
-            session.add(vm)
-            session.commit()
+            await _update_progress(session, vm, force=True)
 
             # 6. Configure RDP
             rdp_error = None  # Initialize here — referenced in notification block below regardless of rdp_port
             if vm.rdp_port:
-                vm.task_message = "Configuring RDP Firewall..."
-                vm.task_progress = 90
-                session.add(vm)
-                session.commit()
+                await _update_progress(session, vm, message="Configuring RDP Firewall...", progress=90, force=True)
 
-                script = f"""
-                $port = {vm.rdp_port}
-                
-                # Enable RDP 
-                Set-ItemProperty -Path 'HKLM:\\System\\CurrentControlSet\\Control\\Terminal Server' -Name 'fDenyTSConnections' -Value 0 
-                
-                # Set RDP port explicitly as DWORD 
-                Set-ItemProperty -Path 'HKLM:\\System\\CurrentControlSet\\Control\\Terminal Server\\WinStations\\RDP-Tcp' -Name 'PortNumber' -Value $port -Type DWord 
-                
-                # Disable default RDP firewall rules (3389) 
-                Get-NetFirewallRule -DisplayGroup "Remote Desktop" | Disable-NetFirewallRule 
-                
-                # Allow custom RDP port 
-                New-NetFirewallRule -DisplayName "RDP Custom Port $port" -Direction Inbound -Protocol TCP -LocalPort $port -Action Allow -Profile Any -ErrorAction SilentlyContinue 
-                
-                # Restart RDP service
-                Restart-Service TermService -Force 
-                
-                # Wait to ensure port bind 
-                Start-Sleep -Seconds 5 
-                
-                # Reboot to ensure settings apply
-                Restart-Computer -Force
-                """
-
-                # FIX: Do NOT join with semicolons because it makes comments (#) comment out the next command!
-                # Keep as multi-line string for the .ps1 file.
-                script_lines = [line.strip() for line in script.splitlines() if line.strip()]
-                script = "\n".join(script_lines)
+                script = _RDP_SCRIPT_TEMPLATE.format(port=vm.rdp_port)
                 
                 # Method 3: File Transfer + Execution (Most Robust)
-                # Create a persistent script file on the host
+                # Create a persistent script file on the host. Named by content hash, so
+                # VMs sharing an RDP port reuse one file and it is only written once.
                 scripts_dir = os.path.join("app", "scripts")
-                os.makedirs(scripts_dir, exist_ok=True)
                 
-                host_temp_script = os.path.join(scripts_dir, f"rdp_config_{vm.id}.ps1")
+                digest = hashlib.sha256(script.encode()).hexdigest()[:12]
+                host_temp_script = os.path.join(scripts_dir, f"rdp_config_{vm.rdp_port}_{digest}.ps1")
                 
                 # Use User Temp folder to avoid System Temp permission/scanning strictness
                 guest_temp_path = f"C:\\Users\\{bootstrap_user}\\AppData\\Local\\Temp\\rdp_config.ps1"
                 
-                with open(host_temp_script, "w") as f:
-                    f.write(script)
-                
-                host_script_abs_path = os.path.abspath(host_temp_script)
+                # File I/O (and the getcwd behind abspath) off the event loop, like the folder wipe above
+                host_script_abs_path = await asyncio.to_thread(_write_script_once, host_temp_script, script)
 
                 # We assume the Base snapshot has correct credentials and RDP enabled.
                 # Just run the script to change the port.
                 rdp_error = None
                 try:
                     # 1. Copy Script to Guest
-                    await run_in_threadpool(
+                    await run_bare(
                         vm_service.copy_file_to_guest,
                         vm.vmx_path,
                         host_script_abs_path,
@@ -444,7 +478,7 @@ async def background_reinstall_vm(vm_id: int):
                         "-File", guest_temp_path
                     ]
 
-                    await run_in_threadpool(
+                    await run_bare(
                         vm_service.run_program_in_guest,
                         vm.vmx_path, 
                         bootstrap_user, 
@@ -499,68 +533,152 @@ async def background_reinstall_vm(vm_id: int):
                     "inline": False
                 })
 
-            await send_vm_notification(vm, "reinstall", status_title, status_desc, fields=success_fields)
+            await send_vm_notification(vm, "reinstall", status_title, status_desc, fields=success_fields + events + _elapsed_field(started_at))
             
             # Completion
             vm.task_state = None
-            vm.task_progress = 0
             vm.task_message = None
-            session.add(vm)
-            session.commit()
+            await _update_progress(session, vm, progress=0, force=True)
             
         except Exception as e:
             vm.task_state = None
-            vm.task_message = f"Error: {str(e)}"
-            session.add(vm)
-            session.commit()
-            await send_vm_notification(vm, "reinstall", "Failed", str(e))
+            await _update_progress(session, vm, message=f"Error: {str(e)}", force=True)
+            await send_vm_notification(vm, "reinstall", "Failed", str(e), fields=events + _elapsed_field(started_at))
+        finally:
+            # The throttle only matters while a reinstall runs; don't keep one entry per VM forever
+            _progress_committed_at.pop(vm_id, None)
+
+async def get_running_vms() -> frozenset:
+    """Normalized paths of running VMs. VMService caches the set; only a stale cache costs a `vmrun list` subprocess."""
+    try:
+        return await vm_service.list_running_vms_async()
+    except Exception:
+        logger.warning("list_running_vms failed", exc_info=True)
+        # Keep serving the last known list rather than reporting everything stopped
+        return vm_service.last_running_vms()
+
+# Exactly what VMRead plus the running check read; guest/VNC secrets and alert
+# bookkeeping are never selected. Selected as plain columns, so rows come back as
+# named tuples with no VM instances or identity-map entries. Anything added to
+# VMRead must be added here too.
+_VM_LIST_COLUMNS = (
+    VM.id, VM.name, VM.vmx_path, VM.vmx_path_normalized, VM.owner_id, VM.expiration_date,
+    VM.rdp_ip, VM.rdp_port, VM.rdp_username, VM.internal_ip, VM.guest_username,
+    VM.task_state, VM.task_progress, VM.task_message,
+)
+
+# VMs serialized per slice when the list is streamed
+VM_LIST_CHUNK = 500
+
+def _vm_list_json(vms, running_vms: frozenset) -> bytes:
+    # Rows come straight from the DB, so skip per-field validation (model_construct)
+    return VMReadListAdapter.dump_json([
+        VMRead.model_construct(
+            id=vm.id, name=vm.name, vmx_path=vm.vmx_path, owner_id=vm.owner_id,
+            status="running" if vm.vmx_path and vm.vmx_path_normalized in running_vms else "stopped",
+            rdp_ip=vm.rdp_ip, rdp_port=vm.rdp_port, rdp_username=vm.rdp_username,
+            internal_ip=vm.internal_ip, guest_username=vm.guest_username,
+            expiration_date=vm.expiration_date,
+            task_state=vm.task_state, task_progress=vm.task_progress, task_message=vm.task_message,
+        )
+        for vm in vms
+    ])
+
+def _iter_vm_list_json(vms: list, running_vms: frozenset):
+    """One JSON array, VM_LIST_CHUNK models at a time: each slice's array brackets are cut off and re-joined with commas."""
+    yield b"["
+    for i in range(0, len(vms), VM_LIST_CHUNK):
+        if i:
+            yield b","
+        yield _vm_list_json(vms[i:i + VM_LIST_CHUNK], running_vms)[1:-1]
+    yield b"]"
 
 @router.get("/", response_model=List[VMRead])
-def read_my_vms(
+async def read_my_vms(
     current_user: User = Depends(get_current_active_user), 
     session: Session = Depends(get_session)
 ):
-    if current_user.role == Role.ADMIN:
-        vms = session.exec(select(VM)).all()
-    else:
-        vms = session.exec(select(VM).where(VM.owner_id == current_user.id)).all()
+    query = select(*_VM_LIST_COLUMNS)
+    if current_user.role != Role.ADMIN:
+        query = query.where(VM.owner_id == current_user.id)
     
-    results = []
-    try:
-        running_vms = vm_service.list_running_vms()
-    except Exception as e:
-        print(f"Error listing VMs: {e}")
-        running_vms = []
-        
-    for vm in vms:
-        is_running = False
-        if vm.vmx_path:
-            normalized_vm_path = os.path.normpath(vm.vmx_path).lower()
-            is_running = normalized_vm_path in running_vms
-            
-        status_str = "running" if is_running else "stopped"
-        vm_read = VMRead.from_orm(vm)
-        vm_read.status = status_str
-        results.append(vm_read)
-        
-    return results
+    # Sync DB read goes to the threadpool and overlaps with the vmrun list call
+    vms, running_vms = await asyncio.gather(
+        run_in_threadpool(lambda: session.exec(query).all()),
+        get_running_vms(),
+    )
+    
+    # Serialize the list in one go instead of FastAPI's per-item response_model pass;
+    # a large (admin) list goes out in VM_LIST_CHUNK slices so its JSON is never built whole
+    if len(vms) <= VM_LIST_CHUNK:
+        return Response(content=_vm_list_json(vms, running_vms), media_type="application/json")
+    return StreamingResponse(_iter_vm_list_json(vms, running_vms), media_type="application/json")
+
+@router.get("/status")
+async def read_my_vm_statuses(
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    """Power state of every VM the caller can see, from a single `vmrun list`."""
+    query = select(VM.id, VM.vmx_path_normalized)
+    if current_user.role != Role.ADMIN:
+        query = query.where(VM.owner_id == current_user.id)
+    
+    rows, running_vms = await asyncio.gather(
+        run_in_threadpool(lambda: session.exec(query).all()),
+        get_running_vms(),
+    )
+    return {row.id: "running" if row.vmx_path_normalized in running_vms else "stopped" for row in rows}
+
+class VMBatchRequest(BaseModel):
+    vm_ids: List[int]
+
+def _visible_vms_query(current_user: User, vm_ids: List[int]):
+    query = select(VM.id, VM.vmx_path, VM.vmx_path_normalized, VM.guest_username, VM.guest_password).where(VM.id.in_(vm_ids))
+    if current_user.role != Role.ADMIN:
+        query = query.where(VM.owner_id == current_user.id)
+    return query
+
+@router.post("/snapshots:batch")
+async def batch_list_snapshots(
+    request: VMBatchRequest,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    """Snapshots of several VMs in one call, listed in parallel. VMs the caller can't see are left out."""
+    query = _visible_vms_query(current_user, request.vm_ids)
+    rows = await run_in_threadpool(lambda: session.exec(query).all())
+    snapshots = await run_bare(vm_service.batch_list_snapshots, [row.vmx_path for row in rows])
+    return {row.id: snapshots[row.vmx_path] for row in rows}
+
+@router.post("/ips:batch")
+async def batch_get_vm_ips(
+    request: VMBatchRequest,
+    current_user: User = Depends(get_current_active_user),
+    session: Session = Depends(get_session)
+):
+    """Guest IPs of several VMs in one call; stopped VMs are reported without asking vmrun."""
+    query = _visible_vms_query(current_user, request.vm_ids)
+    rows, running_vms = await asyncio.gather(
+        run_in_threadpool(lambda: session.exec(query).all()),
+        get_running_vms(),
+    )
+    running = [row for row in rows if row.vmx_path_normalized in running_vms]
+    ips = await run_bare(
+        vm_service.batch_get_guest_ips,
+        [(row.vmx_path, row.guest_username, row.guest_password) for row in running],
+    )
+    return {row.id: ips.get(row.vmx_path, "VM is stopped") for row in rows}
 
 @router.get("/{vm_id}", response_model=VMRead)
 async def read_vm(
     vm_id: int,
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_session)
+    vm: VM = Depends(get_owned_vm)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    if vm.owner_id != current_user.id and current_user.role != Role.ADMIN:
-         raise HTTPException(status_code=403, detail="Not authorized")
-    
     # Check running status
     is_running = False
     try:
-        if vm.vmx_path and vm_service.is_running(vm.vmx_path):
+        if vm.vmx_path and vm.vmx_path_normalized in await get_running_vms():
             is_running = True
     except:
         pass
@@ -572,42 +690,104 @@ async def read_vm(
 @router.get("/{vm_id}/stats")
 async def get_vm_stats(
     vm_id: int,
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_session)
+    vm: VM = Depends(get_owned_vm)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    if vm.owner_id != current_user.id and current_user.role != Role.ADMIN:
-         raise HTTPException(status_code=403, detail="Not authorized")
-    
-    stats = await run_in_threadpool(vm_service.get_vm_stats, vm.vmx_path)
+    stats = await run_bare(vm_service.get_vm_stats, vm.vmx_path)
     if not stats:
         return {"cpu_percent": 0, "memory_mb": 0}
         
     return stats
 
+SCREENSHOT_DIR = os.path.join("app", "static", "screenshots")
+SCREENSHOT_CACHE_SECONDS = 2
+
+# Known vmrun captureScreen failures -> user-facing message; matched with one regex scan
+_SCREENSHOT_ERRORS = {
+    "Anonymous guest operations are not allowed": "Guest credentials required. Set the guest username/password in the VM's RDP settings.",
+    "Invalid user name or password": "Invalid Guest Credentials. Update the guest username/password in the VM's RDP settings.",
+}
+_SCREENSHOT_ERROR_RE = re.compile("|".join(re.escape(k) for k in _SCREENSHOT_ERRORS))
+# vm_id -> (monotonic time, PNG bytes, ETag) of the last screenshot grabbed over VNC;
+# entries expire just after they stop being served, so idle VMs don't keep their PNG
+_vnc_screenshots: TTLCache = TTLCache(maxsize=256, ttl=SCREENSHOT_CACHE_SECONDS + 1)
+
+@router.get("/{vm_id}/screenshot")
+async def get_vm_screenshot(
+    vm_id: int,
+    request: Request,
+    vm: VM = Depends(get_owned_vm)
+):
+    if vm.vmx_path_normalized not in await get_running_vms():
+        raise HTTPException(status_code=400, detail="VM must be running")
+
+    headers = {"Cache-Control": f"private, max-age={SCREENSHOT_CACHE_SECONDS}"}
+    # VNC enabled: read the framebuffer straight off the VM's VNC server, kept in memory.
+    # Falls through to vmrun captureScreen when VNC isn't up (e.g. enabled but not restarted yet)
+    if vm.vnc_enabled and vm.vnc_port:
+        cached = _vnc_screenshots.get(vm_id)
+        if cached is None or time.monotonic() - cached[0] >= SCREENSHOT_CACHE_SECONDS:
+            try:
+                png = await grab_screen_png(vm.vnc_port, vm.vnc_password)
+            except Exception as e:
+                logger.debug(f"VNC screenshot of VM {vm_id} failed, using vmrun: {e!r}")
+                cached = None
+            else:
+                cached = _vnc_screenshots[vm_id] = (time.monotonic(), png, f'"{zlib.crc32(png):08x}"')
+        if cached is not None:
+            _, png, headers["ETag"] = cached
+            if request.headers.get("if-none-match") == headers["ETag"]:
+                return Response(status_code=304, headers=headers)
+            headers["Content-Disposition"] = f'inline; filename="vm_{vm_id}.png"'
+            return Response(png, media_type="image/png", headers=headers)
+    
+    file_path = os.path.abspath(os.path.join(SCREENSHOT_DIR, f"vm_{vm_id}_screenshot.png"))
+    # Polls inside the throttle window reuse the last capture instead of running vmrun again
+    try:
+        st = os.stat(file_path)
+        fresh = time.time() - st.st_mtime < SCREENSHOT_CACHE_SECONDS
+    except OSError:
+        fresh = False
+    
+    if not fresh:
+        try:
+            await run_bare(vm_service.capture_screen, vm.vmx_path, file_path, vm.guest_username, vm.guest_password)
+        except Exception as e:
+            match = _SCREENSHOT_ERROR_RE.search(str(e))
+            if match:
+                raise HTTPException(status_code=400, detail=_SCREENSHOT_ERRORS[match.group(0)])
+            raise HTTPException(status_code=500, detail=str(e))
+        st = os.stat(file_path)
+    
+    # stat_result: reuse the stat above instead of another one inside FileResponse; body goes out via sendfile
+    response = FileResponse(
+        file_path, media_type="image/png", stat_result=st, headers=headers,
+        filename=f"vm_{vm_id}.png", content_disposition_type="inline",
+    )
+    # Unchanged image: 304 and skip the body
+    if request.headers.get("if-none-match") == response.headers["etag"]:
+        headers["ETag"] = response.headers["etag"]
+        return Response(status_code=304, headers=headers)
+    return response
+
 @router.post("/{vm_id}/start")
 async def start_vm(
     vm_id: int, 
     current_user: User = Depends(get_current_active_user),
+    vm: VM = Depends(get_owned_vm),
     session: Session = Depends(get_session)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    if vm.owner_id != current_user.id and current_user.role != Role.ADMIN:
-         raise HTTPException(status_code=403, detail="Not authorized")
-    
     try:
+        _release_connection(session)
         if not vm.vnc_port:
             vm.vnc_port = 5900 + vm.id
             vm.vnc_enabled = True
-            session.add(vm)
+            session.execute(update(VM).where(VM.id == vm_id).values(vnc_port=vm.vnc_port, vnc_enabled=True))
             session.commit()
+            # The write's connection goes back to the pool before the multi-second start
+            _release_connection(session)
             
-        vm_service.enable_vnc(vm.vmx_path, vm.vnc_port, vm.vnc_password)
-        vm_service.start_vm(vm.vmx_path)
+        await run_bare(vm_service.enable_vnc, vm.vmx_path, vm.vnc_port, vm.vnc_password)
+        await run_bare(vm_service.start_vm, vm.vmx_path)
         log_action(current_user.id, "start", vm_id)
         
         await send_vm_notification(vm, "start")
@@ -621,16 +801,12 @@ async def start_vm(
 async def stop_vm(
     vm_id: int, 
     current_user: User = Depends(get_current_active_user),
+    vm: VM = Depends(get_owned_vm),
     session: Session = Depends(get_session)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    if vm.owner_id != current_user.id and current_user.role != Role.ADMIN:
-         raise HTTPException(status_code=403, detail="Not authorized")
-    
     try:
-        vm_service.stop_vm(vm.vmx_path)
+        _release_connection(session)
+        await run_bare(vm_service.stop_vm, vm.vmx_path)
         log_action(current_user.id, "stop", vm_id)
         
         await send_vm_notification(vm, "stop")
@@ -644,16 +820,12 @@ async def stop_vm(
 async def restart_vm(
     vm_id: int, 
     current_user: User = Depends(get_current_active_user),
+    vm: VM = Depends(get_owned_vm),
     session: Session = Depends(get_session)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    if vm.owner_id != current_user.id and current_user.role != Role.ADMIN:
-         raise HTTPException(status_code=403, detail="Not authorized")
-    
     try:
-        vm_service.restart_vm(vm.vmx_path)
+        _release_connection(session)
+        await run_bare(vm_service.restart_vm, vm.vmx_path)
         log_action(current_user.id, "restart", vm_id)
         
         await send_vm_notification(vm, "restart")
@@ -668,16 +840,9 @@ async def set_static_ip(
     vm_id: int, 
     request: VMStaticIPRequest,
     current_user: User = Depends(get_current_active_user),
+    vm: VM = Depends(get_owned_vm),
     session: Session = Depends(get_session)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    
-    # Check permission (owner or admin)
-    if current_user.role != Role.ADMIN and vm.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized")
-        
     if not vm.guest_username or not vm.guest_password:
         raise HTTPException(status_code=400, detail="Guest credentials (username/password) are required to set Static IP. Please update VM details first.")
         
@@ -685,7 +850,8 @@ async def set_static_ip(
         # Note: We no longer require the VM to be running.
         # If it's off, we just configure the Host DHCP, and it will pick it up on boot.
         
-        await run_in_threadpool(
+        _release_connection(session)
+        await run_bare(
             vm_service.configure_static_ip, 
             vm.vmx_path, 
             request.ip, 
@@ -698,10 +864,10 @@ async def set_static_ip(
         
         # Update DB record to reflect the new Static IP
         vm.internal_ip = request.ip
-        session.add(vm)
+        session.execute(update(VM).where(VM.id == vm_id).values(internal_ip=request.ip))
+        log_action(current_user.id, "static_ip", vm_id, f"Set IP to {request.ip}", session=session)
         session.commit()
         
-        log_action(current_user.id, "static_ip", vm_id, f"Set IP to {request.ip}")
         await send_vm_notification(vm, "network_change", "Success", f"Static IP set to {request.ip}")
         
         return {"status": "success", "message": f"Static IP {request.ip} configured"}
@@ -723,31 +889,22 @@ async def update_rdp_settings(
     current_user: User = Depends(get_current_active_user),
     session: Session = Depends(get_session)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    
-    # Check permission
+    # Check permission first: a non-admin is refused without touching the database
     # Security Restriction: Only Admins can change RDP settings (IP/Port) to prevent hijacking
     if current_user.role != Role.ADMIN:
         raise HTTPException(status_code=403, detail="Only Administrators can change RDP settings.")
 
+    vm = session.get(VM, vm_id)
+    if not vm:
+        raise HTTPException(status_code=404, detail="VM not found")
+
     try:
-        vm.rdp_ip = request.rdp_ip
-        vm.rdp_port = request.rdp_port
-        vm.rdp_username = request.rdp_username
-        
-        # Only update guest creds if provided (to allow partial updates if needed)
-        # But based on UI, they are sent.
-        if request.guest_username is not None:
-            vm.guest_username = request.guest_username
-        if request.guest_password is not None:
-            vm.guest_password = request.guest_password
-            
+        # Guest creds are optional (None = keep the current ones), so drop unset fields
+        vm.sqlmodel_update(request.model_dump(exclude_none=True))
         session.add(vm)
+        log_action(current_user.id, "update_rdp", vm_id, f"Updated RDP settings (Port: {request.rdp_port})", session=session)
         session.commit()
         
-        log_action(current_user.id, "update_rdp", vm_id, f"Updated RDP settings (Port: {vm.rdp_port})")
         return {"status": "success", "message": "RDP settings updated successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -762,16 +919,10 @@ async def change_password(
     vm_id: int,
     request: ChangePasswordRequest,
     current_user: User = Depends(get_current_active_user),
+    vm: VM = Depends(get_owned_vm),
     session: Session = Depends(get_session)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    
-    if current_user.role != Role.ADMIN and vm.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    
-    if not vm_service.is_running(vm.vmx_path):
+    if vm.vmx_path_normalized not in await get_running_vms():
         raise HTTPException(status_code=400, detail="VM must be running to change password.")
         
     # Use existing credentials to perform the change
@@ -785,7 +936,8 @@ async def change_password(
         
     try:
         # Change password via net user
-        await run_in_threadpool(
+        _release_connection(session)
+        await run_bare(
             vm_service.change_guest_password,
             vm.vmx_path,
             current_guest_user, # User to change
@@ -796,14 +948,14 @@ async def change_password(
         
         # Update DB
         vm.guest_password = request.new_password
-        session.add(vm)
+        session.execute(update(VM).where(VM.id == vm_id).values(guest_password=request.new_password))
+        log_action(current_user.id, "change_password", vm_id, "Changed Guest Password", session=session)
         session.commit()
         
-        log_action(current_user.id, "change_password", vm_id, "Changed Guest Password")
         await send_vm_notification(vm, "security", "Success", "Guest Password Changed")
         
         if request.force_restart:
-             await run_in_threadpool(vm_service.restart_vm, vm.vmx_path, hard=True)
+             await run_bare(vm_service.restart_vm, vm.vmx_path, hard=True)
              return {"message": "Password changed and VM restarted."}
              
         return {"message": "Password changed successfully."}
@@ -813,75 +965,54 @@ async def change_password(
         raise HTTPException(status_code=500, detail=f"Failed to change password: {str(e)}")
 
 @router.get("/{vm_id}/snapshots")
-async def list_snapshots(vm_id: int, current_user: User = Depends(get_current_active_user), session: Session = Depends(get_session)):
-    vm = session.get(VM, vm_id)
-    if not vm: raise HTTPException(status_code=404, detail="VM not found")
-    if current_user.role != Role.ADMIN and vm.owner_id != current_user.id: raise HTTPException(status_code=403, detail="Not authorized")
-    
+async def list_snapshots(vm_id: int, current_user: User = Depends(get_current_active_user), vm: VM = Depends(get_owned_vm)):
     try:
-        return await run_in_threadpool(vm_service.list_snapshots, vm.vmx_path)
+        return await run_bare(vm_service.list_snapshots, vm.vmx_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{vm_id}/snapshots")
-async def create_snapshot(vm_id: int, name: str, current_user: User = Depends(get_current_active_user), session: Session = Depends(get_session)):
-    vm = session.get(VM, vm_id)
-    if not vm: raise HTTPException(status_code=404, detail="VM not found")
-    if current_user.role != Role.ADMIN and vm.owner_id != current_user.id: raise HTTPException(status_code=403, detail="Not authorized")
-
+async def create_snapshot(vm_id: int, name: str, current_user: User = Depends(get_current_active_user), vm: VM = Depends(get_owned_vm)):
     try:
-        await run_in_threadpool(vm_service.create_snapshot, vm.vmx_path, name)
+        await run_vmrun(vm_service.create_snapshot, vm.vmx_path, name)
         log_action(current_user.id, "snapshot_create", vm_id, f"Created snapshot: {name}")
         return {"message": "Snapshot created"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{vm_id}/snapshots/revert")
-async def revert_snapshot(vm_id: int, name: str, current_user: User = Depends(get_current_active_user), session: Session = Depends(get_session)):
-    vm = session.get(VM, vm_id)
-    if not vm: raise HTTPException(status_code=404, detail="VM not found")
-    if current_user.role != Role.ADMIN and vm.owner_id != current_user.id: raise HTTPException(status_code=403, detail="Not authorized")
-
+async def revert_snapshot(vm_id: int, name: str, current_user: User = Depends(get_current_active_user), vm: VM = Depends(get_owned_vm)):
     try:
-        await run_in_threadpool(vm_service.revert_to_snapshot, vm.vmx_path, name)
+        await run_vmrun(vm_service.revert_to_snapshot, vm.vmx_path, name)
         log_action(current_user.id, "snapshot_revert", vm_id, f"Reverted to snapshot: {name}")
         return {"message": "Reverted to snapshot"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{vm_id}/snapshots")
-async def delete_snapshot(vm_id: int, name: str, current_user: User = Depends(get_current_active_user), session: Session = Depends(get_session)):
-    vm = session.get(VM, vm_id)
-    if not vm: raise HTTPException(status_code=404, detail="VM not found")
-    if current_user.role != Role.ADMIN and vm.owner_id != current_user.id: raise HTTPException(status_code=403, detail="Not authorized")
-
+async def delete_snapshot(vm_id: int, name: str, current_user: User = Depends(get_current_active_user), vm: VM = Depends(get_owned_vm)):
     try:
-        await run_in_threadpool(vm_service.delete_snapshot, vm.vmx_path, name)
+        await run_vmrun(vm_service.delete_snapshot, vm.vmx_path, name)
         log_action(current_user.id, "snapshot_delete", vm_id, f"Deleted snapshot: {name}")
         return {"message": "Snapshot deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{vm_id}/ip")
-async def get_vm_ip(vm_id: int, current_user: User = Depends(get_current_active_user), session: Session = Depends(get_session)):
-    vm = session.get(VM, vm_id)
-    if not vm: raise HTTPException(status_code=404, detail="VM not found")
-    if current_user.role != Role.ADMIN and vm.owner_id != current_user.id: raise HTTPException(status_code=403, detail="Not authorized")
-
-    if not vm_service.is_running(vm.vmx_path):
+async def get_vm_ip(vm_id: int, current_user: User = Depends(get_current_active_user), vm: VM = Depends(get_owned_vm), session: Session = Depends(get_session)):
+    if vm.vmx_path_normalized not in await get_running_vms():
         return {"ip": "VM is stopped"}
         
     try:
-        ip = await run_in_threadpool(vm_service.get_guest_ip, vm.vmx_path, vm.guest_username, vm.guest_password)
+        _release_connection(session)
+        ip = await vm_service.get_guest_ip_async(vm.vmx_path, vm.guest_username, vm.guest_password)
         # Update DB cache if found
         if ip and "Unknown" not in ip:
             # Auto-Learn Internal IP if missing
             # This allows the system to "finger out" the IP automatically for existing VMs
             if not vm.internal_ip:
-                 vm.internal_ip = ip
-
-            session.add(vm)
-            session.commit()
+                 session.execute(update(VM).where(VM.id == vm_id).values(internal_ip=ip))
+                 session.commit()
         return {"ip": ip}
     except Exception as e:
          raise HTTPException(status_code=500, detail=str(e))
@@ -889,22 +1020,19 @@ async def get_vm_ip(vm_id: int, current_user: User = Depends(get_current_active_
 @router.post("/{vm_id}/reinstall")
 async def reinstall_vm(
     vm_id: int, 
-    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_session)
+    vm: VM = Depends(get_owned_vm)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    if current_user.role != Role.ADMIN and vm.owner_id != current_user.id:
-         raise HTTPException(status_code=403, detail="Not authorized")
-    
     # Check if running? Reinstall usually forces stop.
     
+    try:
+        job_id = job_queue.submit(f"reinstall:{vm_id}", background_reinstall_vm, vm_id)
+    except ValueError:
+        raise HTTPException(status_code=409, detail="A reinstall is already queued or running for this VM")
     log_action(current_user.id, "reinstall", vm_id, "Triggered Reinstall")
-    background_tasks.add_task(background_reinstall_vm, vm_id)
     
-    return {"message": "Reinstall started. This will take a few minutes."}
+    # Progress is reported through the VM's task_state / task_progress / task_message
+    return {"message": "Reinstall started. This will take a few minutes.", "job_id": job_id}
 
 class TroubleshootRequest(BaseModel):
     command: str
@@ -914,14 +1042,9 @@ async def run_troubleshoot_command(
     vm_id: int,
     request: TroubleshootRequest,
     current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_session)
+    vm: VM = Depends(get_owned_vm)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    if vm.owner_id != current_user.id and current_user.role != Role.ADMIN:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    if not vm_service.is_running(vm.vmx_path):
+    if vm.vmx_path_normalized not in await get_running_vms():
         raise HTTPException(status_code=400, detail="VM must be running")
 
     bootstrap_user = vm.guest_username or settings.BASE_SNAPSHOT_USER
@@ -933,7 +1056,7 @@ async def run_troubleshoot_command(
             "-ExecutionPolicy", "Bypass",
             "-Command", request.command
         ]
-        await run_in_threadpool(
+        await run_bare(
             vm_service.run_program_in_guest,
             vm.vmx_path,
             bootstrap_user,
@@ -948,68 +1071,73 @@ async def run_troubleshoot_command(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Only address, port and username vary per VM; everything else is fixed
+_RDP_TEMPLATE = (
+    "full address:s:{addr}:{port}\n"
+    "username:s:{user}\n"
+    "screen mode id:i:2\n"
+    "session bpp:i:32\n"
+    "compression:i:1\n"
+    "keyboardhook:i:2\n"
+    "audiocapturemode:i:0\n"
+    "videoplaybackmode:i:1\n"
+    "connection type:i:7\n"
+    "networkautodetect:i:1\n"
+    "bandwidthautodetect:i:1\n"
+    "displayconnectionbar:i:1\n"
+    "enableworkspacereconnect:i:0\n"
+    "disable wallpaper:i:0\n"
+    "allow font smoothing:i:0\n"
+    "allow desktop composition:i:0\n"
+    "disable full window drag:i:1\n"
+    "disable menu anims:i:1\n"
+    "disable themes:i:0\n"
+    "disable cursor setting:i:0\n"
+    "bitmapcachepersistenable:i:1\n"
+    "audiomode:i:0\n"
+    "redirectprinters:i:0\n"
+    "redirectcomports:i:0\n"
+    "redirectsmartcards:i:0\n"
+    "redirectclipboard:i:1\n"
+    "redirectposdevices:i:0\n"
+    "drivestoredirect:s:\n"
+    "autoreconnection enabled:i:1\n"
+    "authentication level:i:2\n"
+    "prompt for credentials:i:0\n"
+    "negotiate security layer:i:1\n"
+    "remoteapplicationmode:i:0\n"
+    "alternate shell:s:\n"
+    "shell working directory:s:\n"
+    "gatewayhostname:s:\n"
+    "gatewayusagemethod:i:4\n"
+    "gatewaycredentialssource:i:4\n"
+    "gatewayprofileusagemethod:i:0\n"
+    "promptcredentialonce:i:0\n"
+    "use redirection server name:i:0\n"
+    "rdgiskdcproxy:i:0\n"
+    "kdcproxyname:s:\n"
+)
+
+@lru_cache(maxsize=256)
+def _rdp_payload(addr: str, port: int, user: str) -> bytes:
+    # Encoded once per distinct connection target; Response sends bytes as-is
+    return _RDP_TEMPLATE.format(addr=addr, port=port, user=user).encode("utf-8")
+
+@router.get("/{vm_id}/rdp/download")
 async def download_rdp_file(
     vm_id: int,
-    current_user: User = Depends(get_current_active_user),
-    session: Session = Depends(get_session)
+    vm: VM = Depends(get_owned_vm)
 ):
-    vm = session.get(VM, vm_id)
-    if not vm:
-        raise HTTPException(status_code=404, detail="VM not found")
-    if current_user.role != Role.ADMIN and vm.owner_id != current_user.id:
-         raise HTTPException(status_code=403, detail="Not authorized")
-
-    rdp_content = f"""
-full address:s:{vm.rdp_ip}:{vm.rdp_port}
-username:s:{vm.rdp_username or 'Administrator'}
-screen mode id:i:2
-session bpp:i:32
-compression:i:1
-keyboardhook:i:2
-audiocapturemode:i:0
-videoplaybackmode:i:1
-connection type:i:7
-networkautodetect:i:1
-bandwidthautodetect:i:1
-displayconnectionbar:i:1
-enableworkspacereconnect:i:0
-disable wallpaper:i:0
-allow font smoothing:i:0
-allow desktop composition:i:0
-disable full window drag:i:1
-disable menu anims:i:1
-disable themes:i:0
-disable cursor setting:i:0
-bitmapcachepersistenable:i:1
-audiomode:i:0
-redirectprinters:i:0
-redirectcomports:i:0
-redirectsmartcards:i:0
-redirectclipboard:i:1
-redirectposdevices:i:0
-drivestoredirect:s:
-autoreconnection enabled:i:1
-authentication level:i:2
-prompt for credentials:i:0
-negotiate security layer:i:1
-remoteapplicationmode:i:0
-alternate shell:s:
-shell working directory:s:
-gatewayhostname:s:
-gatewayusagemethod:i:4
-gatewaycredentialssource:i:4
-gatewayprofileusagemethod:i:0
-promptcredentialonce:i:0
-use redirection server name:i:0
-rdgiskdcproxy:i:0
-kdcproxyname:s:
-"""
+    rdp_content = _rdp_payload(vm.rdp_ip, vm.rdp_port, vm.rdp_username or 'Administrator')
     
     headers = {
         'Content-Disposition': f'attachment; filename="vm_{vm_id}.rdp"'
     }
     return Response(content=rdp_content, media_type="application/x-rdp", headers=headers)
 
+VNC_READ_SIZE = 64 * 1024
+VNC_SOCKET_BUFFER = 256 * 1024
+
 @router.websocket("/{vm_id}/vnc")
 async def vnc_proxy(websocket: WebSocket, vm_id: int, token: str = None, session: Session = Depends(get_session)):
     await websocket.accept()
@@ -1019,15 +1147,11 @@ async def vnc_proxy(websocket: WebSocket, vm_id: int, token: str = None, session
         await websocket.close(code=4401)
         return
     try:
-        from app.core.config import settings as _s
-        from jose import jwt as _jwt, JWTError
-        payload = _jwt.decode(token, _s.SECRET_KEY, algorithms=[_s.ALGORITHM])
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username = payload.get("sub")
         if not username:
             raise ValueError("no sub")
-        from sqlmodel import select as _select
-        from app.models.user import User as _User
-        user = session.exec(_select(_User).where(_User.username == username)).first()
+        user = session.exec(select(User).where(User.username == username)).first()
         if not user or not user.is_active:
             raise ValueError("invalid user")
         # Non-admins can only connect to their own VMs
@@ -1035,38 +1159,54 @@ async def vnc_proxy(websocket: WebSocket, vm_id: int, token: str = None, session
         if not vm:
             await websocket.close(code=4404)
             return
-        if user.role != "admin" and vm.owner_id != user.id:
+        if user.role != Role.ADMIN and vm.owner_id != user.id:
             await websocket.close(code=4403)
             return
     except Exception:
         await websocket.close(code=4401)
         return
 
-    vm = session.get(VM, vm_id)
-    if not vm or not vm.vnc_port:
+    if not vm.vnc_port:
         await websocket.close(code=1000)
         return
 
+    # Raw non-blocking socket driven by loop.sock_* calls rather than a StreamReader/Writer pair:
+    # sock_recv hands back the kernel's bytes directly, without the extra copy through the
+    # stream's internal buffer. Runs the same on uvloop (run.py) and Windows' proactor loop.
+    loop = asyncio.get_running_loop()
+    vnc_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    vnc_sock.setblocking(False)
+    # Framebuffer updates are bursty and large: no Nagle delay on input events, and room
+    # in the kernel buffers for whole updates (set before connect so the window scale covers it)
     try:
-        reader, writer = await asyncio.open_connection('127.0.0.1', vm.vnc_port)
+        vnc_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        vnc_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, VNC_SOCKET_BUFFER)
+        vnc_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, VNC_SOCKET_BUFFER)
+    except OSError as e:
+        logger.debug("VNC socket tuning failed: %s", e)
+
+    try:
+        await loop.sock_connect(vnc_sock, ('127.0.0.1', vm.vnc_port))
     except Exception as e:
-        print(f"VNC Connect Error: {e}")
+        vnc_sock.close()
+        logger.warning("VNC connect to port %s failed: %s", vm.vnc_port, e)
         await websocket.close(code=1011) # Internal Error
         return
 
     async def forward_client_to_server():
         try:
-            while True:
-                data = await websocket.receive_bytes()
-                writer.write(data)
-                await writer.drain()
+            # iter_bytes ends cleanly on disconnect instead of raising out of receive_bytes
+            async for data in websocket.iter_bytes():
+                # Input events are tiny and almost always fit the send buffer at once;
+                # sock_sendall only suspends when the kernel falls behind
+                await loop.sock_sendall(vnc_sock, data)
         except Exception:
             pass
 
     async def forward_server_to_client():
         try:
             while True:
-                data = await reader.read(4096)
+                data = await loop.sock_recv(vnc_sock, VNC_READ_SIZE)
                 if not data:
                     break
                 await websocket.send_bytes(data)
@@ -1074,13 +1214,15 @@ async def vnc_proxy(websocket: WebSocket, vm_id: int, token: str = None, session
             pass
 
     try:
-        await asyncio.gather(forward_client_to_server(), forward_server_to_client())
+        # Whichever side closes first ends the session; don't leave the other pump waiting
+        pumps = [asyncio.create_task(forward_client_to_server()), asyncio.create_task(forward_server_to_client())]
+        _, pending = await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        # Let cancelled pumps unwind before the socket goes away under them
+        await asyncio.gather(*pending, return_exceptions=True)
     finally:
-        try:
-            writer.close()
-            await writer.wait_closed()
-        except:
-            pass
+        vnc_sock.close()
         try:
              await websocket.close()
         except:
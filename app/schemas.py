@@ -1,4 +1,4 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, TypeAdapter
 from typing import Optional, List
 from datetime import datetime
 from app.models.user import Role
@@ -58,6 +58,13 @@ class VMRead(VMBase):
 
     model_config = ConfigDict(from_attributes=True)
 
+# One compiled serializer for whole VM lists: a single pydantic-core pass straight to JSON bytes
+VMReadListAdapter = TypeAdapter(List[VMRead])
+
+class VMPage(BaseModel):
+    items: List[VMRead]
+    next: Optional[int] = None  # pass as after_id to fetch the following page
+
 class VMUpdate(BaseModel):
     name: Optional[str] = None
     vmx_path: Optional[str] = None
@@ -106,3 +113,55 @@ class ScheduledTaskRead(BaseModel):
 class ScheduledTaskUpdate(BaseModel):
     run_at: Optional[datetime] = None
     snapshot_name: Optional[str] = None
+
+
+# ── msgspec response structs ───────────────────────────────────────────────────
+# Used by the large admin list endpoints, which encode with msgspec directly
+# instead of validating every row through a Pydantic response_model.
+import msgspec  # noqa: E402
+
+
+class VMReadStruct(msgspec.Struct):
+    id: int
+    name: str
+    vmx_path: str
+    owner_id: Optional[int] = None
+    status: Optional[str] = "unknown"
+    rdp_ip: str = "remotedesktop.penguinhosting.host"
+    rdp_port: int = 3389
+    rdp_username: Optional[str] = "Administrator"
+    internal_ip: Optional[str] = None
+    guest_username: Optional[str] = None
+    # guest_password intentionally excluded from API responses (security)
+    expiration_date: Optional[datetime] = None
+    task_state: Optional[str] = None
+    task_progress: int = 0
+    task_message: Optional[str] = None
+
+
+class UserReadStruct(msgspec.Struct):
+    id: int
+    username: str
+    is_active: bool = True
+    role: Role = Role.USER
+    discord_webhook_url: Optional[str] = None
+    discord_webhook_public: Optional[str] = None
+
+
+class AuditLogStruct(msgspec.Struct):
+    id: int
+    user_id: int
+    action: str
+    vm_id: Optional[int] = None
+    timestamp: Optional[datetime] = None
+    details: Optional[str] = None
+
+
+def to_struct(struct_type, obj):
+    """Build a msgspec struct from an ORM object or row, copying only the struct's fields."""
+    return struct_type(**{f: getattr(obj, f) for f in struct_type.__struct_fields__ if hasattr(obj, f)})
+
+
+def struct_columns(model, struct_type) -> list:
+    """Model columns backing a struct, for select(*...) without hydrating ORM objects."""
+    return [getattr(model, f) for f in struct_type.__struct_fields__ if f in model.__table__.columns]
@@ -0,0 +1,83 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+from app.core.database import engine
+from app.models.audit import AuditLog
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL_SECONDS = 2.0
+
+_fromtimestamp = datetime.fromtimestamp
+_UTC = timezone.utc
+
+class AuditQueue:
+    """
+    Buffers audit rows written from request handlers and inserts them in batches,
+    so a start/stop/snapshot call doesn't wait on its own INSERT + COMMIT.
+    The flusher (run) is started and drained by the lifespan in main.py.
+    """
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # Rows taken off the queue but not yet handed to the database
+        self._batch = []
+        # Long-lived session owned by the flusher; flushes never overlap, so it is
+        # only ever used by one threadpool thread at a time
+        self._session: Session = None
+
+    def log(self, user_id: int, action: str, vm_id: int, details: str = None):
+        """Queue one audit row. Call from the event loop thread."""
+        # Plain dicts, not AuditLog instances: the flusher inserts them without the ORM unit of work.
+        # Only a raw time.time() here; the datetime is built at flush time, off the request path.
+        self._queue.put_nowait({"user_id": user_id, "action": action, "vm_id": vm_id, "details": details, "timestamp": time.time()})
+
+    def _write(self, batch: list):
+        for row in batch:
+            # Naive UTC, like every other timestamp column in the schema
+            row["timestamp"] = _fromtimestamp(row["timestamp"], _UTC).replace(tzinfo=None)
+        # One executemany INSERT in one transaction; no identity map or post-flush refresh
+        if self._session is None:
+            self._session = Session(engine)
+        try:
+            self._session.bulk_insert_mappings(AuditLog, batch)
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+
+    async def _flush(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        try:
+            await run_in_threadpool(self._write, batch)
+        except Exception as e:
+            print(f"Failed to write {len(batch)} audit log(s): {e}")
+
+    async def run(self):
+        """Commit once per BATCH_SIZE rows, or FLUSH_INTERVAL_SECONDS after the first queued row."""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch.append(await self._queue.get())
+            deadline = loop.time() + FLUSH_INTERVAL_SECONDS
+            while len(self._batch) < BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush()
+
+    async def drain(self):
+        """Write everything still buffered; called at shutdown after the flusher is cancelled."""
+        while not self._queue.empty():
+            self._batch.append(self._queue.get_nowait())
+        await self._flush()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+audit_queue = AuditQueue()
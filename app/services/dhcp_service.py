@@ -2,12 +2,34 @@ import os
 import subprocess
 import logging
 import re
+from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 
 DHCP_CONFIG_PATH = r"C:\ProgramData\VMware\vmnetdhcp.conf"
 
+_UNSAFE_NAME_RE = re.compile(r'[^a-zA-Z0-9_-]')
+
+@lru_cache(maxsize=256)
+def _block_re(safe_name: str) -> re.Pattern:
+    # Regex to find the existing "host <name> { ... }" block for this specific VM name.
+    # re.DOTALL to match across lines. Cached so re-reserving a known VM skips compilation.
+    return re.compile(rf"host\s+{re.escape(safe_name)}\s*\{{.*?\}}", re.DOTALL | re.IGNORECASE)
+
 class DHCPService:
+    def __init__(self):
+        # Last content read or written, reused while the file's mtime is unchanged
+        self._content = None
+        self._mtime_ns = 0
+
+    def _read_config(self) -> str:
+        st = os.stat(DHCP_CONFIG_PATH)
+        if self._content is None or st.st_mtime_ns != self._mtime_ns:
+            with open(DHCP_CONFIG_PATH, 'r') as f:
+                self._content = f.read()
+            self._mtime_ns = st.st_mtime_ns
+        return self._content
+
     def add_reservation(self, vm_name: str, mac_address: str, ip_address: str):
         """
         Adds or updates a DHCP reservation for the given VM in vmnetdhcp.conf.
@@ -19,12 +41,11 @@ class DHCPService:
             
         # Normalize inputs
         # vm_name should be safe for config (alphanumeric + underscores/dashes)
-        safe_name = re.sub(r'[^a-zA-Z0-9_-]', '_', vm_name)
+        safe_name = _UNSAFE_NAME_RE.sub('_', vm_name)
         
         # Read content
         try:
-            with open(DHCP_CONFIG_PATH, 'r') as f:
-                content = f.read()
+            content = self._read_config()
         except Exception as e:
             logger.error(f"Failed to read DHCP config: {e}")
             raise e
@@ -32,10 +53,7 @@ class DHCPService:
         # Check if entry exists
         # Pattern: host <name> { ... }
         # We want to replace the whole block or append if not found.
-        
-        # Regex to find existing block for this specific VM name
-        # We use re.DOTALL to match across lines
-        block_pattern = re.compile(rf"host\s+{re.escape(safe_name)}\s*\{{.*?\}}", re.DOTALL | re.IGNORECASE)
+        block_pattern = _block_re(safe_name)
         
         new_entry = f"""host {safe_name} {{
     hardware ethernet {mac_address};
@@ -68,6 +86,8 @@ class DHCPService:
             try:
                 with open(DHCP_CONFIG_PATH, 'w') as f:
                     f.write(new_content)
+                self._content = new_content
+                self._mtime_ns = os.stat(DHCP_CONFIG_PATH).st_mtime_ns
                 self.restart_dhcp_service()
             except Exception as e:
                 logger.error(f"Failed to write DHCP config or restart service: {e}")
@@ -78,8 +98,10 @@ class DHCPService:
     def restart_dhcp_service(self):
         logger.info("Restarting VMwareDHCP service...")
         try:
-            subprocess.run(["net", "stop", "VMnetDHCP"], check=False, capture_output=True, timeout=30)
-            result = subprocess.run(["net", "start", "VMnetDHCP"], check=True, capture_output=True, text=True, timeout=30)
+            # One process instead of `net stop` + `net start`; Restart-Service also starts
+            # the service when it is already stopped
+            cmd = ["powershell", "-NoProfile", "-Command", "Restart-Service -Name VMnetDHCP -Force"]
+            result = subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=60)
             logger.info(f"VMwareDHCP service restarted successfully: {result.stdout}")
         except subprocess.TimeoutExpired:
             logger.error("Timed out waiting for VMnetDHCP service restart")
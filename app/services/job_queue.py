@@ -0,0 +1,39 @@
+import asyncio
+import uuid
+
+# Reinstalls running at once; more are queued rather than competing with requests for threads
+WORKER_COUNT = 2
+
+class JobQueue:
+    """
+    In-process queue for long-running VM jobs (reinstall), drained by WORKER_COUNT
+    run_worker tasks started in main.py lifespan. One job per key at a time, so a
+    double-clicked reinstall doesn't run twice. Jobs still queued or running when the
+    process exits are lost; the lifespan's stuck-task cleanup resets their VMs on boot.
+    """
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # key -> job id, for jobs queued or running
+        self._active = {}
+
+    def submit(self, key: str, func, *args) -> str:
+        """Queue func(*args) and return its job id. Raises ValueError if key already has a job."""
+        if key in self._active:
+            raise ValueError(f"Job already queued for {key}")
+        job_id = uuid.uuid4().hex
+        self._active[key] = job_id
+        self._queue.put_nowait((job_id, key, func, args))
+        return job_id
+
+    async def run_worker(self):
+        while True:
+            job_id, key, func, args = await self._queue.get()
+            try:
+                await func(*args)
+            except Exception as e:
+                print(f"Job {job_id} ({key}) failed: {e}")
+            finally:
+                self._active.pop(key, None)
+                self._queue.task_done()
+
+job_queue = JobQueue()
@@ -2,58 +2,149 @@ import os
 import subprocess
 import logging
 import re
-from typing import List, Dict, Optional
+import tempfile
+import threading
+from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
 NAT_CONF_PATH = r"C:\ProgramData\VMware\vmnetnat.conf"
 SERVICE_NAME = "VMware NAT Service"
 
+# Rule line: 8888 = 192.168.1.5:80
+_RULE_RE = re.compile(r"^\s*(\d+)\s*=\s*([0-9\.]+):(\d+)")
+# Host port of a rule line, used to find the one being replaced or removed
+_PORT_RE = re.compile(r"^\s*(\d+)\s*=")
+
+_SECTIONS = {"[incomingtcp]": "tcp", "[incomingudp]": "udp"}
+
+class _NatConfig:
+    """
+    vmnetnat.conf split into the lines we never touch and, per protocol, the forwarding
+    rules keyed by host port: {host_port: (guest_ip, guest_port, raw_line)}.
+    Each rule keeps its place in lines as a (protocol, host_port) slot, so an update is
+    written where the rule was and a delete just leaves its slot empty. anchors[protocol]
+    is the index in lines after which ports new to the section are written (the section's
+    last non-blank line; trailing blank lines stay after them). Untouched lines, comments
+    between rules included, round-trip byte for byte:
+
+    >>> import io
+    >>> text = "[incomingtcp]\\n# ssh for vm1\\n22 = 10.0.0.2:22\\n# web for vm2\\n80 = 10.0.0.3:80\\n\\n"
+    >>> "".join(_NatConfig.parse(io.StringIO(text)).render()) == text
+    True
+    """
+    def __init__(self):
+        self.lines: List = []
+        self.rules: Dict[str, Dict[int, tuple]] = {"tcp": {}, "udp": {}}
+        # Ports that have a slot in lines, per protocol
+        self.slots: Dict[str, Dict[int, int]] = {"tcp": {}, "udp": {}}
+        self.anchors: Dict[str, int] = {}
+
+    @classmethod
+    def parse(cls, f) -> "_NatConfig":
+        config = cls()
+        section = None
+        for line in f:
+            stripped = line.strip()
+            if stripped.startswith("["):
+                section = _SECTIONS.get(stripped)
+            elif section:
+                match = _PORT_RE.match(stripped)
+                if match:
+                    host_port = int(match.group(1))
+                    rule = _RULE_RE.match(stripped)
+                    guest = (rule.group(2), int(rule.group(3))) if rule else (None, None)
+                    previous = config.slots[section].get(host_port)
+                    if previous is not None:
+                        # Duplicate port: the last line wins, earlier ones stay as plain text
+                        config.lines[previous] = config.rules[section][host_port][2]
+                    config.rules[section][host_port] = (*guest, line)
+                    config.slots[section][host_port] = len(config.lines)
+                    line = (section, host_port)
+            config.lines.append(line)
+            if section and stripped:
+                config.anchors[section] = len(config.lines) - 1
+        return config
+
+    def _emit(self):
+        after = {}
+        for protocol, index in self.anchors.items():
+            after.setdefault(index, []).append(protocol)
+        for i, line in enumerate(self.lines):
+            if isinstance(line, tuple):
+                protocol, host_port = line
+                rule = self.rules[protocol].get(host_port)
+                if rule is not None:
+                    yield rule[2]
+            else:
+                yield line
+            for protocol in after.get(i, ()):
+                slots = self.slots[protocol]
+                for host_port, (_, _, raw) in self.rules[protocol].items():
+                    if host_port not in slots:
+                        yield raw
+
+    def render(self):
+        previous = "\n"
+        for piece in self._emit():
+            # Only the file's last line may lack its newline; don't glue a rule onto it
+            if not previous.endswith("\n"):
+                yield "\n"
+            yield piece
+            previous = piece
+
 class NatService:
     def __init__(self, config_path: str = NAT_CONF_PATH):
         self.config_path = config_path
+        # Parsed config, reused until the file's (mtime, size) changes on disk
+        self._cache: Optional[_NatConfig] = None
+        self._cache_key = None
+        # Handlers call in from threadpool threads; edits mutate the shared cache
+        self._lock = threading.Lock()
 
-    def _read_lines(self) -> List[str]:
-        if not os.path.exists(self.config_path):
+    def _load(self) -> _NatConfig:
+        try:
+            st = os.stat(self.config_path)
+        except FileNotFoundError:
             raise FileNotFoundError(f"NAT config not found at {self.config_path}")
-        with open(self.config_path, 'r') as f:
-            return f.readlines()
+        key = (st.st_mtime_ns, st.st_size)
+        if self._cache is None or key != self._cache_key:
+            with open(self.config_path, 'r') as f:
+                self._cache = _NatConfig.parse(f)
+            self._cache_key = key
+        return self._cache
 
-    def _write_lines(self, lines: List[str]):
-        with open(self.config_path, 'w') as f:
-            f.writelines(lines)
+    def _flush(self, config: _NatConfig):
+        """Write the config to a temp file next to it and swap it in with os.replace (crash-safe)."""
+        tmp = tempfile.NamedTemporaryFile('w', delete=False, dir=os.path.dirname(self.config_path) or None)
+        try:
+            with tmp:
+                tmp.writelines(config.render())
+            os.replace(tmp.name, self.config_path)
+        except BaseException:
+            # Drop the cache too: it may hold an edit that never reached the disk
+            self._cache = None
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+            raise
+        st = os.stat(self.config_path)
+        self._cache_key = (st.st_mtime_ns, st.st_size)
 
     def get_rules(self) -> Dict[str, List[Dict]]:
         """
         Returns a dict with 'tcp' and 'udp' lists.
         Each item: {'host_port': int, 'guest_ip': str, 'guest_port': int, 'description': str}
         """
-        lines = self._read_lines()
-        rules = {"tcp": [], "udp": []}
-        current_section = None
-        
-        # Regex for rule: 8888 = 192.168.1.5:80
-        rule_pattern = re.compile(r"^\s*(\d+)\s*=\s*([0-9\.]+):(\d+)")
-
-        for line in lines:
-            stripped = line.strip()
-            if stripped == "[incomingtcp]":
-                current_section = "tcp"
-            elif stripped == "[incomingudp]":
-                current_section = "udp"
-            elif stripped.startswith("["):
-                current_section = None
-            
-            if current_section and "=" in stripped:
-                match = rule_pattern.match(stripped)
-                if match:
-                    host_port, guest_ip, guest_port = match.groups()
-                    rules[current_section].append({
-                        "host_port": int(host_port),
-                        "guest_ip": guest_ip,
-                        "guest_port": int(guest_port)
-                    })
-        return rules
+        with self._lock:
+            config = self._load()
+            return {
+                protocol: [
+                    {"host_port": host_port, "guest_ip": guest_ip, "guest_port": guest_port}
+                    for host_port, (guest_ip, guest_port, _) in rules.items()
+                    if guest_ip is not None
+                ]
+                for protocol, rules in config.rules.items()
+            }
 
     def add_forwarding_rule(self, protocol: str, host_port: int, guest_ip: str, guest_port: int):
         """
@@ -63,79 +154,29 @@ class NatService:
         if protocol not in ['tcp', 'udp']:
             raise ValueError("Protocol must be 'tcp' or 'udp'")
             
-        lines = self._read_lines()
-        section_header = f"[incoming{protocol}]"
-        new_lines = []
-        in_section = False
-        inserted = False
-        
-        # Check if port already used
-        rule_pattern = re.compile(r"^\s*(\d+)\s*=")
-        
-        for line in lines:
-            stripped = line.strip()
-            if stripped == section_header:
-                in_section = True
-                new_lines.append(line)
-                continue
-            elif stripped.startswith("[") and in_section:
-                # End of our section, insert here if not already
-                if not inserted:
-                    new_lines.append(f"{host_port} = {guest_ip}:{guest_port}\n")
-                    inserted = True
-                in_section = False
-            
-            if in_section:
-                match = rule_pattern.match(stripped)
-                if match and int(match.group(1)) == host_port:
-                    # Update existing rule
-                    new_lines.append(f"{host_port} = {guest_ip}:{guest_port}\n")
-                    inserted = True
-                    continue
-            
-            new_lines.append(line)
-            
-        # If section was at the end or we missed it
-        if not inserted:
-            if in_section:
-                 # EOF while in section
-                 new_lines.append(f"{host_port} = {guest_ip}:{guest_port}\n")
-            else:
-                 # Section might not exist? (Unlikely for vmnetnat.conf)
-                 pass
-
-        self._write_lines(new_lines)
+        with self._lock:
+            config = self._load()
+            if protocol not in config.anchors:
+                # Section might not exist? (Unlikely for vmnetnat.conf)
+                return
+            rules = config.rules[protocol]
+            current = rules.get(host_port)
+            if current and current[:2] == (guest_ip, guest_port):
+                return
+            # Update existing rule in place, or append at the end of the section
+            rules[host_port] = (guest_ip, guest_port, f"{host_port} = {guest_ip}:{guest_port}\n")
+            self._flush(config)
         self.restart_nat_service()
 
     def delete_forwarding_rule(self, protocol: str, host_port: int):
         if protocol not in ['tcp', 'udp']:
             raise ValueError("Protocol must be 'tcp' or 'udp'")
             
-        lines = self._read_lines()
-        section_header = f"[incoming{protocol}]"
-        new_lines = []
-        in_section = False
-        
-        rule_pattern = re.compile(r"^\s*(\d+)\s*=")
-        
-        for line in lines:
-            stripped = line.strip()
-            if stripped == section_header:
-                in_section = True
-                new_lines.append(line)
-                continue
-            elif stripped.startswith("[") and in_section:
-                in_section = False
-            
-            if in_section:
-                match = rule_pattern.match(stripped)
-                if match and int(match.group(1)) == host_port:
-                    # Skip this line to delete
-                    continue
-            
-            new_lines.append(line)
-
-        self._write_lines(new_lines)
+        with self._lock:
+            config = self._load()
+            if config.rules[protocol].pop(host_port, None) is None:
+                return
+            self._flush(config)
         self.restart_nat_service()
 
     def restart_nat_service(self):
@@ -1,13 +1,93 @@
+import asyncio
 import httpx
 from datetime import datetime
 from app.core.config import settings
 
+# Alerts waiting for a worker; beyond this they are dropped rather than piling up in memory
+QUEUE_SIZE = 1000
+# Concurrent senders; per-webhook ordering and pacing still go through _post's lock
+WORKER_COUNT = 2
+
+def _seconds(header_value: str, default: float = 1.0) -> float:
+    try:
+        return float(header_value)
+    except (TypeError, ValueError):
+        return default
+
 class NotificationService:
+    def __init__(self):
+        # One pooled client for the process lifetime: keep-alive + HTTP/2 to discord.com
+        # instead of a fresh TCP/TLS handshake per alert. Closed in main.py lifespan.
+        self._client = httpx.AsyncClient(
+            http2=True,
+            # Fail fast on connect so a Discord outage can't hold callers for the full read timeout
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20, keepalive_expiry=300),
+        )
+        # Per-webhook pacing: Discord rate-limits each webhook URL separately
+        self._locks = {}
+        self._next_allowed = {}
+        # Fire-and-forget alerts from request handlers, sent by run_worker tasks (see main.py lifespan)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def enqueue(self, **alert):
+        """
+        Queue a send_discord_alert(**alert) call and return immediately, so the caller's
+        response never waits on Discord. Drops the alert with a warning if the queue is full.
+        """
+        try:
+            self._queue.put_nowait(alert)
+        except asyncio.QueueFull:
+            print(f"Notification queue full, dropping alert: {alert.get('title')}")
+
+    async def run_worker(self):
+        while True:
+            alert = await self._queue.get()
+            try:
+                await self.send_discord_alert(**alert)
+            finally:
+                self._queue.task_done()
+
+    async def drain(self, timeout: float = 5.0):
+        """Best-effort send of whatever is still queued at shutdown; called after the workers are cancelled."""
+        async def _flush():
+            while not self._queue.empty():
+                await self.send_discord_alert(**self._queue.get_nowait())
+        try:
+            await asyncio.wait_for(_flush(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Dropped {self._queue.qsize()} queued notification(s) at shutdown")
+
+    async def _post(self, url: str, payload: dict):
+        """
+        POST to a webhook, one request at a time per URL. Waits out the bucket when
+        Discord reports it empty (X-RateLimit-Remaining: 0) and retries once on 429.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._locks.setdefault(url, asyncio.Lock()):
+            for attempt in range(2):
+                wait = self._next_allowed.get(url, 0.0) - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                response = await self._client.post(url, json=payload)
+                now = loop.time()
+                if response.headers.get("X-RateLimit-Remaining") == "0":
+                    self._next_allowed[url] = now + _seconds(response.headers.get("X-RateLimit-Reset-After"))
+                if response.status_code == 429 and attempt == 0:
+                    self._next_allowed[url] = now + _seconds(response.headers.get("Retry-After"))
+                    continue
+                response.raise_for_status()
+                return
+
     async def send_discord_alert(self, title: str, description: str, color: int = 3447003, fields: list = None, webhook_url: str = None, thumbnail_url: str = None, image_url: str = None, author: dict = None, footer: dict = None):
         """
         Sends a Discord notification.
         If webhook_url is provided, sends to that URL.
         Otherwise, sends to the global admin webhook (if configured).
+        Returns True once Discord accepted it; False if there was no URL or the send failed.
         """
         target_url = webhook_url or settings.DISCORD_WEBHOOK_URL
         
@@ -15,7 +95,7 @@ class NotificationService:
             # Only log if we expected to send one but couldn't
             if webhook_url:
                 print("Provided Webhook URL is empty. Skipping.")
-            return
+            return False
 
         embed = {
             "title": title,
@@ -46,11 +126,11 @@ class NotificationService:
             "embeds": [embed]
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(target_url, json=payload)
-                response.raise_for_status()
-            except Exception as e:
-                print(f"Failed to send Discord notification to {target_url}: {e}")
+        try:
+            await self._post(target_url, payload)
+        except Exception as e:
+            print(f"Failed to send Discord notification to {target_url}: {e}")
+            return False
+        return True
 
 notification_service = NotificationService()
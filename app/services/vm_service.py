@@ -1,34 +1,231 @@
 import subprocess
 import logging
 import os
+import sys
+import time
+import threading
 import psutil
 import base64
+import mmap
+import re
+import asyncio
+from string import Template
+from concurrent.futures import ThreadPoolExecutor
 from app.core.config import settings
+from app.core.threadpool import run_bare
+from app.models.vm import normalize_vmx_path
 
 logger = logging.getLogger(__name__)
 
+# Every `key = "value"` line of a .vmx, matched in one pass over the file
+_VMX_VALUE_RE = re.compile(rb'(?m)^[ \t]*([A-Za-z0-9_.:]+)[ \t]*=[ \t]*"([^"\r\n]*)"')
+
+# vmx_path -> (st_mtime_ns, st_size, settings) from the last parse_vmx
+_vmx_cache = {}
+
+def parse_vmx(vmx_path: str) -> dict:
+    """
+    {lowercased key: value} for every setting in the .vmx, in file order (first occurrence wins).
+    Re-parsed only when the file's mtime or size changed; treat the result as read-only.
+    """
+    with open(vmx_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        cached = _vmx_cache.get(vmx_path)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        values = {}
+        if st.st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for k, v in _VMX_VALUE_RE.findall(m):
+                    values.setdefault(k.lower().decode(), v.decode(errors="replace"))
+    _vmx_cache[vmx_path] = (st.st_mtime_ns, st.st_size, values)
+    return values
+
+# Whole-line matches (newline included) for the settings enable_vnc / update_specs replace
+_VNC_LINE_RE = re.compile(r'(?mi)^[ \t]*remotedisplay\.vnc.*(?:\n|$)')
+_CPU_LINE_RE = re.compile(r'(?mi)^[ \t]*(?:numvcpus|cpuid\.corespersocket)[ \t]*=.*(?:\n|$)')
+_MEM_LINE_RE = re.compile(r'(?mi)^[ \t]*memsize[ \t]*=.*(?:\n|$)')
+
+def _write_vmx(vmx_path: str, content: str):
+    """Write through a temp file + fsync + os.replace, so a crash never leaves a truncated .vmx."""
+    tmp_path = vmx_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, vmx_path)
+
+# Decoders tried on vmrun output, in order: UTF-8 (standard), then OEM (likely for console
+# apps like vmrun on Windows), then MBCS (ANSI, system default). The last two only exist on Windows.
+_OUTPUT_ENCODINGS = ('utf-8', 'oem', 'mbcs') if sys.platform == 'win32' else ('utf-8',)
+
+# The .vmx argument (last on the line, quoted or not) of a vmware-vmx.exe command line
+_VMX_ARG_RE = re.compile(r'"([^"]+\.vmx)"|(\S+\.vmx)(?=\s|$)', re.IGNORECASE)
+# One query for just the vmware-vmx.exe rows; reading every process's cmdline through psutil is slow on Windows
+_WMIC_VMX_CMD = ["wmic", "process", "where", "name='vmware-vmx.exe'", "get", "ProcessId,CommandLine", "/format:csv"]
+
+# New PIDs in one scan above which Windows uses the wmic query instead of inspecting each PID
+WMIC_SCAN_THRESHOLD = 32
+
+# How long a guest IP / snapshot list is served from cache before vmrun is asked again
+GUEST_IP_TTL = 30.0
+SNAPSHOT_TTL = 30.0
+
+# Parallel vmrun processes per batch call
+BATCH_WORKERS = 8
+# CPU/memory sampling period for running VMs, and how long the sampler keeps going unread
+SAMPLE_INTERVAL = 0.5
+SAMPLER_IDLE_SECONDS = 60
+
+class _PSTemplate(Template):
+    """string.Template with @ placeholders, so the script's own $variables need no escaping."""
+    delimiter = "@"
+
+# Guest-side static IP setup run by configure_static_ip; parsed once at import
+_STATIC_IP_PS = _PSTemplate("""
+$ErrorActionPreference = 'Continue'
+try {
+    Start-Transcript -Path "C:\\Windows\\Temp\\static_ip_debug.log" -Append
+} catch {
+    Write-Output "Could not start transcript"
+}
+
+$IP = "@ip"
+$Subnet = "@subnet"
+$Gateway = "@gateway"
+$DNS1 = "@dns1"
+$DNS2 = "@dns2"
+
+Write-Output "Configuring Static IP: $IP"
+
+# 1. Find Adapter
+$adapter = Get-NetAdapter | Where-Object { $_.Status -eq 'Up' } | Select-Object -First 1
+if (-not $adapter) { 
+    Write-Error "No active network adapter found"
+    exit 1
+}
+$InterfaceName = $adapter.Name
+
+Write-Output "Adapter found: $InterfaceName"
+
+# 2. Configure via netsh (Legacy/Robust for GUI)
+# We use netsh because it forces the GUI to update to 'Use the following IP address'
+# which satisfies user verification.
+
+# Set IP/Subnet/Gateway
+# netsh interface ip set address "Ethernet0" static 192.168.x.x ...
+$netshCmd = 'netsh interface ip set address name="' + $InterfaceName + '" static ' + $IP + ' ' + $Subnet + ' ' + $Gateway
+Write-Output "Executing: $netshCmd"
+cmd /c $netshCmd
+
+# Set DNS 1
+$dnsCmd1 = 'netsh interface ip set dns name="' + $InterfaceName + '" static ' + $DNS1
+Write-Output "Executing: $dnsCmd1"
+cmd /c $dnsCmd1
+
+# Set DNS 2
+$dnsCmd2 = 'netsh interface ip add dns name="' + $InterfaceName + '" ' + $DNS2 + ' index=2'
+Write-Output "Executing: $dnsCmd2"
+cmd /c $dnsCmd2
+
+Write-Output "Configuration Complete"
+Stop-Transcript
+""")
+
+class _StatsSampler(threading.Thread):
+    """
+    Samples every vmware-vmx process each SAMPLE_INTERVAL with the non-blocking, delta-based
+    cpu_percent(), so get_vm_stats reads a snapshot instead of blocking 1.5 s per call.
+    Exits after SAMPLER_IDLE_SECONDS without a reader; VMService starts a new one on demand.
+    """
+    def __init__(self, service: "VMService"):
+        super().__init__(name="vm-stats-sampler", daemon=True)
+        self.service = service
+
+    def run(self):
+        service = self.service
+        # Processes whose cpu_percent baseline is taken (the first call always returns 0.0)
+        primed = set()
+        cpu_count = service._cpu_count
+        while True:
+            try:
+                procs = service._vmx_processes()
+                service._vmx_to_proc = procs
+            except Exception as e:
+                logger.error(f"Error listing VM processes: {e}")
+                procs = {}
+            stats = {}
+            for vmx, p in procs.items():
+                try:
+                    with p.oneshot():
+                        # cpu_percent returns usage across all cores (200% = 2 cores fully used);
+                        # divide by cpu_count to scale to "System CPU %"
+                        cpu_raw = p.cpu_percent(interval=None)
+                        rss = p.memory_info().rss
+                except psutil.Error:
+                    continue
+                if p not in primed:
+                    primed.add(p)
+                    continue
+                stats[vmx] = {
+                    "cpu_percent": round(cpu_raw / cpu_count, 2),
+                    "memory_mb": round(rss / (1024 * 1024), 0)
+                }
+            primed.intersection_update(procs.values())
+            with service._stats_cond:
+                service._stats = stats
+                service._stats_cond.notify_all()
+                if time.monotonic() - service._stats_read_at > SAMPLER_IDLE_SECONDS:
+                    service._sampler = None
+                    service._stats = {}
+                    return
+            time.sleep(SAMPLE_INTERVAL)
+
 class VMService:
     def __init__(self):
         self.vmrun_path = settings.VMRUN_PATH
         # Basic check if vmrun exists
         if not os.path.exists(self.vmrun_path):
             logger.warning(f"vmrun not found at {self.vmrun_path}. VM operations will fail.")
+        # (fetched_at, frozenset of normalized .vmx paths) from the last `vmrun list`
+        self._running_cache = (0.0, frozenset())
+        self._cache_ttl = 1.5
+        self._running_lock = threading.Lock()
+        # In-flight `vmrun list` of list_running_vms_async, shared by concurrent callers
+        self._running_task = None
+        # pid -> (psutil.Process, normalized .vmx path) for vmware-vmx processes, (None, None)
+        # for everything else, so each PID's name/cmdline is read once per lifetime
+        self._proc_cache = {}
+        self._proc_lock = threading.Lock()
+        # Normalized .vmx path -> Process, read before touching the PID table at all
+        self._vmx_to_proc = {}
+        # Latest {normalized .vmx path: stats} from _StatsSampler, guarded by _stats_cond
+        self._stats = {}
+        self._stats_cond = threading.Condition()
+        self._stats_read_at = 0.0
+        self._sampler = None
+        # Normalized .vmx path -> (monotonic time, value); dropped by forget_vm on power/snapshot changes
+        self._ip_cache = {}
+        self._snapshot_cache = {}
+        # Host logical CPUs, for scaling per-process cpu_percent; fixed for the process lifetime
+        self._cpu_count = psutil.cpu_count() or 1
 
     def _decode_output(self, data: bytes) -> str:
         """Helper to decode bytes using multiple encodings (UTF-8, OEM, MBCS)."""
         if not data:
             return ""
-        # Try UTF-8 first (standard)
-        # Then OEM (likely for console apps like vmrun on Windows)
-        # Then MBCS (ANSI, system default)
-        for encoding in ['utf-8', 'oem', 'mbcs']:
+        # Typical vmrun output is plain ASCII, valid in every candidate encoding
+        if data.isascii():
+            return data.decode('ascii')
+        for encoding in _OUTPUT_ENCODINGS:
             try:
                 return data.decode(encoding)
             except UnicodeDecodeError:
                 continue
         return data.decode('utf-8', errors='replace')
 
-    def _run_command(self, command: str, vmx_path: str = None, params: list = None, guest_user: str = None, guest_pass: str = None, timeout: int = 30):
+    def _build_command(self, command: str, vmx_path: str = None, params: list = None, guest_user: str = None, guest_pass: str = None) -> list:
+        """vmrun argv for one command; logs it with the guest password masked."""
         cmd = [self.vmrun_path, "-T", "ws"] # -T ws for Workstation
         
         # Add guest credentials if provided
@@ -42,17 +239,54 @@ class VMService:
         if params:
             cmd.extend(params)
         
-        # Log command (redacting password)
-        log_cmd = cmd.copy()
-        if guest_pass:
-            try:
-                pass_idx = log_cmd.index("-gp") + 1
-                if pass_idx < len(log_cmd):
-                    log_cmd[pass_idx] = "******"
-            except ValueError:
-                pass
-        
-        logger.info(f"Executing: {' '.join(log_cmd)}")
+        # Log command (redacting password); built only when INFO is actually emitted
+        if logger.isEnabledFor(logging.INFO):
+            log_cmd = cmd
+            if guest_user and guest_pass is not None:
+                # -gp is always at index 5: [vmrun, -T, ws, -gu, user, -gp, pass, ...]
+                log_cmd = [*cmd[:6], "******", *cmd[7:]]
+            logger.info("Executing: %s", subprocess.list2cmdline(log_cmd))
+        return cmd
+
+    def _command_output(self, stdout: bytes, output: bool, raw: bool):
+        if not output:
+            return None
+        if raw:
+            return stdout
+        return self._decode_output(stdout).strip()
+
+    def _command_failed(self, command: str, stdout: bytes, stderr: bytes):
+        """Log a non-zero vmrun exit and raise with its message."""
+        stderr_str = self._decode_output(stderr)
+        stdout_str = self._decode_output(stdout)
+        err_msg = stderr_str.strip() if stderr_str else (stdout_str.strip() if stdout_str else "Unknown error")
+
+        # Suppress noisy-but-expected messages that happen constantly during reinstall/boot
+        # "VMware Tools are not running" is normal while the VM is starting up
+        _quiet_patterns = [
+            "vmware tools are not running",
+            "tools are not running",
+            "vmware tools is not running",
+        ]
+        is_expected = any(p in err_msg.lower() for p in _quiet_patterns)
+
+        if not is_expected:
+            logger.error(f"Error running vmrun {command}: {stderr_str}")
+            if stdout_str:
+                logger.error(f"Stdout: {stdout_str}")
+        else:
+            logger.debug(f"vmrun {command}: Tools not ready yet (expected during boot)")
+
+        raise Exception(f"VM Operation Failed: {err_msg}")
+
+    def _run_command(self, command: str, vmx_path: str = None, params: list = None, guest_user: str = None, guest_pass: str = None, timeout: int = 30, output: bool = True, raw: bool = False):
+        """
+        Runs one vmrun command and returns its decoded stdout.
+        With output=False the stdout is never decoded and None is returned; for commands
+        whose callers only care that they succeeded (errors still raise with the decoded stderr).
+        With raw=True the undecoded stdout bytes are returned, for callers that parse them first.
+        """
+        cmd = self._build_command(command, vmx_path, params, guest_user, guest_pass)
         
         try:
             result = subprocess.run(
@@ -62,7 +296,7 @@ class VMService:
                 check=True,
                 timeout=timeout  # CRITICAL: prevents vmrun from hanging and locking .vmx files
             )
-            return self._decode_output(result.stdout).strip()
+            return self._command_output(result.stdout, output, raw)
         except subprocess.TimeoutExpired as e:
             # Kill the hung process and any children to release .vmx file lock
             logger.error(f"vmrun {command} timed out after {timeout}s — killing process")
@@ -76,42 +310,61 @@ class VMService:
                 self._kill_hanging_vmrun(vmx_path, command)
             raise Exception(f"VM Operation Timed Out: {command} exceeded {timeout}s")
         except subprocess.CalledProcessError as e:
-            stderr_str = self._decode_output(e.stderr)
-            stdout_str = self._decode_output(e.stdout)
-            err_msg = stderr_str.strip() if stderr_str else (stdout_str.strip() if stdout_str else "Unknown error")
-
-            # Suppress noisy-but-expected messages that happen constantly during reinstall/boot
-            # "VMware Tools are not running" is normal while the VM is starting up
-            _quiet_patterns = [
-                "vmware tools are not running",
-                "tools are not running",
-                "vmware tools is not running",
-            ]
-            is_expected = any(p in err_msg.lower() for p in _quiet_patterns)
-
-            if not is_expected:
-                logger.error(f"Error running vmrun {command}: {stderr_str}")
-                if stdout_str:
-                    logger.error(f"Stdout: {stdout_str}")
-            else:
-                logger.debug(f"vmrun {command}: Tools not ready yet (expected during boot)")
-
-            raise Exception(f"VM Operation Failed: {err_msg}")
+            self._command_failed(command, e.stdout, e.stderr)
         except FileNotFoundError:
              raise Exception(f"vmrun executable not found at {self.vmrun_path}")
 
+    async def _run_command_async(self, command: str, vmx_path: str = None, params: list = None, guest_user: str = None, guest_pass: str = None, timeout: int = 30, output: bool = True, raw: bool = False):
+        """
+        _run_command without a thread: vmrun runs as an asyncio subprocess awaited on the loop.
+        Falls back to _run_command on the default executor when the loop can't spawn
+        subprocesses (the selector event loop on Windows).
+        """
+        cmd = self._build_command(command, vmx_path, params, guest_user, guest_pass)
+        try:
+            proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except NotImplementedError:
+            return await run_bare(self._run_command, command, vmx_path, params, guest_user, guest_pass, timeout, output, raw)
+        except FileNotFoundError:
+            raise Exception(f"vmrun executable not found at {self.vmrun_path}")
+
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            # Kill the hung process and any children to release .vmx file lock
+            logger.error(f"vmrun {command} timed out after {timeout}s — killing process")
+            self._kill_quietly(proc)
+            if vmx_path:
+                await run_bare(self._kill_hanging_vmrun, vmx_path, command)
+            raise Exception(f"VM Operation Timed Out: {command} exceeded {timeout}s")
+        except asyncio.CancelledError:
+            # Caller went away (client disconnect); don't leave vmrun holding the .vmx
+            self._kill_quietly(proc)
+            raise
+        if proc.returncode:
+            self._command_failed(command, stdout, stderr)
+        return self._command_output(stdout, output, raw)
+
+    @staticmethod
+    def _kill_quietly(proc):
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
     def _kill_hanging_vmrun(self, vmx_path: str, command: str):
         """Kill any hanging vmrun processes that may be holding a lock on the vmx file."""
         try:
             vmx_lower = vmx_path.lower()
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+            # Names only: reading a cmdline is a separate, costly query on Windows,
+            # so it is fetched just for the few vmrun processes
+            for proc in psutil.process_iter(['name']):
                 try:
                     name = (proc.info.get('name') or '').lower()
-                    cmdline = proc.info.get('cmdline') or []
                     if 'vmrun' in name:
-                        cmdline_str = ' '.join(cmdline).lower()
+                        cmdline_str = ' '.join(proc.cmdline()).lower()
                         if vmx_lower in cmdline_str and command.lower() in cmdline_str:
-                            logger.warning(f"Killing hanging vmrun PID {proc.info['pid']}: {cmdline_str[:100]}")
+                            logger.warning(f"Killing hanging vmrun PID {proc.pid}: {cmdline_str[:100]}")
                             proc.kill()
                 except (psutil.NoSuchProcess, psutil.AccessDenied):
                     pass
@@ -119,38 +372,197 @@ class VMService:
             logger.error(f"Error killing hanging vmrun: {e}")
 
     def start_vm(self, vmx_path: str):
-        return self._run_command("start", vmx_path, ["nogui"], timeout=60)
+        try:
+            self._run_command("start", vmx_path, ["nogui"], timeout=60, output=False)
+        finally:
+            self.invalidate()
+            self.forget_vm(vmx_path)
+        # Index the new vmware-vmx process now, so the first stats poll is a dict hit
+        try:
+            self._vmx_to_proc = self._vmx_processes()
+        except Exception as e:
+            logger.warning(f"Could not index VM processes after start: {e}")
 
     def stop_vm(self, vmx_path: str, hard: bool = False):
         mode = "hard" if hard else "soft"
-        return self._run_command("stop", vmx_path, [mode], timeout=60)
+        try:
+            return self._run_command("stop", vmx_path, [mode], timeout=60, output=False)
+        finally:
+            self.invalidate()
+            self.forget_vm(vmx_path)
 
     def restart_vm(self, vmx_path: str, hard: bool = False):
         mode = "hard" if hard else "soft"
-        return self._run_command("reset", vmx_path, [mode], timeout=60)
-
-    def list_running_vms(self):
-        output = self._run_command("list")
+        try:
+            return self._run_command("reset", vmx_path, [mode], timeout=60, output=False)
+        finally:
+            self.invalidate()
+            self.forget_vm(vmx_path)
+
+    def invalidate(self):
+        """Forget the cached running-VM set so the next check re-runs `vmrun list`."""
+        self._running_cache = (0.0, self._running_cache[1])
+
+    def forget_vm(self, vmx_path: str, ip: bool = True, snapshots: bool = True):
+        """Drop one VM's cached guest IP and/or snapshot list."""
+        key = os.path.normpath(vmx_path).lower()
+        if ip:
+            self._ip_cache.pop(key, None)
+        if snapshots:
+            self._snapshot_cache.pop(key, None)
+
+    def _cached(self, cache: dict, vmx_path: str, ttl: float):
+        """(key, value) for a cache entry younger than ttl; value is None on a miss."""
+        key = os.path.normpath(vmx_path).lower()
+        entry = cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] < ttl:
+            return key, entry[1]
+        return key, None
+
+    def peek_running_vms(self, ttl: float = None):
+        """Cached running-VM set if younger than ttl (default _cache_ttl), else None. Never blocks (safe on the event loop)."""
+        ts, running = self._running_cache
+        return running if time.monotonic() - ts < (self._cache_ttl if ttl is None else ttl) else None
+
+    def list_running_vms(self, ttl: float = None) -> frozenset:
+        """Normalized paths of running VMs. One `vmrun list` per _cache_ttl; callers arriving
+        while it runs wait on the lock and share its result. ttl=0 forces a fresh listing."""
+        with self._running_lock:
+            running = self.peek_running_vms(ttl)
+            if running is not None:
+                return running
+            return self._store_running(self._run_command("list", raw=True))
+
+    async def list_running_vms_async(self, ttl: float = None) -> frozenset:
+        """list_running_vms for coroutines: `vmrun list` runs as an asyncio subprocess,
+        and callers arriving while one is in flight await the same task."""
+        running = self.peek_running_vms(ttl)
+        if running is not None:
+            return running
+        task = self._running_task
+        if task is None or task.done():
+            task = self._running_task = asyncio.ensure_future(self._list_running_async())
+        # shield: one caller being cancelled must not cancel the listing the others wait on
+        return await asyncio.shield(task)
+
+    async def _list_running_async(self) -> frozenset:
+        return self._store_running(await self._run_command_async("list", raw=True))
+
+    def _store_running(self, data: bytes) -> frozenset:
         # Output format:
         # Total running VMs: 1
         # C:\Path\To\VM.vmx
-        lines = output.splitlines()
-        running_vms = []
-        if len(lines) > 1:
-            for line in lines[1:]:
-                path = line.strip()
-                if path:
-                    running_vms.append(os.path.normpath(path).lower())
-        return running_vms
-
-    def is_running(self, vmx_path: str) -> bool:
-        running_vms = self.list_running_vms()
-        normalized_vmx = os.path.normpath(vmx_path).lower()
+        # Drop the header on the bytes, then decode the path lines in one go;
+        # splitlines already drops the \r\n, so no per-line strip. Normalized here, once per
+        # listing, with the same function that fills VM.vmx_path_normalized, so consumers
+        # only ever do set lookups with the stored column
+        _, _, paths = data.partition(b"\n")
+        running = frozenset(map(normalize_vmx_path, filter(str.strip, self._decode_output(paths).splitlines())))
+        self._running_cache = (time.monotonic(), running)
+        return running
+
+    def last_running_vms(self) -> frozenset:
+        """Last successfully fetched running-VM set, however old."""
+        return self._running_cache[1]
+
+    @staticmethod
+    def _has_lock(vmx_path: str) -> bool:
+        """A powered-on VM always holds its <name>.vmx.lck directory. One stat, so a missing
+        lock answers "stopped" without `vmrun list`; a present one may be stale, so it proves nothing."""
+        return os.path.isdir(vmx_path + ".lck")
+
+    def is_running(self, vmx_path: str, running_vms: frozenset = None, ttl: float = None) -> bool:
+        """Pass running_vms from one list_running_vms() call when checking several VMs."""
+        normalized_vmx = normalize_vmx_path(vmx_path)
+        if running_vms is None:
+            if not self._has_lock(vmx_path):
+                return False
+            running_vms = self.list_running_vms(ttl)
         return normalized_vmx in running_vms
     
     def get_vm_status(self, vmx_path: str):
         return "running" if self.is_running(vmx_path) else "stopped"
 
+    def status_map(self, vmx_paths: dict) -> dict:
+        """
+        Status for many VMs off a single (cached) `vmrun list`, instead of one check per VM.
+        vmx_paths maps each vmx_path to its stored vmx_path_normalized, so no path is
+        normalized per request. VMs without a lock directory are stopped; the listing
+        runs only if some VM has one.
+        """
+        locked = [p for p in vmx_paths if self._has_lock(p)]
+        running = self.list_running_vms() if locked else frozenset()
+        status = dict.fromkeys(vmx_paths, "stopped")
+        for p in locked:
+            if vmx_paths[p] in running:
+                status[p] = "running"
+        return status
+
+    @staticmethod
+    def _inspect_pid(pid: int):
+        try:
+            proc = psutil.Process(pid)
+            with proc.oneshot():
+                name = proc.name()
+                if name and 'vmware-vmx' in name.lower():
+                    for arg in proc.cmdline():
+                        if arg.lower().endswith('.vmx'):
+                            return proc, os.path.normpath(arg).lower()
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            pass
+        return None, None
+
+    def _list_vmx_processes_fast(self) -> dict:
+        """Normalized .vmx path -> PID of its vmware-vmx.exe, from a single wmic call (Windows only)."""
+        result = subprocess.run(_WMIC_VMX_CMD, capture_output=True, check=True, timeout=15)
+        vmx_pids = {}
+        # Rows are "Node,CommandLine,ProcessId"; the command line itself may contain commas
+        for line in self._decode_output(result.stdout).splitlines():
+            _, _, rest = line.partition(",")
+            cmdline, _, pid = rest.rpartition(",")
+            if not pid.strip().isdigit():
+                continue  # blank lines and the header row
+            args = _VMX_ARG_RE.findall(cmdline)
+            if args:
+                quoted, bare = args[-1]
+                vmx_pids[os.path.normpath(quoted or bare).lower()] = int(pid)
+        return vmx_pids
+
+    def _vmx_processes(self) -> dict:
+        """Normalized .vmx path -> its vmware-vmx Process. Only PIDs new since the last call are inspected."""
+        with self._proc_lock:
+            pids = set(psutil.pids())
+            for pid in self._proc_cache.keys() - pids:
+                del self._proc_cache[pid]
+            new_pids = pids - self._proc_cache.keys()
+            # Cold cache (or a burst of new processes) on Windows: one wmic query instead of
+            # opening every new PID; the steady-state diff stays on psutil
+            if sys.platform == 'win32' and len(new_pids) > WMIC_SCAN_THRESHOLD:
+                try:
+                    vmx_pids = {pid: vmx for vmx, pid in self._list_vmx_processes_fast().items()}
+                except Exception as e:
+                    logger.debug(f"wmic process query failed, scanning with psutil: {e}")
+                else:
+                    for pid in new_pids:
+                        vmx = vmx_pids.get(pid)
+                        try:
+                            self._proc_cache[pid] = (psutil.Process(pid), vmx) if vmx else (None, None)
+                        except psutil.Error:
+                            self._proc_cache[pid] = (None, None)
+                    new_pids = ()
+            for pid in new_pids:
+                self._proc_cache[pid] = self._inspect_pid(pid)
+            return {vmx: proc for proc, vmx in self._proc_cache.values() if vmx}
+
+    def _find_vmx_process(self, vmx_key: str):
+        """The VM's vmware-vmx Process, from the reverse index; one rescan refreshes it when stale."""
+        proc = self._vmx_to_proc.get(vmx_key)
+        # is_running() also catches a PID reused since it was cached
+        if proc is not None and proc.is_running():
+            return proc
+        self._vmx_to_proc = self._vmx_processes()
+        return self._vmx_to_proc.get(vmx_key)
+
     def get_vm_stats(self, vmx_path: str):
         """
         Returns a dict with 'cpu_percent' and 'memory_mb' for the VM process.
@@ -159,38 +571,25 @@ class VMService:
         target_vmx = os.path.normpath(vmx_path).lower()
         
         try:
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                try:
-                    if proc.info['name'] and 'vmware-vmx' in proc.info['name'].lower():
-                        cmdline = proc.info.get('cmdline', [])
-                        if not cmdline:
-                            continue
-                            
-                        # Check if this process belongs to the requested VMX
-                        for arg in cmdline:
-                            if arg.lower().endswith('.vmx'):
-                                if os.path.normpath(arg).lower() == target_vmx:
-                                    # Found it!
-                                    p = psutil.Process(proc.info['pid'])
-                                    # Interval 1.5s to get a meaningful CPU reading
-                                    # cpu_percent returns usage across all cores.
-                                    # e.g. 200% = 2 cores fully used.
-                                    # To scale to "System CPU %", divide by cpu_count.
-                                    cpu_raw = p.cpu_percent(interval=1.5)
-                                    cpu_system = cpu_raw / psutil.cpu_count()
-                                    
-                                    mem_mb = p.memory_info().rss / (1024 * 1024)
-                                    
-                                    return {
-                                        "cpu_percent": round(cpu_system, 2),
-                                        "memory_mb": round(mem_mb, 0)
-                                    }
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    pass
+            if self._find_vmx_process(target_vmx) is None:
+                return None
         except Exception as e:
             logger.error(f"Error getting VM stats: {e}")
-            
-        return None
+            return None
+
+        with self._stats_cond:
+            self._stats_read_at = time.monotonic()
+            if self._sampler is None:
+                self._sampler = _StatsSampler(self)
+                self._sampler.start()
+            # A process the sampler hasn't measured yet needs two ticks (baseline, then delta)
+            deadline = time.monotonic() + 3 * SAMPLE_INTERVAL
+            while target_vmx not in self._stats:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._stats_cond.wait(remaining)
+            return self._stats.get(target_vmx)
 
     def capture_screen(self, vmx_path: str, target_path: str, guest_user: str = None, guest_pass: str = None):
         """Captures the screen of the running VM to the target path."""
@@ -202,31 +601,66 @@ class VMService:
         # Let's try adding gu and gp if we have them, but for now just basic command.
         return self._run_command("captureScreen", vmx_path, [target_path], guest_user=guest_user, guest_pass=guest_pass)
 
-    def get_guest_ip(self, vmx_path: str, guest_user: str = None, guest_pass: str = None):
+    def get_guest_ip(self, vmx_path: str, guest_user: str = None, guest_pass: str = None, force: bool = False):
         """Gets the IP address of the guest OS.
         Short timeout — called repeatedly in a polling loop. Must never block.
+        A found IP is reused for GUEST_IP_TTL unless force=True; a miss is never cached,
+        so a booting guest is asked again on the next poll.
         """
+        key, ip = self._cached(self._ip_cache, vmx_path, GUEST_IP_TTL)
+        if ip and not force:
+            return ip
         try:
-            return self._run_command("getGuestIPAddress", vmx_path, [], 
-                                     guest_user=guest_user, guest_pass=guest_pass,
-                                     timeout=8)  # 8s max — if Tools aren't ready it returns fast anyway
+            ip = self._run_command("getGuestIPAddress", vmx_path, [], 
+                                   guest_user=guest_user, guest_pass=guest_pass,
+                                   timeout=8)  # 8s max — if Tools aren't ready it returns fast anyway
         except Exception as e:
             return None
+        if ip:
+            self._ip_cache[key] = (time.monotonic(), ip)
+        return ip
+
+    async def get_guest_ip_async(self, vmx_path: str, guest_user: str = None, guest_pass: str = None, force: bool = False):
+        """get_guest_ip awaited as an asyncio subprocess, for the polling loops on the event loop."""
+        key, ip = self._cached(self._ip_cache, vmx_path, GUEST_IP_TTL)
+        if ip and not force:
+            return ip
+        try:
+            ip = await self._run_command_async("getGuestIPAddress", vmx_path, [],
+                                               guest_user=guest_user, guest_pass=guest_pass,
+                                               timeout=8)
+        except Exception:
+            return None
+        if ip:
+            self._ip_cache[key] = (time.monotonic(), ip)
+        return ip
 
     def create_snapshot(self, vmx_path: str, name: str):
-        return self._run_command("snapshot", vmx_path, [name], timeout=900)
+        try:
+            return self._run_command("snapshot", vmx_path, [name], timeout=900, output=False)
+        finally:
+            self.forget_vm(vmx_path, ip=False)
 
     def revert_snapshot(self, vmx_path: str, name: str):
-        return self._run_command("revertToSnapshot", vmx_path, [name], timeout=120)
+        try:
+            return self._run_command("revertToSnapshot", vmx_path, [name], timeout=120)
+        finally:
+            self.forget_vm(vmx_path)
 
     def delete_snapshot(self, vmx_path: str, name: str):
-        return self._run_command("deleteSnapshot", vmx_path, [name], timeout=300)
+        try:
+            return self._run_command("deleteSnapshot", vmx_path, [name], timeout=300, output=False)
+        finally:
+            self.forget_vm(vmx_path, ip=False)
 
     def delete_vm(self, vmx_path: str):
         """
         Deletes the VM and its files.
         """
-        return self._run_command("deleteVM", vmx_path)
+        try:
+            return self._run_command("deleteVM", vmx_path)
+        finally:
+            self.forget_vm(vmx_path)
 
     def get_vm_specs(self, vmx_path: str) -> dict:
         """
@@ -237,17 +671,11 @@ class VMService:
 
         specs = {"cpu_count": 2, "memory_mb": 4096}
         try:
-            with open(vmx_path, 'r') as f:
-                for line in f:
-                    line = line.strip().lower()
-                    if line.startswith("numvcpus"):
-                        parts = line.split("=")
-                        if len(parts) > 1:
-                            specs["cpu_count"] = int(parts[1].strip().strip('"'))
-                    elif line.startswith("memsize"):
-                        parts = line.split("=")
-                        if len(parts) > 1:
-                            specs["memory_mb"] = int(parts[1].strip().strip('"'))
+            values = parse_vmx(vmx_path)
+            if "numvcpus" in values:
+                specs["cpu_count"] = int(values["numvcpus"].strip())
+            if "memsize" in values:
+                specs["memory_mb"] = int(values["memsize"].strip())
         except Exception as e:
             logger.error(f"Failed to read VM specs from {vmx_path}: {e}")
         
@@ -279,22 +707,19 @@ class VMService:
             raise Exception("VMX file not found")
             
         with open(vmx_path, 'r') as f:
-            lines = f.readlines()
+            content = f.read()
             
-        new_lines = []
         # Remove existing VNC config
-        for line in lines:
-            if not line.strip().lower().startswith("remotedisplay.vnc"):
-                new_lines.append(line)
+        content = _VNC_LINE_RE.sub('', content)
+        if content and not content.endswith('\n'):
+            content += '\n'
         
         # Add new VNC config
-        new_lines.append('RemoteDisplay.vnc.enabled = "TRUE"\n')
-        new_lines.append(f'RemoteDisplay.vnc.port = "{port}"\n')
+        content += f'RemoteDisplay.vnc.enabled = "TRUE"\nRemoteDisplay.vnc.port = "{port}"\n'
         if password:
-            new_lines.append(f'RemoteDisplay.vnc.password = "{password}"\n')
+            content += f'RemoteDisplay.vnc.password = "{password}"\n'
             
-        with open(vmx_path, 'w') as f:
-            f.writelines(new_lines)
+        _write_vmx(vmx_path, content)
 
     def update_specs(self, vmx_path: str, cpu_count: int = None, memory_mb: int = None):
         """
@@ -307,20 +732,17 @@ class VMService:
             raise Exception("VMX file not found")
             
         with open(vmx_path, 'r') as f:
-            lines = f.readlines()
+            content = f.read()
             
-        new_lines = []
-        for line in lines:
-            key = line.split('=')[0].strip().lower()
-            if cpu_count and (key == "numvcpus" or key == "cpuid.corespersocket"):
-                continue # Skip existing CPU lines
-            if memory_mb and key == "memsize":
-                continue # Skip existing Memory lines
-            new_lines.append(line)
+        if cpu_count:
+            content = _CPU_LINE_RE.sub('', content) # Skip existing CPU lines
+        if memory_mb:
+            content = _MEM_LINE_RE.sub('', content) # Skip existing Memory lines
             
         # Ensure the last line ends with a newline
-        if new_lines and not new_lines[-1].endswith('\n'):
-            new_lines[-1] += '\n'
+        if content and not content.endswith('\n'):
+            content += '\n'
+        new_lines = [content]
 
         # Append new settings
         if cpu_count:
@@ -340,32 +762,55 @@ class VMService:
         new_lines.append('uuid.action = "keep"\n')
         new_lines.append('ui.microsem.mouse.tooltip = "FALSE"\n') # Disable annoying tooltips
             
-        with open(vmx_path, 'w') as f:
-            f.writelines(new_lines)
+        _write_vmx(vmx_path, ''.join(new_lines))
 
     def revert_to_snapshot(self, vmx_path: str, snapshot_name: str):
         """
         Reverts the VM to a named snapshot.
         """
-        return self._run_command("revertToSnapshot", vmx_path, [snapshot_name], timeout=120)
+        try:
+            return self._run_command("revertToSnapshot", vmx_path, [snapshot_name], timeout=120)
+        finally:
+            self.forget_vm(vmx_path)
 
-    def list_snapshots(self, vmx_path: str) -> list:
+    def list_snapshots(self, vmx_path: str, force: bool = False) -> list:
         """
         Lists all snapshots for a VM.
-        Returns a list of snapshot names.
+        Returns a list of snapshot names, reused for SNAPSHOT_TTL unless force=True.
         """
-        output = self._run_command("listSnapshots", vmx_path)
+        key, snapshots = self._cached(self._snapshot_cache, vmx_path, SNAPSHOT_TTL)
+        if snapshots is not None and not force:
+            return list(snapshots)
+        data = self._run_command("listSnapshots", vmx_path, raw=True)
         # Output format:
         # Total snapshots: 1
         # SnapshotName
-        lines = output.splitlines()
-        snapshots = []
-        if len(lines) > 1:
-            for line in lines[1:]:
-                name = line.strip()
-                if name:
-                    snapshots.append(name)
-        return snapshots
+        _, _, names = data.partition(b"\n")
+        snapshots = tuple(filter(None, map(str.strip, self._decode_output(names).splitlines())))
+        self._snapshot_cache[key] = (time.monotonic(), snapshots)
+        return list(snapshots)
+
+    def _batch(self, func, calls: list) -> list:
+        """Run func(*args) for each args tuple in parallel vmrun processes; None for a call that failed."""
+        def _call(args):
+            try:
+                return func(*args)
+            except Exception as e:
+                logger.warning(f"{func.__name__}{args[:1]} failed: {e}")
+                return None
+        if not calls:
+            return []
+        # Wall time is the slowest vmrun, not the sum of them
+        with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(calls))) as pool:
+            return list(pool.map(_call, calls))
+
+    def batch_list_snapshots(self, vmx_paths: list) -> dict:
+        """Snapshot names per VM path (None where vmrun failed)."""
+        return dict(zip(vmx_paths, self._batch(self.list_snapshots, [(p,) for p in vmx_paths])))
+
+    def batch_get_guest_ips(self, guests: list) -> dict:
+        """Guest IP per VM path, from (vmx_path, guest_user, guest_pass) tuples."""
+        return dict(zip((g[0] for g in guests), self._batch(self.get_guest_ip, guests)))
 
     def run_script_in_guest(self, vmx_path: str, username: str, password: str, script_text: str, interpreter: str = "powershell"):
         interp_path = "C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe"
@@ -373,6 +818,15 @@ class VMService:
              interp_path = "C:\\Windows\\System32\\cmd.exe"
         elif interpreter == "bash":
              interp_path = "/bin/bash"
+        else:
+            # PowerShell takes the script itself as base64 UTF-16LE on its command line: no guest
+            # temp file, and no quoting of the script text by vmrun or the guest's argv parser
+            encoded = base64.b64encode(script_text.encode("utf-16-le")).decode("ascii")
+            return self.run_program_in_guest(
+                vmx_path, username, password, interp_path,
+                ["-NoProfile", "-NonInteractive", "-EncodedCommand", encoded],
+                interactive=False
+            )
         
         return self._run_command(
             "runScriptInGuest",
@@ -410,21 +864,12 @@ class VMService:
 
         mac = None
         try:
-            with open(vmx_path, 'r') as f:
-                for line in f:
-                    line = line.strip().lower()
-                    # Check for exact matches on keys to avoid matching "ethernet0.addresstype"
-                    if line.startswith("ethernet0.generatedaddress") or line.startswith("ethernet0.address"):
-                         # Split by first =
-                        parts = line.split("=", 1)
-                        if len(parts) > 1:
-                            key = parts[0].strip()
-                            value = parts[1].strip().strip('"')
-                            
-                            # Double check the key to ensure it's not addressType
-                            if key == "ethernet0.generatedaddress" or key == "ethernet0.address":
-                                mac = value
-                                break 
+            # Exact keys only, so "ethernet0.addressType" never matches; the dict keeps
+            # file order, so whichever of the two comes first in the file wins
+            for key, value in parse_vmx(vmx_path).items():
+                if key in ("ethernet0.generatedaddress", "ethernet0.address"):
+                    mac = value.strip().lower()
+                    break
 
         except Exception as e:
             logger.error(f"Failed to read MAC from {vmx_path}: {e}")
@@ -445,65 +890,18 @@ class VMService:
         from app.services.dhcp_service import dhcp_service
         vm_name = os.path.splitext(os.path.basename(vmx_path))[0]
         dhcp_service.add_reservation(vm_name, mac, ip)
+        self.forget_vm(vmx_path, snapshots=False)
         
         # 3. Force Guest to Static IP (GUI Update via netsh)
-        # Only if VM is running
-        if self.is_running(vmx_path):
+        # Only if VM is running (fresh listing: a stale "running" would cost a guest-command timeout)
+        if self.is_running(vmx_path, ttl=0):
             logger.info("VM is running. Executing Guest-Side 'netsh' configuration for GUI persistence...")
             
             # Safe DNS handling
             dns1 = dns[0] if len(dns) > 0 else "8.8.8.8"
             dns2 = dns[1] if len(dns) > 1 else "1.1.1.1"
             
-            script = f"""
-            $ErrorActionPreference = 'Continue'
-            try {{
-                Start-Transcript -Path "C:\\Windows\\Temp\\static_ip_debug.log" -Append
-            }} catch {{
-                Write-Output "Could not start transcript"
-            }}
-            
-            $IP = "{ip}"
-            $Subnet = "{subnet}"
-            $Gateway = "{gateway}"
-            $DNS1 = "{dns1}"
-            $DNS2 = "{dns2}"
-            
-            Write-Output "Configuring Static IP: $IP"
-            
-            # 1. Find Adapter
-            $adapter = Get-NetAdapter | Where-Object {{ $_.Status -eq 'Up' }} | Select-Object -First 1
-            if (-not $adapter) {{ 
-                Write-Error "No active network adapter found"
-                exit 1
-            }}
-            $InterfaceName = $adapter.Name
-            
-            Write-Output "Adapter found: $InterfaceName"
-            
-            # 2. Configure via netsh (Legacy/Robust for GUI)
-            # We use netsh because it forces the GUI to update to 'Use the following IP address'
-            # which satisfies user verification.
-            
-            # Set IP/Subnet/Gateway
-            # netsh interface ip set address "Ethernet0" static 192.168.x.x ...
-            $netshCmd = 'netsh interface ip set address name="' + $InterfaceName + '" static ' + $IP + ' ' + $Subnet + ' ' + $Gateway
-            Write-Output "Executing: $netshCmd"
-            cmd /c $netshCmd
-            
-            # Set DNS 1
-            $dnsCmd1 = 'netsh interface ip set dns name="' + $InterfaceName + '" static ' + $DNS1
-            Write-Output "Executing: $dnsCmd1"
-            cmd /c $dnsCmd1
-            
-            # Set DNS 2
-            $dnsCmd2 = 'netsh interface ip add dns name="' + $InterfaceName + '" ' + $DNS2 + ' index=2'
-            Write-Output "Executing: $dnsCmd2"
-            cmd /c $dnsCmd2
-            
-            Write-Output "Configuration Complete"
-            Stop-Transcript
-            """
+            script = _STATIC_IP_PS.substitute(ip=ip, subnet=subnet, gateway=gateway, dns1=dns1, dns2=dns2)
             
             try:
                  # Run with elevated privileges (Administrator user is required)
@@ -0,0 +1,146 @@
+import asyncio
+import struct
+import zlib
+
+# Whole grab (connect, handshake, one full framebuffer update) before the caller falls back to vmrun
+GRAB_TIMEOUT_SECONDS = 5.0
+# Speed over size: the PNG is a throwaway preview tile
+PNG_COMPRESS_LEVEL = 1
+
+_RFB_VERSION = b"RFB 003.008\n"
+_SEC_NONE = 1
+_SEC_VNC_AUTH = 2
+# SetPixelFormat: 32 bpp, depth 24, little-endian true colour, 8 bits per channel at
+# shifts 16/8/0, so every pixel arrives as B, G, R, pad bytes
+_SET_PIXEL_FORMAT = struct.pack(">B3xBBBBHHHBBB3x", 0, 32, 24, 0, 1, 255, 255, 255, 16, 8, 0)
+# SetEncodings: Raw only, so no decoder is needed here
+_SET_ENCODINGS = struct.pack(">BxHi", 2, 1, 0)
+
+
+class VNCCaptureError(Exception):
+    pass
+
+
+def _vnc_auth_response(password: str, challenge: bytes) -> bytes:
+    """DES-encrypt the challenge with the password, each key byte bit-reversed (RFC 6143 7.2.2)."""
+    try:
+        from cryptography.hazmat.decrepit.ciphers.algorithms import TripleDES
+    except ImportError:
+        from cryptography.hazmat.primitives.ciphers.algorithms import TripleDES
+    from cryptography.hazmat.primitives.ciphers import Cipher, modes
+
+    key = bytes(int(f"{b:08b}"[::-1], 2) for b in password.encode("latin-1")[:8].ljust(8, b"\0"))
+    # A single 8-byte key makes TripleDES plain DES
+    encryptor = Cipher(TripleDES(key), modes.ECB()).encryptor()
+    return encryptor.update(challenge) + encryptor.finalize()
+
+
+async def _handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, password: str):
+    if not (await reader.readexactly(12)).startswith(b"RFB "):
+        raise VNCCaptureError("Not an RFB server")
+    writer.write(_RFB_VERSION)
+
+    count = (await reader.readexactly(1))[0]
+    if count == 0:
+        reason_len, = struct.unpack(">I", await reader.readexactly(4))
+        raise VNCCaptureError((await reader.readexactly(reason_len)).decode(errors="replace"))
+    types = await reader.readexactly(count)
+    if _SEC_NONE in types:
+        writer.write(bytes((_SEC_NONE,)))
+    elif _SEC_VNC_AUTH in types and password:
+        writer.write(bytes((_SEC_VNC_AUTH,)))
+        writer.write(_vnc_auth_response(password, await reader.readexactly(16)))
+    else:
+        raise VNCCaptureError(f"No usable security type in {list(types)}")
+    if struct.unpack(">I", await reader.readexactly(4))[0] != 0:
+        raise VNCCaptureError("VNC authentication failed")
+
+    # ClientInit shared=1: never disconnect a console the user has open
+    writer.write(b"\x01")
+    width, height = struct.unpack(">HH16x", await reader.readexactly(20))
+    name_len, = struct.unpack(">I", await reader.readexactly(4))
+    await reader.readexactly(name_len)
+    return width, height
+
+
+async def _read_framebuffer(reader: asyncio.StreamReader, width: int, height: int) -> bytearray:
+    """Read server messages until the first FramebufferUpdate; its Raw rects painted on a BGRX buffer."""
+    while True:
+        msg_type = (await reader.readexactly(1))[0]
+        if msg_type == 0:
+            break
+        if msg_type == 1:  # SetColourMapEntries (unused with true colour)
+            _, count = struct.unpack(">xHH", await reader.readexactly(5))
+            await reader.readexactly(count * 6)
+        elif msg_type == 2:  # Bell
+            continue
+        elif msg_type == 3:  # ServerCutText
+            length, = struct.unpack(">3xI", await reader.readexactly(7))
+            await reader.readexactly(length)
+        else:
+            raise VNCCaptureError(f"Unexpected RFB message {msg_type}")
+
+    frame = bytearray(width * height * 4)
+    stride = width * 4
+    rects, = struct.unpack(">xH", await reader.readexactly(3))
+    for _ in range(rects):
+        x, y, w, h, encoding = struct.unpack(">HHHHi", await reader.readexactly(12))
+        if encoding != 0:
+            raise VNCCaptureError(f"Unexpected encoding {encoding}")
+        data = await reader.readexactly(w * h * 4)
+        if x == 0 and w == width:
+            frame[y * stride:(y + h) * stride] = data
+            continue
+        row = w * 4
+        for r in range(h):
+            start = (y + r) * stride + x * 4
+            frame[start:start + row] = data[r * row:(r + 1) * row]
+    return frame
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+def encode_png(frame: bytes, width: int, height: int) -> bytes:
+    """8-bit RGB PNG from a BGRX framebuffer; channels are swizzled with slice assignment, not per pixel."""
+    rgb = bytearray(width * height * 3)
+    rgb[0::3] = frame[2::4]
+    rgb[1::3] = frame[1::4]
+    rgb[2::3] = frame[0::4]
+    stride = width * 3
+    # Filter type 0 (None) in front of every scanline
+    raw = b"".join(b"\0" + rgb[i:i + stride] for i in range(0, len(rgb), stride))
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)),
+        _png_chunk(b"IDAT", zlib.compress(raw, PNG_COMPRESS_LEVEL)),
+        _png_chunk(b"IEND", b""),
+    ))
+
+
+async def _grab(port: int, password: str) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        width, height = await _handshake(reader, writer, password)
+        writer.write(_SET_PIXEL_FORMAT + _SET_ENCODINGS)
+        # Non-incremental request for the whole screen
+        writer.write(struct.pack(">BBHHHH", 3, 0, 0, 0, width, height))
+        await writer.drain()
+        frame = await _read_framebuffer(reader, width, height)
+    finally:
+        writer.close()
+    # Swizzle + deflate of a full frame is CPU work; keep it off the event loop
+    return await asyncio.to_thread(encode_png, frame, width, height)
+
+
+async def grab_screen_png(port: int, password: str = None) -> bytes:
+    """
+    One PNG screenshot straight from the VM's VNC server (the one enable_vnc configures),
+    in memory, instead of vmrun captureScreen writing a file. Raises VNCCaptureError,
+    OSError or asyncio.TimeoutError when VNC isn't reachable; callers fall back to vmrun.
+    """
+    try:
+        return await asyncio.wait_for(_grab(port, password), GRAB_TIMEOUT_SECONDS)
+    except asyncio.IncompleteReadError as e:
+        raise VNCCaptureError("VNC server closed the connection") from e
@@ -0,0 +1,46 @@
+"""
+Precompress app/static for PrecompressedStaticFiles (app/core/static_files.py).
+
+Writes `<file>.br` (if the `brotli` package is installed) and `<file>.gz` next to
+every text asset, so the server never compresses at request time. Run after
+changing anything under app/static:
+
+    python compress_static.py
+"""
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app", "static")
+COMPRESSIBLE = (".css", ".js", ".html", ".svg", ".json", ".txt", ".map")
+
+
+def _write_if_stale(src: str, dst: str, data: bytes):
+    if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+        return
+    with open(dst, "wb") as f:
+        f.write(data)
+    print(f"  {os.path.relpath(dst, STATIC_DIR)}")
+
+
+def main():
+    if brotli is None:
+        print("brotli not installed — writing .gz only (pip install brotli for .br)")
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            if not name.lower().endswith(COMPRESSIBLE):
+                continue
+            src = os.path.join(root, name)
+            with open(src, "rb") as f:
+                raw = f.read()
+            _write_if_stale(src, src + ".gz", gzip.compress(raw, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write_if_stale(src, src + ".br", brotli.compress(raw, quality=11))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,9 +22,10 @@ FLUSH PRIVILEGES;
 
 -- ==========================================
 -- NOTE ON TABLES:
--- The Python application (FastAPI + SQLModel) automatically creates tables 
--- on startup if they don't exist.
--- However, for reference or manual recovery, here is the schema:
+-- Tables are created and upgraded with Alembic: run `alembic upgrade head`
+-- from the project root (see migrations/). The application no longer
+-- creates tables on startup.
+-- For reference or manual recovery, here is the schema:
 -- ==========================================
 
 USE vm_control;
@@ -48,8 +49,10 @@ CREATE TABLE IF NOT EXISTS vm (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
     vmx_path VARCHAR(512) NOT NULL UNIQUE,
+    vmx_path_normalized VARCHAR(512) NOT NULL DEFAULT '',
     owner_id INT,
     expiration_date DATETIME DEFAULT NULL,
+    last_notified_threshold INT DEFAULT NULL,
     
     -- RDP Settings
     rdp_ip VARCHAR(255) DEFAULT 'LocalHost',
@@ -70,9 +73,20 @@ CREATE TABLE IF NOT EXISTS vm (
     task_progress INT DEFAULT 0,
     task_message VARCHAR(255) DEFAULT NULL,
     
+    INDEX ix_vm_owner_id (owner_id),
+    INDEX ix_vm_vmx_path_normalized (vmx_path_normalized),
+    INDEX ix_vm_expiration_date_id (expiration_date, id, name, last_notified_threshold),
     FOREIGN KEY (owner_id) REFERENCES user(id)
 );
 
+-- Upgrading an existing install:
+-- ALTER TABLE vm ADD COLUMN last_notified_threshold INT DEFAULT NULL;
+-- CREATE INDEX ix_vm_expiration_date_id ON vm (expiration_date, id, name, last_notified_threshold);
+-- CREATE INDEX ix_vm_owner_id ON vm (owner_id);
+-- ALTER TABLE vm ADD COLUMN vmx_path_normalized VARCHAR(512) NOT NULL DEFAULT '';
+-- CREATE INDEX ix_vm_vmx_path_normalized ON vm (vmx_path_normalized);
+-- (`alembic upgrade head` adds and backfills this column for you)
+
 -- PortMapping Table
 -- Tracks network port forwarding rules associated with VMs.
 CREATE TABLE IF NOT EXISTS portmapping (
@@ -97,6 +111,12 @@ CREATE TABLE IF NOT EXISTS auditlog (
     vm_id INT DEFAULT NULL,
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
     details TEXT,
+    INDEX ix_auditlog_timestamp (timestamp),
+    INDEX ix_auditlog_vm_id_timestamp (vm_id, timestamp),
     FOREIGN KEY (user_id) REFERENCES user(id),
     FOREIGN KEY (vm_id) REFERENCES vm(id)
 );
+
+-- Upgrading an existing install:
+-- CREATE INDEX ix_auditlog_timestamp ON auditlog (timestamp);
+-- CREATE INDEX ix_auditlog_vm_id_timestamp ON auditlog (vm_id, timestamp);
@@ -0,0 +1,120 @@
+"""baseline schema
+
+Schema as previously created by SQLModel.metadata.create_all() at startup.
+Existing installs already have these tables: run `alembic stamp 0001_baseline`
+once, then `alembic upgrade head`.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_baseline"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("username", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+        sa.Column("hashed_password", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("role", sa.Enum("ADMIN", "USER", name="role"), nullable=False),
+        sa.Column("is_active", sa.Boolean(), nullable=False),
+        sa.Column("discord_webhook_url", sqlmodel.sql.sqltypes.AutoString(length=512), nullable=True),
+        sa.Column("discord_webhook_public", sqlmodel.sql.sqltypes.AutoString(length=512), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_user_username"), "user", ["username"], unique=True)
+
+    op.create_table(
+        "vm",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+        sa.Column("vmx_path", sqlmodel.sql.sqltypes.AutoString(length=512), nullable=False),
+        sa.Column("owner_id", sa.Integer(), nullable=True),
+        sa.Column("expiration_date", sa.DateTime(), nullable=True),
+        sa.Column("rdp_ip", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+        sa.Column("rdp_port", sa.Integer(), nullable=False),
+        sa.Column("rdp_username", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
+        sa.Column("internal_ip", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
+        sa.Column("guest_username", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
+        sa.Column("guest_password", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
+        sa.Column("vnc_port", sa.Integer(), nullable=True),
+        sa.Column("vnc_password", sqlmodel.sql.sqltypes.AutoString(length=8), nullable=True),
+        sa.Column("vnc_enabled", sa.Boolean(), nullable=False),
+        sa.Column("task_state", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("task_progress", sa.Integer(), nullable=False),
+        sa.Column("task_message", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.ForeignKeyConstraint(["owner_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("vmx_path"),
+    )
+
+    op.create_table(
+        "portmapping",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("protocol", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("host_port", sa.Integer(), nullable=False),
+        sa.Column("vm_id", sa.Integer(), nullable=True),
+        sa.Column("description", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
+        sa.ForeignKeyConstraint(["vm_id"], ["vm.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_portmapping_protocol"), "portmapping", ["protocol"], unique=False)
+    op.create_index(op.f("ix_portmapping_host_port"), "portmapping", ["host_port"], unique=False)
+
+    op.create_table(
+        "auditlog",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("action", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("vm_id", sa.Integer(), nullable=True),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+        sa.Column("details", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["vm_id"], ["vm.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    op.create_table(
+        "scheduledtask",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("vm_id", sa.Integer(), nullable=False),
+        sa.Column("created_by", sa.Integer(), nullable=False),
+        sa.Column("action", sa.Enum("START", "STOP", "RESTART", "SNAPSHOT", name="taskaction"), nullable=False),
+        sa.Column("snapshot_name", sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
+        sa.Column("run_at", sa.DateTime(), nullable=False),
+        sa.Column(
+            "status",
+            sa.Enum("PENDING", "RUNNING", "COMPLETED", "FAILED", "CANCELLED", name="taskstatus"),
+            nullable=False,
+        ),
+        sa.Column("result_message", sqlmodel.sql.sqltypes.AutoString(length=1024), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("executed_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["created_by"], ["user.id"]),
+        sa.ForeignKeyConstraint(["vm_id"], ["vm.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("scheduledtask")
+    op.drop_table("auditlog")
+    op.drop_index(op.f("ix_portmapping_host_port"), table_name="portmapping")
+    op.drop_index(op.f("ix_portmapping_protocol"), table_name="portmapping")
+    op.drop_table("portmapping")
+    op.drop_table("vm")
+    op.drop_index(op.f("ix_user_username"), table_name="user")
+    op.drop_table("user")
@@ -0,0 +1,32 @@
+"""vm expiration alert tracking and lookup indexes
+
+Adds vm.last_notified_threshold plus the expiration_date and owner_id indexes.
+
+Revision ID: 0002_vm_expiration_alerts
+Revises: 0001_baseline
+Create Date: 2026-10-15 00:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002_vm_expiration_alerts"
+down_revision: Union[str, None] = "0001_baseline"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("vm", sa.Column("last_notified_threshold", sa.Integer(), nullable=True))
+    op.create_index(op.f("ix_vm_expiration_date"), "vm", ["expiration_date"], unique=False)
+    op.create_index(op.f("ix_vm_owner_id"), "vm", ["owner_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_vm_owner_id"), table_name="vm")
+    op.drop_index(op.f("ix_vm_expiration_date"), table_name="vm")
+    op.drop_column("vm", "last_notified_threshold")
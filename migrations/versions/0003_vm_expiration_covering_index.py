@@ -0,0 +1,33 @@
+"""covering index for the daily expiration sweep
+
+Replaces ix_vm_expiration_date with (expiration_date, id, name,
+last_notified_threshold) so check_expiring_vms never reads the clustered row.
+
+Revision ID: 0003_vm_expiration_covering_index
+Revises: 0002_vm_expiration_alerts
+Create Date: 2026-10-15 00:00:02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_vm_expiration_covering_index"
+down_revision: Union[str, None] = "0002_vm_expiration_alerts"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_vm_expiration_date_id", "vm",
+        ["expiration_date", "id", "name", "last_notified_threshold"], unique=False,
+    )
+    op.drop_index("ix_vm_expiration_date", table_name="vm")
+
+
+def downgrade() -> None:
+    op.create_index("ix_vm_expiration_date", "vm", ["expiration_date"], unique=False)
+    op.drop_index("ix_vm_expiration_date_id", table_name="vm")
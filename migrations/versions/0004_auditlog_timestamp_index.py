@@ -0,0 +1,25 @@
+"""index auditlog.timestamp
+
+Revision ID: 0004_auditlog_timestamp_index
+Revises: 0003_vm_expiration_covering_index
+Create Date: 2026-10-15 00:00:03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_auditlog_timestamp_index"
+down_revision: Union[str, None] = "0003_vm_expiration_covering_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f("ix_auditlog_timestamp"), "auditlog", ["timestamp"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_auditlog_timestamp"), table_name="auditlog")
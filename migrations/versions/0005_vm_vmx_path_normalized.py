@@ -0,0 +1,43 @@
+"""vm.vmx_path_normalized
+
+Persists the normalized VMX path so the VM list can match running VMs with a
+set lookup instead of normalizing every row per request.
+
+Revision ID: 0005_vm_vmx_path_normalized
+Revises: 0004_auditlog_timestamp_index
+Create Date: 2026-10-15 00:00:04
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.models.vm import normalize_vmx_path
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005_vm_vmx_path_normalized"
+down_revision: Union[str, None] = "0004_auditlog_timestamp_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("vm", sa.Column("vmx_path_normalized", sa.String(length=512), nullable=False, server_default=""))
+    op.create_index(op.f("ix_vm_vmx_path_normalized"), "vm", ["vmx_path_normalized"], unique=False)
+
+    # One-shot backfill; normalization must match VMService.list_running_vms(), so do it in Python
+    vm = sa.table("vm", sa.column("id", sa.Integer), sa.column("vmx_path", sa.String), sa.column("vmx_path_normalized", sa.String))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(vm.c.id, vm.c.vmx_path)).all()
+    if rows:
+        bind.execute(
+            vm.update().where(vm.c.id == sa.bindparam("vm_id")).values(vmx_path_normalized=sa.bindparam("normalized")),
+            [{"vm_id": row.id, "normalized": normalize_vmx_path(row.vmx_path)} for row in rows],
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_vm_vmx_path_normalized"), table_name="vm")
+    op.drop_column("vm", "vmx_path_normalized")
@@ -0,0 +1,28 @@
+"""composite auditlog (vm_id, timestamp) index
+
+Revision ID: 0006_auditlog_vm_timestamp_index
+Revises: 0005_vm_vmx_path_normalized
+Create Date: 2026-10-15 00:00:05
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006_auditlog_vm_timestamp_index"
+down_revision: Union[str, None] = "0005_vm_vmx_path_normalized"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_auditlog_vm_id_timestamp", "auditlog", ["vm_id", "timestamp"], unique=False)
+
+
+def downgrade() -> None:
+    # MySQL drops its implicit FK index once the composite covers vm_id; put one
+    # back first or the foreign key refuses to let the composite go
+    op.create_index("ix_auditlog_vm_id", "auditlog", ["vm_id"], unique=False)
+    op.drop_index("ix_auditlog_vm_id_timestamp", table_name="auditlog")
@@ -0,0 +1,45 @@
+"""ensure vm VNC columns
+
+Installs stamped at 0001_baseline from a schema created before VNC support lack
+vm.vnc_port / vnc_password / vnc_enabled. Adds whichever are missing, reading the
+column list once through the inspector, so it is a no-op where they already exist.
+
+Revision ID: 0007_vm_vnc_columns
+Revises: 0006_auditlog_vm_timestamp_index
+Create Date: 2026-10-15 00:00:06
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007_vm_vnc_columns"
+down_revision: Union[str, None] = "0006_auditlog_vm_timestamp_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+VNC_COLUMNS = (
+    sa.Column("vnc_port", sa.Integer(), nullable=True),
+    sa.Column("vnc_password", sqlmodel.sql.sqltypes.AutoString(length=8), nullable=True),
+    sa.Column("vnc_enabled", sa.Boolean(), nullable=False, server_default=sa.false()),
+)
+
+
+def upgrade() -> None:
+    # --sql (offline) has no database to inspect; the baseline already declares these columns
+    if op.get_context().as_sql:
+        return
+    existing = {col["name"] for col in sa.inspect(op.get_bind()).get_columns("vm")}
+    for column in VNC_COLUMNS:
+        if column.name not in existing:
+            op.add_column("vm", column)
+
+
+def downgrade() -> None:
+    # The columns belong to 0001_baseline; nothing to undo here
+    pass
@@ -1,8 +1,21 @@
 import uvicorn
 
+try:
+    import uvloop  # noqa: F401 — not available on Windows
+    EVENT_LOOP = "uvloop"
+except ImportError:
+    EVENT_LOOP = "asyncio"
+
+try:
+    import httptools  # noqa: F401 — installed with uvicorn[standard]
+    HTTP_PARSER = "httptools"
+except ImportError:
+    HTTP_PARSER = "h11"
+
 if __name__ == "__main__":
     # Port 8000 is often occupied by system services on Windows.
     # Changed to 8081 to avoid WinError 10013.
     # Disable reload for stability in production-like testing
     # Port 8081 seems stuck, trying 8083
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8082, reload=False, log_level="debug")
+    # Single worker: the scheduler, job/audit queues and VM caches are per-process singletons
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8082, reload=False, log_level="info", loop=EVENT_LOOP, http=HTTP_PARSER)